@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'catalog.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -66,6 +69,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'catalog.context_processors.cart_items_count',
             ],
         },
     },
@@ -87,14 +91,124 @@ REST_FRAMEWORK = {
 WSGI_APPLICATION = 'bookstore.wsgi.application'
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bookstore',
+    },
+    # Фрагменты JSON книг (см. catalog/fragments.py): по записи на книгу,
+    # поэтому отдельный кэш, чтобы они не вытесняли версии, бейджи и блоки
+    # главной страницы из 'default'
+    'book_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'book-fragments',
+        'OPTIONS': {
+            # С запасом на весь каталог; при переполнении удаляется десятая часть
+            'MAX_ENTRIES': 50000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+# Бейдж корзины кэшируется на пользователя и сбрасывается при изменении корзины
+CART_BADGE_CACHE = 'default'
+CART_BADGE_TIMEOUT = 60 * 60
+
+# Кэш фрагментов JSON книг
+BOOK_FRAGMENT_CACHE = 'book_fragments'
+BOOK_FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+# Блоки главной страницы; популярные книги пересчитывает команда
+# refresh_popular_books, ее нужно запускать по cron раз в интервал. С LocMemCache
+# кэш у каждого процесса свой, и список считается в запросе при промахе
+HOME_CACHE_TIMEOUT = 5 * 60
+HOME_POPULAR_REFRESH_INTERVAL = 5 * 60
+
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Профиль базы задается переменными окружения:
+#   DB_ENGINE=sqlite (по умолчанию) или postgresql;
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT - параметры PostgreSQL;
+#   DB_CONN_MAX_AGE - сколько секунд держать постоянное соединение;
+#   DB_POOLER=pgbouncer - соединения идут через PgBouncer в режиме transaction.
+# Тесты на PostgreSQL: DB_ENGINE=postgresql python manage.py test catalog
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+# Постоянное соединение живет между запросами; 0 - закрывать после каждого запроса
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'postgresql':
+    # Драйвер psycopg указан в requirements.txt. В Django 4.2 нет своего пула
+    # соединений: процесс держит одно постоянное соединение (CONN_MAX_AGE),
+    # а общий пул для всех процессов дает PgBouncer
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'bookstore'),
+            'USER': os.environ.get('DB_USER', 'bookstore'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # Перед повторным использованием соединение проверяется
+            'CONN_HEALTH_CHECKS': True,
+            # PgBouncer в режиме transaction не сохраняет серверные курсоры между транзакциями
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER') == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': 5,
+                # Подготовленные выражения psycopg привязаны к серверному
+                # соединению, а PgBouncer в режиме transaction его подменяет
+                'prepare_threshold': None if os.environ.get('DB_POOLER') == 'pgbouncer' else 5,
+            },
+        }
+    }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            # PRAGMA из catalog/db.py выполняются один раз на соединение
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        }
     }
+else:
+    raise ImproperlyConfigured(f'Неизвестный DB_ENGINE: {DB_ENGINE}')
+
+# Реплики для чтения каталога: DB_REPLICAS - через запятую пути к файлам SQLite
+# или хосты PostgreSQL. В тестах реплики зеркалируют основную базу, но данные
+# TestCase не видны через соединение реплики, поэтому тесты запускаются без DB_REPLICAS.
+DATABASE_REPLICAS = []
+for index, replica_name in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    replica['HOST' if DB_ENGINE == 'postgresql' else 'NAME'] = replica_name.strip()
+    DATABASES[f'replica{index}'] = replica
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['catalog.routers.ReplicaRouter']
+
+# Сколько секунд после изменения пользователь читает из основной базы
+REPLICA_PIN_SECONDS = 10
+# Эти разделы всегда работают с основной базой
+PRIMARY_DB_PATHS = [
+    '/cart/', '/checkout/', '/orders/', '/order/', '/profile/', '/admin/',
+    '/api/cart/', '/api/orders/',
+]
+
+# PRAGMA для каждого нового соединения SQLite (см. catalog/db.py)
+SQLITE_PRAGMAS = {
+    # Читатели не блокируют писателя и наоборот
+    'journal_mode': 'WAL',
+    # В режиме WAL безопасно и заметно быстрее FULL
+    'synchronous': 'NORMAL',
+    # Сколько миллисекунд ждать снятия блокировки записи
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'foreign_keys': 'ON',
 }
 
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookstore.settings')
 
 application = get_wsgi_application()
+
+# Индекс подсказок строится при старте процесса, а не на первом запросе
+from catalog.suggest import index  # noqa: E402
+
+index.warm_up()
@@ -0,0 +1,149 @@
+"""Кэширование производных данных каталога."""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+# Бейдж корзины: количество товаров в корзине пользователя
+CART_BADGE_CACHE = getattr(settings, 'CART_BADGE_CACHE', 'default')
+CART_BADGE_TIMEOUT = getattr(settings, 'CART_BADGE_TIMEOUT', 60 * 60)
+
+
+def cart_badge_key(user_id):
+    return f'cart_badge:{user_id}'
+
+
+def get_cart_badge(user_id):
+    """Возвращает количество товаров в корзине, обращаясь к БД только при промахе кэша"""
+    from .models import Cart
+
+    cache = caches[CART_BADGE_CACHE]
+    key = cart_badge_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Cart.objects.filter(user_id=user_id).values_list('item_count', flat=True).first() or 0
+        cache.set(key, count, CART_BADGE_TIMEOUT)
+    return count
+
+
+def invalidate_cart_badge(*user_ids):
+    """Сбрасывает бейдж после фиксации транзакции, чтобы не закэшировать старое значение"""
+    keys = [cart_badge_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: caches[CART_BADGE_CACHE].delete_many(keys))
+
+
+# Версии данных каталога. Ключи кэша включают версии тех сущностей, от
+# которых зависят данные, поэтому для инвалидации достаточно увеличить версию.
+# Источник истины - таблица CatalogVersion, в кэше лежит ее копия, поэтому
+# версия не откатывается после очистки кэша или перезапуска.
+VERSION_CACHE = getattr(settings, 'CATALOG_VERSION_CACHE', 'default')
+# Копия версии в кэше перечитывается из БД не реже, чем раз в это время
+VERSION_TIMEOUT = getattr(settings, 'CATALOG_VERSION_TIMEOUT', 5 * 60)
+NAMESPACES = ('book', 'author', 'category', 'publisher', 'recommendation', 'suggest', 'search', 'home')
+
+
+def _version_key(namespace):
+    return f'version:{namespace}'
+
+
+def get_versions(*namespaces):
+    from .models import CatalogVersion
+
+    cache = caches[VERSION_CACHE]
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys)
+    missing = [namespace for key, namespace in keys.items() if key not in found]
+    if missing:
+        stored = dict(
+            CatalogVersion.objects.filter(namespace__in=missing).values_list('namespace', 'version')
+        )
+        loaded = {_version_key(namespace): stored.get(namespace, 0) for namespace in missing}
+        cache.set_many(loaded, VERSION_TIMEOUT)
+        found.update(loaded)
+    return {namespace: found[key] for key, namespace in keys.items()}
+
+
+def bump_version(*namespaces):
+    """Увеличивает версии после фиксации транзакции и сбрасывает их копии в кэше.
+
+    UPDATE выполняется в on_commit, то есть в режиме autocommit: строка
+    версии блокируется на время одного UPDATE, а не всей транзакции
+    вызывающего кода (например, оформления заказа). До фиксации новые
+    данные никому не видны, поэтому и версию раньше увеличивать незачем.
+    """
+    from .models import CatalogVersion
+
+    def apply():
+        updated = CatalogVersion.objects.filter(namespace__in=namespaces).update(version=F('version') + 1)
+        if updated < len(set(namespaces)):
+            # Строки еще нет - версия начинается с 1
+            for namespace in namespaces:
+                CatalogVersion.objects.get_or_create(namespace=namespace, defaults={'version': 1})
+        caches[VERSION_CACHE].delete_many([_version_key(namespace) for namespace in namespaces])
+
+    transaction.on_commit(apply)
+
+
+def versioned_key(name, *namespaces):
+    versions = get_versions(*namespaces)
+    return ':'.join([name] + [f'{namespace}{versions[namespace]}' for namespace in namespaces])
+
+
+# Главная страница. Блоки не зависят от остатков и продаж, поэтому ключи
+# версионируются сущностью 'home': ее увеличивают правки книг (signals.py)
+# и импорт, но не оформление заказов
+HOME_CACHE = getattr(settings, 'HOME_CACHE', 'default')
+# Остатки на главной могут отставать не больше чем на это время
+HOME_CACHE_TIMEOUT = getattr(settings, 'HOME_CACHE_TIMEOUT', 5 * 60)
+# Популярные книги пересчитывает команда refresh_popular_books (по cron
+# с этим интервалом). Если списка в кэше нет, он считается в запросе
+POPULAR_REFRESH_INTERVAL = getattr(settings, 'HOME_POPULAR_REFRESH_INTERVAL', 5 * 60)
+
+
+def _cached_block(key, build, timeout=HOME_CACHE_TIMEOUT):
+    cache = caches[HOME_CACHE]
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout)
+    return value
+
+
+def get_new_books():
+    from .models import Book
+
+    return _cached_block(
+        versioned_key('home:new_books', 'home', 'author'),
+        lambda: list(Book.objects.select_related('author').order_by('-created_at')[:8]),
+    )
+
+
+def get_home_categories():
+    from .models import Category
+
+    return _cached_block(
+        versioned_key('home:categories', 'category'),
+        lambda: list(Category.objects.all()),
+    )
+
+
+def _popular_books_key():
+    return versioned_key('home:popular', 'home', 'author')
+
+
+def _build_popular_books():
+    from .models import Book
+
+    return list(Book.objects.select_related('author').order_by('-order_count')[:8])
+
+
+def get_popular_books():
+    return _cached_block(_popular_books_key(), _build_popular_books, POPULAR_REFRESH_INTERVAL)
+
+
+def refresh_popular_books():
+    """Пересчитывает популярные книги вне запросов (команда refresh_popular_books)"""
+    books = _build_popular_books()
+    # Запас в два интервала, чтобы список не истекал между запусками команды
+    caches[HOME_CACHE].set(_popular_books_key(), books, 2 * POPULAR_REFRESH_INTERVAL)
+    return books
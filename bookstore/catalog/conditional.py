@@ -0,0 +1,70 @@
+"""Условные GET-запросы (ETag) для страниц и API каталога.
+
+ETag собирается из версий данных каталога (см. cache.get_versions), поэтому
+для проверки не нужно загружать строки: если версии не изменились, клиент
+получает 304 без запросов к таблицам, рендера шаблона и сериализации.
+
+Last-Modified не отдается: версии - это счетчики, а updated_at книги не
+меняется при правке автора или категорий, которые входят в ответ.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .cache import get_cart_badge, get_versions
+
+
+def catalog_etag(namespaces, *extra):
+    versions = get_versions(*namespaces)
+    parts = [f'{namespace}{versions[namespace]}' for namespace in namespaces]
+    parts.extend(str(part) for part in extra)
+    return '"%s"' % hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+
+def catalog_condition(*namespaces):
+    """ETag для HTML-страницы каталога.
+
+    В шапке страницы есть имя пользователя и бейдж корзины, а в формах -
+    CSRF-токен, поэтому они тоже входят в ETag. Пока в сессии есть
+    неотображенные сообщения, страница отдается без ETag: закэшированная
+    копия их не содержит.
+    """
+    def etag_func(request, *args, **kwargs):
+        if len(get_messages(request)):
+            return None
+        # get_token создает секрет, если cookie еще нет; токены в формах
+        # с тем же секретом остаются действительными
+        get_token(request)
+        extra = [request.META['CSRF_COOKIE']]
+        user = request.user
+        if user.is_authenticated:
+            extra.extend([user.pk, get_cart_badge(user.pk)])
+        return catalog_etag(namespaces, *extra)
+
+    return condition(etag_func=etag_func)
+
+
+class ConditionalGetMixin:
+    """ETag для GET-запросов API: версии etag_namespaces и формат ответа"""
+    etag_namespaces = ('book', 'author', 'category', 'publisher')
+
+    def get_etag(self, request):
+        extra = [request.accepted_media_type]
+        if request.accepted_renderer.format == 'api':
+            # В браузерной версии API показывается текущий пользователь
+            extra.append(request.user.pk)
+        return catalog_etag(self.etag_namespaces, *extra)
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is None:
+            response = super().get(request, *args, **kwargs)
+        else:
+            response = not_modified
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        return response
@@ -1,10 +1,13 @@
-from .models import Cart
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_cart_badge
+
 
 def cart_items_count(request):
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            return {'cart_items_count': cart.total_items}
-        except Cart.DoesNotExist:
-            return {'cart_items_count': 0}
-    return {'cart_items_count': 0}
\ No newline at end of file
+    # Значение вычисляется только если шаблон действительно выводит бейдж
+    def count():
+        if request.user.is_authenticated:
+            return get_cart_badge(request.user.pk)
+        return 0
+
+    return {'cart_items_count': SimpleLazyObject(count)}
@@ -0,0 +1,124 @@
+"""Рекомендации «с этой книгой покупают».
+
+Офлайн-расчет (команда build_co_purchases) читает позиции заказов
+порциями, для каждой порции строит разреженную матрицу заказ x книга и
+накапливает матрицу совместных покупок книга x книга как X.T @ X. Память
+ограничена размером порции и числом ненулевых пар книг.
+
+Вес пары - косинусная мера: число совместных заказов, деленное на
+sqrt(заказы книги A * заказы книги B). Для каждой книги сохраняются
+top_k соседей в CoPurchase, витрина читает только эту таблицу.
+
+Для расчета нужны numpy и scipy; для чтения рекомендаций они не нужны.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .cache import bump_version
+from .models import Book, CoPurchase, OrderItem
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+TOP_K = getattr(settings, 'CO_PURCHASE_TOP_K', 10)
+# Пары, купленные вместе реже, считаются случайными
+MIN_ORDERS = getattr(settings, 'CO_PURCHASE_MIN_ORDERS', 2)
+CHUNK_SIZE = 100_000
+
+
+def also_bought(book, limit=4):
+    return (
+        Book.objects.filter(bought_with__book=book)
+        .select_related('author').order_by('-bought_with__score')[:limit]
+    )
+
+
+def iter_order_lines(chunk_size=CHUNK_SIZE):
+    """Порции (order_ids, book_ids) позиций заказов; заказ не делится между порциями"""
+    last_order = 0
+    while True:
+        lines = list(
+            OrderItem.objects.filter(order_id__gt=last_order).order_by('order_id')
+            .values_list('order_id', 'book_id')[:chunk_size]
+        )
+        if not lines:
+            return
+        if len(lines) == chunk_size:
+            # Последний заказ мог не поместиться в порцию целиком
+            tail = lines[-1][0]
+            complete = [line for line in lines if line[0] != tail]
+            if complete:
+                lines = complete
+            else:
+                lines = list(OrderItem.objects.filter(order_id=tail).values_list('order_id', 'book_id'))
+        last_order = lines[-1][0]
+        order_ids, book_ids = np.array(lines, dtype=np.int64).T
+        yield order_ids, book_ids
+
+
+def co_occurrence(book_ids, chunk_size=CHUNK_SIZE):
+    """Разреженная матрица совместных покупок; на диагонали - число заказов книги"""
+    size = len(book_ids)
+    counts = sparse.csr_matrix((size, size), dtype=np.int64)
+    for order_ids, line_books in iter_order_lines(chunk_size):
+        # Книги, созданные после снимка book_ids, в матрицу не попадают
+        known = np.isin(line_books, book_ids)
+        order_ids, line_books = order_ids[known], line_books[known]
+        if not len(line_books):
+            continue
+        orders, rows = np.unique(order_ids, return_inverse=True)
+        columns = np.searchsorted(book_ids, line_books)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int64), (rows, columns)),
+            shape=(len(orders), size),
+        )
+        # Несколько строк одной книги в заказе считаются одной покупкой
+        matrix.data[:] = 1
+        counts = counts + (matrix.T @ matrix).tocsr()
+    return counts
+
+
+def top_neighbours(counts, top_k=TOP_K, min_orders=MIN_ORDERS):
+    """Массивы (книга, сосед, вес, заказы) с top_k соседями каждой книги"""
+    orders_per_book = counts.diagonal().astype(np.float64)
+    pairs = counts.tocoo()
+    keep = (pairs.row != pairs.col) & (pairs.data >= min_orders)
+    rows, columns, together = pairs.row[keep], pairs.col[keep], pairs.data[keep]
+    scores = together / np.sqrt(orders_per_book[rows] * orders_per_book[columns])
+
+    # Сортировка по книге и убыванию веса, затем номер соседа внутри книги
+    order = np.lexsort((columns, -scores, rows))
+    rows, columns, scores, together = rows[order], columns[order], scores[order], together[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < top_k
+    return rows[keep], columns[keep], scores[keep], together[keep]
+
+
+def rebuild(top_k=TOP_K, min_orders=MIN_ORDERS, chunk_size=CHUNK_SIZE, batch_size=5000):
+    """Пересчитывает CoPurchase целиком, возвращает число сохраненных пар"""
+    if np is None:
+        raise ImproperlyConfigured('Для расчета совместных покупок нужны numpy и scipy')
+
+    book_ids = np.fromiter(Book.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+    counts = co_occurrence(book_ids, chunk_size)
+    rows, columns, scores, together = top_neighbours(counts, top_k, min_orders)
+
+    with transaction.atomic():
+        CoPurchase.objects.all().delete()
+        for start in range(0, len(rows), batch_size):
+            end = start + batch_size
+            CoPurchase.objects.bulk_create([
+                CoPurchase(book_id=book, related_id=related, score=score, orders=orders)
+                for book, related, score, orders in zip(
+                    book_ids[rows[start:end]].tolist(),
+                    book_ids[columns[start:end]].tolist(),
+                    scores[start:end].tolist(),
+                    together[start:end].tolist(),
+                )
+            ])
+    bump_version('recommendation')
+    return len(rows)
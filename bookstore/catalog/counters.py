@@ -0,0 +1,49 @@
+"""Денормализованные счетчики книг у категорий, авторов и издательств.
+
+books_count пересчитывается из сигналов (см. signals.py) только для
+затронутых строк: при сохранении и удалении книги и при изменении ее
+категорий. Счетчик именно пересчитывается, а не сдвигается на +1/-1:
+m2m_changed при remove() передает запрошенные id, а не реально удаленные.
+Массовые изменения в обход сигналов (bulk_create, update) после себя
+вызывают recount_all().
+
+Если счетчик действительно изменился, увеличивается версия самой сущности
+('category', 'author' или 'publisher'): ответы со счетчиками зависят только
+от нее, а не от версии 'book', которую сбрасывает каждый заказ.
+"""
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .cache import bump_version
+from .models import Author, Book, Category, Publisher
+
+
+def count_subquery(model):
+    """Количество книг для строки model (Category, Author или Publisher)"""
+    if model._meta.model_name == 'category':
+        rows = Book.categories.through.objects.filter(category=OuterRef('pk')).values('category')
+    else:
+        rows = Book.objects.filter(**{model._meta.model_name: OuterRef('pk')}).values(model._meta.model_name)
+    return Coalesce(Subquery(rows.annotate(count=Count('pk')).values('count')), Value(0))
+
+
+def _recount(queryset):
+    count = count_subquery(queryset.model)
+    # Обновляются только строки, у которых счетчик разошелся
+    updated = queryset.exclude(books_count=count).update(books_count=count)
+    if updated:
+        bump_version(queryset.model._meta.model_name)
+    return updated
+
+
+def recount(model, pks):
+    """Пересчитывает books_count у строк model с указанными id"""
+    pks = {pk for pk in pks if pk is not None}
+    if not pks:
+        return 0
+    return _recount(model.objects.filter(pk__in=pks))
+
+
+def recount_all():
+    """Пересчитывает счетчики всех категорий, авторов и издательств"""
+    return sum(_recount(model.objects.all()) for model in (Category, Author, Publisher))
@@ -43,6 +43,14 @@ class PublisherForm(forms.ModelForm):
             'address': forms.Textarea(attrs={'rows': 3}),
         }
 
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(label='Файл каталога')
+    format = forms.ChoiceField(
+        label='Формат',
+        choices=[('', 'По расширению файла'), ('csv', 'CSV'), ('json', 'JSON / JSON Lines'), ('onix', 'ONIX 3.0')],
+        required=False,
+    )
+
 # forms.py
 class OrderForm(forms.Form):
     shipping_address = forms.CharField(
@@ -0,0 +1,122 @@
+"""Кэш сериализованных книг в виде готовых JSON-фрагментов.
+
+Представление книги кодируется в JSON один раз и хранится в кэше под
+ключом из id книги, updated_at и версий авторов и категорий (их данные
+входят в ответ). Списки собираются из фрагментов: FragmentJSONRenderer
+вставляет байты фрагментов в ответ как есть, не декодируя их обратно.
+updated_at меняется при сохранении книги, списании остатков и изменении
+ее категорий (см. signals.py).
+
+Книги могут быть объектами Book или строками .values() для ValuesSerializer:
+ответы обоих сериализаторов совпадают, поэтому фрагменты у них общие.
+Набор полей из ?fields= и ?expand= входит в ключ.
+"""
+import hashlib
+import re
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .cache import get_versions
+from .serializers import ValuesSerializer, selection_params
+
+FRAGMENT_CACHE = getattr(settings, 'BOOK_FRAGMENT_CACHE', 'default')
+FRAGMENT_TIMEOUT = getattr(settings, 'BOOK_FRAGMENT_TIMEOUT', 24 * 60 * 60)
+
+
+class JSONFragment(bytes):
+    """Уже закодированный JSON-объект"""
+
+
+def _fragment_key_prefix(serializer_class, context):
+    versions = get_versions('author', 'category', 'publisher')
+    request = context.get('request')
+    # Ссылки на обложки абсолютные, если в контексте есть запрос
+    base = request.build_absolute_uri('/') if request is not None else ''
+    name = getattr(serializer_class, 'model_serializer', serializer_class).__name__
+    prefix = f"fragment:{name}:a{versions['author']}:c{versions['category']}:p{versions['publisher']}:{base}"
+    fields, expand = selection_params(request)
+    if fields is not None or expand is not None:
+        prefix += ':' + hashlib.md5(f'{fields}|{expand}'.encode()).hexdigest()
+    return prefix
+
+
+def _book_version(book):
+    if isinstance(book, dict):
+        return book['id'], book['updated_at']
+    return book.pk, book.updated_at
+
+
+def serialize_books(books, serializer_class, context=None):
+    """Список JSONFragment для книг; сериализуются только промахи кэша"""
+    context = context or {}
+    books = list(books)
+    prefix = _fragment_key_prefix(serializer_class, context)
+    keys = [f'{prefix}:{pk}:{updated_at.timestamp()}' for pk, updated_at in map(_book_version, books)]
+    cache = caches[FRAGMENT_CACHE]
+    found = cache.get_many(keys)
+
+    missing = {key: book for key, book in zip(keys, books) if key not in found}
+    if missing:
+        renderer = JSONRenderer()
+        if issubclass(serializer_class, ValuesSerializer):
+            data = serializer_class(context=context).serialize(missing.values())
+        else:
+            data = serializer_class(list(missing.values()), many=True, context=context).data
+        fresh = {key: renderer.render(item) for key, item in zip(missing, data)}
+        cache.set_many(fresh, FRAGMENT_TIMEOUT)
+        found.update(fresh)
+    return [JSONFragment(found[key]) for key in keys]
+
+
+class FragmentJSONRenderer(JSONRenderer):
+    """JSONRenderer, который вставляет JSONFragment в ответ без перекодирования"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        fragments = []
+        # Метка с случайной частью не может совпасть с текстом из данных
+        marker = f'@fragment-{secrets.token_hex(8)}-'
+        data = self._mark(data, marker, fragments)
+        content = super().render(data, accepted_media_type, renderer_context)
+        if not fragments:
+            return content
+        pattern = re.compile(rb'"' + re.escape(marker.encode()) + rb'(\d+)"')
+        return pattern.sub(lambda match: fragments[int(match.group(1))], content)
+
+    def _mark(self, data, marker, fragments):
+        if isinstance(data, JSONFragment):
+            fragments.append(bytes(data))
+            return f'{marker}{len(fragments) - 1}'
+        if isinstance(data, dict):
+            return {key: self._mark(value, marker, fragments) for key, value in data.items()}
+        if isinstance(data, (list, tuple)):
+            return [self._mark(value, marker, fragments) for value in data]
+        return data
+
+
+class FragmentListMixin:
+    """list() для представлений книг через кэш фрагментов.
+
+    Если задан values_serializer_class, страница выбирается строками
+    .values(), и промахи кэша сериализуются без создания объектов Book.
+    Используется вместе с views.QueryPlanMixin (get_required_columns).
+    """
+    values_serializer_class = None
+    # updated_at входит в ключ фрагмента
+    required_columns = ('updated_at',)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer_class = self.values_serializer_class or self.get_serializer_class()
+        if self.values_serializer_class is not None:
+            serializer = serializer_class(context=self.get_serializer_context())
+            queryset = serializer.setup_queryset(queryset, self.get_required_columns())
+        page = self.paginate_queryset(queryset)
+        books = page if page is not None else queryset
+        data = serialize_books(books, serializer_class, self.get_serializer_context())
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
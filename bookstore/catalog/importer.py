@@ -0,0 +1,484 @@
+"""Массовый импорт каталога из CSV, JSON и ONIX 3.0.
+
+Файл читается потоково: read_csv(), read_json() и read_onix() - генераторы,
+которые отдают по одной записи, поэтому память не растет с размером файла.
+CatalogImporter пишет книги пачками по batch_size записей:
+
+- авторы, издательства и категории ищутся по словарям в памяти, которые
+  загружаются из базы один раз, недостающие создаются одним bulk_create
+  на пачку;
+- книги вставляются или обновляются по ISBN одним
+  bulk_create(update_conflicts=True); slug и created_at у существующих
+  книг не меняются, занятый другой книгой slug новой книги дополняется
+  ISBN (см. _assign_slugs);
+- категории книги заменяются категориями из записи, если они в ней есть.
+
+bulk_create не вызывает сигналы Book, поэтому поисковый индекс обновляется
+после каждой пачки, а счетчики книг и версии кэша (в том числе версия
+подсказок, по которой их перестраивают все процессы) - один раз в finish(). Фрагменты книг (см. fragments.py) сбрасываются сами:
+bulk_create проставляет updated_at.
+"""
+import csv
+import io
+import json
+import re
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+
+from . import counters, search
+from .cache import bump_version
+from .models import Author, Book, Cart, Category, Publisher
+
+FORMATS = ('csv', 'json', 'onix')
+EXTENSIONS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'json', '.xml': 'onix', '.onix': 'onix'}
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 1 << 16
+# Сколько ошибок в записях хранить для отчета
+MAX_ERRORS = 100
+
+# Колонки книги, которые перезаписываются у существующих книг
+UPDATE_FIELDS = ['title', 'author', 'publisher', 'description', 'price', 'stock_quantity', 'search_key', 'updated_at']
+
+# DecimalField(max_digits=10, decimal_places=2)
+MAX_PRICE = Decimal('1e8')
+
+CATEGORY_SEPARATORS = re.compile(r'[;|]')
+ISBN_JUNK = re.compile(r'[\s-]')
+
+
+class CatalogImportError(Exception):
+    """Файл нельзя импортировать"""
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+    # [(номер записи, сообщение)], не больше MAX_ERRORS
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def detect_format(filename):
+    for extension, name in EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return name
+    raise CatalogImportError(f'Не удалось определить формат файла {filename}, укажите его явно')
+
+
+def read_records(stream, format):
+    """Записи файла в указанном формате; stream открыт в двоичном режиме"""
+    if format == 'onix':
+        return read_onix(stream)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        return read_csv(text)
+    if format == 'json':
+        return read_json(text)
+    raise CatalogImportError(f'Неизвестный формат: {format}')
+
+
+def read_csv(stream):
+    """Строки CSV с заголовком; названия колонок без учета регистра"""
+    reader = csv.DictReader(stream)
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    yield from reader
+
+
+def read_json(stream):
+    """Объекты из JSON-массива или из JSON Lines (по объекту на строку).
+
+    Файл разбирается кусками по CHUNK_SIZE: в памяти остается только
+    текущий объект, а не весь массив.
+    """
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    buffer = ''
+    position = 0
+    in_array = None
+    eof = False
+    while True:
+        # Пропускаем пробелы и запятые между элементами
+        while True:
+            while position < len(buffer) and (buffer[position].isspace() or (in_array and buffer[position] == ',')):
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            chunk = stream.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+        if position >= len(buffer):
+            if in_array:
+                raise CatalogImportError('JSON: массив не закрыт')
+            return
+        if in_array is None:
+            in_array = buffer[position] == '['
+            if in_array:
+                position += 1
+            continue
+        if in_array and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as exc:
+            if eof:
+                raise CatalogImportError(f'JSON: {exc}')
+            # Объект обрезан концом куска, дочитываем файл
+            chunk = stream.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        position = end
+        yield item
+
+
+def read_onix(stream):
+    """Записи из <Product> файла ONIX 3.0 (теги в полной форме).
+
+    Каждый разобранный Product удаляется из дерева, чтобы оно не росло.
+    """
+    root = None
+    try:
+        for event, element in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+            # Без пространства имен: <onix:Product> и <Product> читаются одинаково
+            element.tag = element.tag.rpartition('}')[2]
+            if element.tag == 'Product':
+                yield _onix_record(element)
+                root.clear()
+    except ET.ParseError as exc:
+        raise CatalogImportError(f'ONIX: {exc}')
+
+
+def _onix_text(element, path):
+    found = element.find(path)
+    return ''.join(found.itertext()).strip() if found is not None else ''
+
+
+def _onix_record(product):
+    record = {
+        'title': _onix_text(product, 'DescriptiveDetail/TitleDetail/TitleElement/TitleText')
+        or ' '.join(filter(None, [
+            _onix_text(product, 'DescriptiveDetail/TitleDetail/TitleElement/TitlePrefix'),
+            _onix_text(product, 'DescriptiveDetail/TitleDetail/TitleElement/TitleWithoutPrefix'),
+        ])),
+        'publisher': _onix_text(product, 'PublishingDetail/Publisher/PublisherName'),
+        'categories': [
+            ''.join(subject.itertext()).strip()
+            for subject in product.iterfind('DescriptiveDetail/Subject/SubjectHeadingText')
+        ],
+        'price': _onix_text(product, 'ProductSupply/SupplyDetail/Price/PriceAmount'),
+        'stock_quantity': _onix_text(product, 'ProductSupply/SupplyDetail/Stock/OnHand'),
+    }
+    for identifier in product.iterfind('ProductIdentifier'):
+        # 15 - ISBN-13, 02 - ISBN-10
+        if _onix_text(identifier, 'ProductIDType') in ('15', '02'):
+            record['isbn'] = _onix_text(identifier, 'IDValue')
+            break
+    for contributor in product.iterfind('DescriptiveDetail/Contributor'):
+        if _onix_text(contributor, 'ContributorRole') == 'A01':
+            if contributor.find('KeyNames') is not None:
+                record['author_first_name'] = _onix_text(contributor, 'NamesBeforeKey')
+                record['author_last_name'] = _onix_text(contributor, 'KeyNames')
+            else:
+                record['author'] = _onix_text(contributor, 'PersonName')
+            break
+    for text in product.iterfind('CollateralDetail/TextContent'):
+        # 03 - описание, 02 - краткое описание
+        if _onix_text(text, 'TextType') in ('03', '02'):
+            record['description'] = _onix_text(text, 'Text')
+            break
+    return record
+
+
+def normalize_isbn(value):
+    """ISBN-13 без дефисов; ISBN-10 переводится в ISBN-13"""
+    isbn = ISBN_JUNK.sub('', str(value or '')).upper()
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        isbn = '978' + isbn[:9]
+        total = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(isbn))
+        return isbn + str(-total % 10)
+    if len(isbn) == 13 and isbn.isdigit():
+        return isbn
+    raise ValueError(f'некорректный ISBN: {value!r}')
+
+
+def split_name(full_name):
+    """'Лев Николаевич Толстой' -> ('Лев Николаевич', 'Толстой')"""
+    first_name, _, last_name = ' '.join(full_name.split()).rpartition(' ')
+    return first_name, last_name
+
+
+def _text(raw, name):
+    value = raw.get(name)
+    return '' if value is None else str(value).strip()
+
+
+def clean_record(raw):
+    """Запись файла -> поля книги; ValueError, если запись нельзя импортировать"""
+    if not isinstance(raw, dict):
+        raise ValueError('запись должна быть объектом')
+    isbn = normalize_isbn(raw.get('isbn'))
+    title = _text(raw, 'title')
+    if not title:
+        raise ValueError('не указано название')
+    if len(title) > Book._meta.get_field('title').max_length:
+        raise ValueError('слишком длинное название')
+    try:
+        price = Decimal(_text(raw, 'price')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"некорректная цена: {raw.get('price')!r}")
+    if not price.is_finite() or price < 0 or price >= MAX_PRICE:
+        raise ValueError(f"некорректная цена: {raw.get('price')!r}")
+    stock = _text(raw, 'stock_quantity') or '0'
+    if not stock.isdigit():
+        raise ValueError(f'некорректное количество на складе: {stock!r}')
+
+    if 'author_last_name' in raw or 'author_first_name' in raw:
+        author = (_text(raw, 'author_first_name'), _text(raw, 'author_last_name'))
+    else:
+        author = split_name(_text(raw, 'author'))
+    categories = raw.get('categories')
+    if isinstance(categories, str):
+        categories = CATEGORY_SEPARATORS.split(categories)
+    if categories is not None:
+        categories = list(dict.fromkeys(name for name in map(str.strip, map(str, categories)) if name))
+    return {
+        'isbn': isbn,
+        'title': title,
+        'slug': _text(raw, 'slug'),
+        'author': author if any(author) else None,
+        'publisher': _text(raw, 'publisher') or None,
+        'categories': categories,
+        'description': _text(raw, 'description'),
+        'price': price,
+        'stock_quantity': int(stock),
+    }
+
+
+class CatalogImporter:
+    """Импорт записей в каталог пачками; после run() нужно вызвать finish()"""
+
+    def __init__(self, batch_size=BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        # progress(result) вызывается после каждой пачки
+        self.progress = progress
+        self.result = ImportResult()
+        self._authors = None
+
+    def _load_lookups(self):
+        self._authors = {
+            (search.normalize(first_name), search.normalize(last_name)): pk
+            for pk, first_name, last_name in Author.objects.values_list('id', 'first_name', 'last_name').iterator()
+        }
+        self._publishers = {
+            search.normalize(name): pk for pk, name in Publisher.objects.values_list('id', 'name').iterator()
+        }
+        self._categories = {}
+        self._category_slugs = set()
+        for pk, name, slug in Category.objects.values_list('id', 'name', 'slug').iterator():
+            self._categories[search.normalize(name)] = pk
+            self._category_slugs.add(slug)
+
+    def run(self, records):
+        """Импортирует записи из итератора и возвращает ImportResult"""
+        if self._authors is None:
+            self._load_lookups()
+        started = time.monotonic() - self.result.seconds
+        batch = {}
+        for number, raw in enumerate(records, start=self.result.rows + 1):
+            self.result.rows += 1
+            try:
+                record = clean_record(raw)
+            except ValueError as exc:
+                self._skip(number, str(exc))
+                continue
+            # Повтор ISBN в пачке: остается последняя запись
+            batch[record['isbn']] = (number, record)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = {}
+                self.result.seconds = time.monotonic() - started
+                if self.progress:
+                    self.progress(self.result)
+        if batch:
+            self._write(batch)
+        self.result.seconds = time.monotonic() - started
+        return self.result
+
+    def finish(self):
+        """Пересчитывает то, что при bulk_create не обновили сигналы"""
+        counters.recount_all()
+        bump_version('book', 'author', 'category', 'publisher', 'home', 'suggest')
+
+    def _skip(self, number, message):
+        self.result.skipped += 1
+        if len(self.result.errors) < MAX_ERRORS:
+            self.result.errors.append((number, message))
+
+    def _write(self, batch):
+        batch = self._assign_slugs(batch)
+        if not batch:
+            return
+        records = [record for number, record in batch.values()]
+        numbers = [number for number, record in batch.values()]
+        try:
+            with transaction.atomic():
+                self._write_batch(records)
+        except IntegrityError as exc:
+            raise CatalogImportError(f'Записи {min(numbers)}-{max(numbers)} не записаны: {exc}')
+
+    def _assign_slugs(self, batch):
+        """Проставляет slug записям пачки; записи, которым slug не подобрать, пропускаются.
+
+        Существующая книга сохраняет свой slug. Если slug новой книги занят
+        другой книгой в базе или в этой же пачке, к нему добавляется ISBN.
+        """
+        stored = dict(Book.objects.filter(isbn__in=list(batch)).values_list('isbn', 'slug'))
+        options = {}
+        for isbn, (number, record) in batch.items():
+            if isbn in stored:
+                options[isbn] = [stored[isbn]]
+            elif record['slug']:
+                options[isbn] = [record['slug'], f"{record['slug'][:180]}-{isbn}"]
+            else:
+                options[isbn] = ['-'.join(filter(None, [slugify(record['title'])[:180], isbn]))]
+
+        owners = dict(
+            Book.objects.filter(slug__in={slug for slugs in options.values() for slug in slugs})
+            .values_list('slug', 'isbn')
+        )
+        kept = {}
+        for isbn, (number, record) in batch.items():
+            slug = next((slug for slug in options[isbn] if owners.get(slug, isbn) == isbn), None)
+            if slug is None:
+                self._skip(number, f'slug {options[isbn][0]!r} занят другой книгой')
+                continue
+            owners[slug] = isbn
+            record['slug'] = slug
+            kept[isbn] = (number, record)
+        return kept
+
+    def _write_batch(self, records):
+        author_ids = self._resolve_authors({record['author'] for record in records if record['author']})
+        publisher_ids = self._resolve(
+            Publisher, self._publishers, {record['publisher'] for record in records if record['publisher']}
+        )
+        category_names = {name for record in records if record['categories'] for name in record['categories']}
+        category_ids = self._resolve(Category, self._categories, category_names)
+
+        isbns = [record['isbn'] for record in records]
+        # Цены существующих книг: корзины с подорожавшими книгами пересчитываются
+        existing = dict(Book.objects.filter(isbn__in=isbns).values_list('isbn', 'price'))
+        books = []
+        for record in records:
+            book = Book(
+                title=record['title'],
+                slug=record['slug'],
+                isbn=record['isbn'],
+                author_id=author_ids.get(record['author']),
+                publisher_id=publisher_ids.get(record['publisher']),
+                description=record['description'],
+                price=record['price'],
+                stock_quantity=record['stock_quantity'],
+            )
+            book.search_key = search.book_search_key(book)
+            books.append(book)
+        Book.objects.bulk_create(books, update_conflicts=True, unique_fields=['isbn'], update_fields=UPDATE_FIELDS)
+        book_ids = dict(Book.objects.filter(isbn__in=isbns).values_list('isbn', 'id'))
+        self.result.created += len(records) - len(existing)
+        self.result.updated += len(existing)
+        repriced = [
+            book_ids[record['isbn']] for record in records
+            if record['isbn'] in existing and existing[record['isbn']] != record['price']
+        ]
+        if repriced:
+            Cart.reprice(repriced)
+
+        with_categories = [record for record in records if record['categories'] is not None]
+        if with_categories:
+            Through = Book.categories.through
+            Through.objects.filter(book_id__in=[book_ids[record['isbn']] for record in with_categories]).delete()
+            # Пары собираются в множество: варианты написания одной
+            # категории ("Классика;классика") дают один и тот же id
+            pairs = {
+                (book_ids[record['isbn']], category_ids[name])
+                for record in with_categories
+                for name in record['categories']
+            }
+            Through.objects.bulk_create([
+                Through(book_id=book_id, category_id=category_id) for book_id, category_id in pairs
+            ])
+        search.index_books_by_id(list(book_ids.values()))
+
+    def _resolve_authors(self, names):
+        """{(имя, фамилия): id}, недостающие авторы создаются"""
+        missing = {}
+        for first_name, last_name in names:
+            key = (search.normalize(first_name), search.normalize(last_name))
+            if key not in self._authors:
+                author = Author(first_name=first_name, last_name=last_name)
+                author.search_key = search.author_search_key(author)
+                missing.setdefault(key, author)
+        if missing:
+            Author.objects.bulk_create(missing.values())
+            if any(author.pk is None for author in missing.values()):
+                self._authors.update(
+                    ((search.normalize(first_name), search.normalize(last_name)), pk)
+                    for pk, first_name, last_name in Author.objects.filter(
+                        last_name__in={author.last_name for author in missing.values()}
+                    ).values_list('id', 'first_name', 'last_name')
+                )
+            else:
+                self._authors.update((key, author.pk) for key, author in missing.items())
+        return {
+            name: self._authors[(search.normalize(name[0]), search.normalize(name[1]))]
+            for name in names
+        }
+
+    def _resolve(self, model, lookup, names):
+        """{название: id} для издательств и категорий, недостающие создаются"""
+        missing = {}
+        for name in names:
+            key = search.normalize(name)
+            if key not in lookup:
+                missing.setdefault(key, model(name=name, **self._defaults(model, name)))
+        if missing:
+            model.objects.bulk_create(missing.values())
+            if any(obj.pk is None for obj in missing.values()):
+                lookup.update(
+                    (search.normalize(name), pk)
+                    for pk, name in model.objects.filter(
+                        name__in=[obj.name for obj in missing.values()]
+                    ).values_list('id', 'name')
+                )
+            else:
+                lookup.update((key, obj.pk) for key, obj in missing.items())
+        return {name: lookup[search.normalize(name)] for name in names}
+
+    def _defaults(self, model, name):
+        if model is not Category:
+            return {}
+        base = slugify(name, allow_unicode=True)[:90] or 'category'
+        slug, suffix = base, 1
+        while slug in self._category_slugs:
+            suffix += 1
+            slug = f'{base}-{suffix}'
+        self._category_slugs.add(slug)
+        return {'slug': slug}
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from catalog.models import Author, Book
+from catalog.search import author_search_key, book_search_key
+
+
+class Command(BaseCommand):
+    help = 'Заполняет нормализованные ключи поиска у книг и авторов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        authors = self._backfill(
+            Author.objects.only('id', 'first_name', 'last_name', 'search_key'),
+            author_search_key, batch_size,
+        )
+        books = self._backfill(
+            Book.objects.only('id', 'title', 'isbn', 'search_key'),
+            book_search_key, batch_size,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено авторов: {authors}, книг: {books}'
+        ))
+
+    def _backfill(self, queryset, make_key, batch_size):
+        changed = []
+        updated = 0
+        for obj in queryset.iterator(chunk_size=batch_size):
+            key = make_key(obj)
+            if obj.search_key != key:
+                obj.search_key = key
+                changed.append(obj)
+            if len(changed) >= batch_size:
+                queryset.model.objects.bulk_update(changed, ['search_key'])
+                updated += len(changed)
+                changed = []
+        if changed:
+            queryset.model.objects.bulk_update(changed, ['search_key'])
+            updated += len(changed)
+        return updated
@@ -0,0 +1,117 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from catalog.models import Author, Book, Category, Publisher
+from catalog.serializers import BookSerializer, BookValuesSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает BookSerializer и BookValuesSerializer на странице из сгенерированных книг'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10_000, help='Сколько книг сгенерировать')
+        parser.add_argument('--page-size', type=int, default=10_000, help='Сколько книг сериализовать за раз')
+        parser.add_argument('--repeat', type=int, default=5, help='Сколько раз повторить каждый замер')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--keep', action='store_true', help='Не откатывать сгенерированные данные')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options)
+                self.measure(options['page_size'], options['repeat'])
+                if not options['keep']:
+                    raise _Rollback
+        except _Rollback:
+            self.stdout.write('Сгенерированные данные откачены')
+
+    def seed(self, options):
+        started = time.perf_counter()
+        rng = random.Random(0)
+        batch_size = options['batch_size']
+        prefix = f'bench-{int(time.time())}'
+
+        categories = Category.objects.bulk_create([
+            Category(name=f'{prefix}-{i}', slug=f'{prefix}-{i}', description='Категория для замера')
+            for i in range(30)
+        ])
+        authors = Author.objects.bulk_create([
+            Author(first_name=f'Имя {i}', last_name=f'{prefix} {i}', search_key=f'{prefix} {i}')
+            for i in range(500)
+        ], batch_size=batch_size)
+        publishers = Publisher.objects.bulk_create([
+            Publisher(name=f'{prefix}-{i}', address='-') for i in range(50)
+        ])
+        # bulk_create на SQLite не всегда возвращает id
+        if categories[0].pk is None:
+            categories = list(Category.objects.filter(slug__startswith=prefix))
+            authors = list(Author.objects.filter(last_name__startswith=prefix))
+            publishers = list(Publisher.objects.filter(name__startswith=prefix))
+
+        Through = Book.categories.through
+        for offset in range(0, options['books'], batch_size):
+            count = min(batch_size, options['books'] - offset)
+            Book.objects.bulk_create([
+                Book(
+                    title=f'{prefix} книга {offset + i}',
+                    slug=f'{prefix}-{offset + i}',
+                    isbn=f'9{offset + i:012d}',
+                    author=rng.choice(authors),
+                    publisher=rng.choice(publishers),
+                    description='Описание книги для замера сериализации',
+                    price=Decimal(rng.randrange(10000, 500000)) / 100,
+                    stock_quantity=rng.randrange(100),
+                    image=f'images/{prefix}-{offset + i}.jpg' if i % 2 else None,
+                )
+                for i in range(count)
+            ])
+            book_ids = Book.objects.filter(slug__startswith=f'{prefix}-').order_by('-id').values_list('id', flat=True)[:count]
+            Through.objects.bulk_create([
+                Through(book_id=book_id, category_id=category.pk)
+                for book_id in book_ids
+                for category in rng.sample(categories, rng.randint(1, 3))
+            ])
+        self.stdout.write(f"Сгенерировано книг: {options['books']} за {time.perf_counter() - started:.1f} с")
+
+    def measure(self, page_size, repeat):
+        context = {'request': Request(RequestFactory().get('/api/books/', HTTP_HOST='localhost'))}
+        queryset = Book.objects.order_by('title', 'id')[:page_size]
+        renderer = JSONRenderer()
+
+        def model_serializer():
+            books = BookSerializer.setup_queryset(queryset)
+            return renderer.render(BookSerializer(books, many=True, context=context).data)
+
+        def values_serializer():
+            serializer = BookValuesSerializer(context=context)
+            return renderer.render(serializer.serialize(serializer.setup_queryset(queryset)))
+
+        outputs = {}
+        for name, serialize in [('ModelSerializer', model_serializer), ('values()', values_serializer)]:
+            timings = []
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    outputs[name] = serialize()
+                    timings.append(time.perf_counter() - started)
+            median = statistics.median(timings)
+            rate = f'{page_size / median:,.0f}'.replace(',', ' ')
+            self.stdout.write(
+                f'{name:>15}: запросов {len(queries)}, медиана {median * 1000:.0f} мс, {rate} книг/с'
+            )
+        if len(set(outputs.values())) != 1:
+            raise CommandError('Ответы сериализаторов различаются')
+        self.stdout.write('Ответы совпадают байт в байт')
@@ -0,0 +1,99 @@
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from catalog import rollups
+from catalog.models import Order, User
+from catalog.stats import SOURCES, dashboard_stats
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def _manual_created_at():
+    """Позволяет задать created_at при bulk_create (иначе его перезапишет auto_now_add)"""
+    field = Order._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Замеряет число запросов и время расчета статистики админ-панели на сгенерированных заказах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1_000_000, help='Сколько заказов сгенерировать')
+        parser.add_argument('--users', type=int, default=10_000, help='Сколько покупателей сгенерировать')
+        parser.add_argument('--days', type=int, default=365, help='За сколько дней распределить заказы')
+        parser.add_argument('--repeat', type=int, default=5, help='Сколько раз повторить каждый замер')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--keep', action='store_true', help='Не откатывать сгенерированные данные')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options)
+                self.measure(options['repeat'])
+                if not options['keep']:
+                    raise _Rollback
+        except _Rollback:
+            self.stdout.write('Сгенерированные данные откачены')
+
+    def seed(self, options):
+        started = time.perf_counter()
+        now = timezone.now()
+        rng = random.Random(0)
+        batch_size = options['batch_size']
+
+        prefix = f'bench-{int(now.timestamp())}'
+        User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', date_joined=now - timedelta(days=rng.randrange(options['days'])))
+            for i in range(options['users'])
+        ], batch_size=batch_size)
+        user_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+        statuses = [status for status, label in Order.STATUS_CHOICES]
+        seconds = options['days'] * 86400
+        with _manual_created_at():
+            for offset in range(0, options['orders'], batch_size):
+                count = min(batch_size, options['orders'] - offset)
+                Order.objects.bulk_create([
+                    Order(
+                        user_id=rng.choice(user_ids),
+                        created_at=now - timedelta(seconds=rng.randrange(seconds)),
+                        status=rng.choice(statuses),
+                        total_amount=Decimal(rng.randrange(10000, 500000)) / 100,
+                        shipping_address='-',
+                    )
+                    for _ in range(count)
+                ])
+        rollups.rebuild()
+        self.stdout.write(
+            f"Сгенерировано заказов: {options['orders']}, покупателей: {options['users']} "
+            f'за {time.perf_counter() - started:.1f} с'
+        )
+
+    def measure(self, repeat):
+        for source in SOURCES:
+            timings = []
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    dashboard_stats(source=source)
+                    timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f'{source:>7}: запросов {len(queries)}, '
+                f'медиана {statistics.median(timings):.1f} мс, минимум {min(timings):.1f} мс'
+            )
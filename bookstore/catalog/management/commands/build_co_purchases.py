@@ -0,0 +1,22 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import copurchase
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рекомендации «с этой книгой покупают» по позициям заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=copurchase.TOP_K, help='Сколько соседей хранить для книги')
+        parser.add_argument('--min-orders', type=int, default=copurchase.MIN_ORDERS,
+                            help='Минимум совместных заказов для пары')
+        parser.add_argument('--chunk-size', type=int, default=copurchase.CHUNK_SIZE,
+                            help='Сколько позиций заказов читать за раз')
+
+    def handle(self, *args, **options):
+        try:
+            saved = copurchase.rebuild(options['top_k'], options['min_orders'], options['chunk_size'])
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(f'Сохранено пар: {saved}'))
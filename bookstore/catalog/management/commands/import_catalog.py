@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importer import (
+    BATCH_SIZE, FORMATS, CatalogImportError, CatalogImporter, detect_format, read_records,
+)
+
+
+class Command(BaseCommand):
+    help = 'Импортирует книги из файла CSV, JSON или ONIX 3.0 (обновляет существующие по ISBN)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу')
+        parser.add_argument('--format', choices=FORMATS, help='Формат файла (по умолчанию по расширению)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        importer = CatalogImporter(batch_size=options['batch_size'], progress=self.report_progress)
+        try:
+            format = options['format'] or detect_format(path)
+            with open(path, 'rb') as stream:
+                result = importer.run(read_records(stream, format))
+        except (CatalogImportError, OSError) as exc:
+            raise CommandError(exc)
+        finally:
+            # Пачки, записанные до ошибки, тоже должны попасть в счетчики и кэш
+            importer.finish()
+
+        for number, message in result.errors:
+            self.stderr.write(f'Запись {number}: {message}')
+        if result.skipped > len(result.errors):
+            self.stderr.write(f'... и еще ошибок: {result.skipped - len(result.errors)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано записей: {result.rows} (создано {result.created}, обновлено {result.updated}, '
+            f'пропущено {result.skipped}) за {result.seconds:.1f} с, {result.rows_per_second:.0f} записей/с'
+        ))
+
+    def report_progress(self, result):
+        self.stdout.write(f'{result.rows} записей, {result.rows_per_second:.0f} записей/с')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog.counters import recount_all
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает количество книг у категорий, авторов и издательств'
+
+    def handle(self, *args, **options):
+        updated = recount_all()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено счетчиков: {updated}'))
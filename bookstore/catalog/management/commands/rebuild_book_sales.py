@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog.sales import rebuild_book_sales
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики продаж книг по позициям заказов'
+
+    def handle(self, *args, **options):
+        updated = rebuild_book_sales()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано книг: {updated}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from catalog import related
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает похожие книги (по умолчанию только для изменившихся книг)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать для всех книг')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        book_ids = Book.objects.values_list('id', flat=True) if options['full'] else None
+        count = related.rebuild(book_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано книг: {count}'))
@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from catalog import rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневные сводки продаж и регистраций по заказам и пользователям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=date.fromisoformat, help='Начало периода, ГГГГ-ММ-ДД')
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, help='Конец периода, ГГГГ-ММ-ДД')
+
+    def handle(self, *args, **options):
+        rollups.rebuild(options['start'], options['end'])
+        self.stdout.write(self.style.SUCCESS('Сводки пересчитаны'))
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс книг'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковый индекс перестроен ({search.get_backend().__class__.__name__}) '
+            f'за {time.monotonic() - started:.2f} с'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from catalog.cache import invalidate_cart_badge
+from catalog.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = 'Сверяет денормализованные итоги корзин с позициями и исправляет расхождения'
+
+    def handle(self, *args, **options):
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        real_count = Coalesce(
+            Subquery(items.annotate(total=Sum('quantity')).values('total')),
+            Value(0),
+        )
+        real_amount = Coalesce(
+            Subquery(items.annotate(total=Sum(F('quantity') * F('book__price'))).values('total')),
+            Value(0),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+        drifted = list(
+            Cart.objects.alias(real_count=real_count, real_amount=real_amount)
+            .exclude(item_count=F('real_count'), subtotal=F('real_amount'))
+            .values_list('pk', flat=True)
+        )
+        if drifted:
+            Cart.objects.filter(pk__in=drifted).update(item_count=real_count, subtotal=real_amount)
+            invalidate_cart_badge(*Cart.objects.filter(pk__in=drifted).values_list('user_id', flat=True))
+        self.stdout.write(self.style.SUCCESS(f'Исправлено корзин: {len(drifted)}'))
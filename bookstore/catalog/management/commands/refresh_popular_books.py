@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog.cache import refresh_popular_books
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает популярные книги для главной страницы (запускать по cron)'
+
+    def handle(self, *args, **options):
+        books = refresh_popular_books()
+        self.stdout.write(self.style.SUCCESS(f'Популярных книг: {len(books)}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog.services import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Снимает просроченные резервы товаров в корзинах (запускать по cron)'
+
+    def handle(self, *args, **options):
+        released = release_expired_holds()
+        self.stdout.write(self.style.SUCCESS(f'Освобождено единиц товара: {released}'))
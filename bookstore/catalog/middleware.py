@@ -0,0 +1,62 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .routers import replica_reads
+
+# Cookie, пока она жива, запросы пользователя читают из основной базы
+PIN_COOKIE = 'db_primary_pin'
+# Клиенты API без cookie закрепляются ключом в кэше: по пользователю и по
+# заголовку Authorization (токен проверяется уже в представлении DRF)
+PIN_CACHE = getattr(settings, 'REPLICA_PIN_CACHE', 'default')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def pin_keys(request):
+    keys = []
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        keys.append(f'db_pin:user:{user.pk}')
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if authorization:
+        keys.append('db_pin:auth:' + hashlib.sha256(authorization.encode()).hexdigest())
+    return keys
+
+
+class ReplicaRoutingMiddleware:
+    """Разрешает чтение каталога с реплик для безопасных запросов.
+
+    После любого изменяющего запроса пользователь на REPLICA_PIN_SECONDS
+    закрепляется за основной базой, чтобы сразу видеть свои изменения, пока
+    реплика догоняет: браузер - cookie, авторизованный клиент - ключом в кэше. Пути из PRIMARY_DB_PATHS (корзина, заказы,
+    админ-панель) всегда работают с основной базой.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+        self.primary_paths = tuple(getattr(settings, 'PRIMARY_DB_PATHS', ()))
+
+    def use_replicas(self, request):
+        if request.method not in SAFE_METHODS or request.path.startswith(self.primary_paths):
+            return False
+        if PIN_COOKIE in request.COOKIES:
+            return False
+        keys = pin_keys(request)
+        return not (keys and caches[PIN_CACHE].get_many(keys))
+
+    def __call__(self, request):
+        token = replica_reads.set(self.use_replicas(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+            # DRF записывает пользователя, вошедшего по токену, в request.user
+            keys = pin_keys(request)
+            if keys:
+                caches[PIN_CACHE].set_many(dict.fromkeys(keys, True), self.pin_seconds)
+        return response
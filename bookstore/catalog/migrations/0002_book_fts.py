@@ -0,0 +1,64 @@
+import re
+
+from django.db import migrations
+
+# Копии на момент миграции (см. catalog/search.py): миграция не должна
+# меняться вместе с кодом приложения
+FTS_TABLE = 'catalog_book_fts'
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').casefold().replace('ё', 'е'))
+
+
+def book_document(book):
+    author = book.author
+    return (
+        ' '.join(tokenize(book.title)),
+        ' '.join(tokenize(f'{author.first_name} {author.last_name}')) if author else '',
+        ' '.join(tokenize(book.isbn)),
+        ' '.join(tokenize(book.description)),
+    )
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                f"USING fts5(title, author, isbn, description, tokenize = 'unicode61', prefix = '2 3')"
+            )
+        except Exception:
+            # SQLite собран без FTS5 - поиск будет работать через индекс в памяти
+            return
+        Book = apps.get_model('catalog', 'Book')
+        rows = [
+            (book.id, *book_document(book))
+            for book in Book.objects.select_related('author')
+        ]
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, author, isbn, description) VALUES (%s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
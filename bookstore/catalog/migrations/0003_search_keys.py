@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-17 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_book_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=201, verbose_name='Ключ поиска'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=214, verbose_name='Ключ поиска'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-17 04:54
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_book_sales(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    OrderItem = apps.get_model('catalog', 'OrderItem')
+    items = OrderItem.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    Book.objects.update(
+        order_count=Coalesce(Subquery(items.annotate(total=Count('id')).values('total')), Value(0)),
+        units_sold=Coalesce(Subquery(items.annotate(total=Sum('quantity')).values('total')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_cart_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='order_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Количество заказов'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Продано экземпляров'),
+        ),
+        migrations.RunPython(fill_book_sales, migrations.RunPython.noop),
+    ]
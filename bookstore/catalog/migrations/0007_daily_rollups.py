@@ -0,0 +1,63 @@
+# Generated by Django 4.2 on 2026-10-17 04:54
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_rollups(apps, schema_editor):
+    Order = apps.get_model('catalog', 'Order')
+    User = apps.get_model('catalog', 'User')
+    DailySalesRollup = apps.get_model('catalog', 'DailySalesRollup')
+    DailySignupRollup = apps.get_model('catalog', 'DailySignupRollup')
+    DailySalesRollup.objects.bulk_create([
+        DailySalesRollup(date=row['day'], status=row['status'],
+                         order_count=row['orders'], revenue=row['revenue'] or 0)
+        for row in Order.objects.annotate(day=TruncDate('created_at')).order_by()
+        .values('day', 'status').annotate(orders=Count('id'), revenue=Sum('total_amount'))
+    ], batch_size=1000)
+    DailySignupRollup.objects.bulk_create([
+        DailySignupRollup(date=row['day'], new_users=row['users'])
+        for row in User.objects.annotate(day=TruncDate('date_joined')).order_by()
+        .values('day').annotate(users=Count('id'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_book_sales_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySignupRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('new_users', models.IntegerField(default=0, verbose_name='Новых пользователей')),
+            ],
+            options={
+                'verbose_name': 'Сводка регистраций за день',
+                'verbose_name_plural': 'Сводки регистраций за день',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('status', models.CharField(choices=[('pending', 'В ожидании'), ('processing', 'Обработка'), ('shipped', 'Отправлен'), ('delivered', 'Доставлен'), ('cancelled', 'Отменен')], max_length=20, verbose_name='Статус заказа')),
+                ('order_count', models.IntegerField(default=0, verbose_name='Количество заказов')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма заказов')),
+            ],
+            options={
+                'verbose_name': 'Сводка продаж за день',
+                'verbose_name_plural': 'Сводки продаж за день',
+                'ordering': ['date', 'status'],
+                'unique_together': {('date', 'status')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-17 05:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='related_built_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Похожие книги пересчитаны'),
+        ),
+        migrations.CreateModel(
+            name='RelatedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Вес')),
+                ('shared_categories', models.PositiveIntegerField(default=0, verbose_name='Общих категорий')),
+                ('co_purchases', models.PositiveIntegerField(default=0, verbose_name='Совместных покупок')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='catalog.book', verbose_name='Книга')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_in', to='catalog.book', verbose_name='Похожая книга')),
+            ],
+            options={
+                'verbose_name': 'Похожая книга',
+                'verbose_name_plural': 'Похожие книги',
+                'ordering': ['book', '-score'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='relatedbook',
+            index=models.Index(fields=['book', '-score'], name='catalog_related_book_score'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='relatedbook',
+            unique_together={('book', 'related')},
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-17 05:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_related_books'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Нормированный вес')),
+                ('orders', models.PositiveIntegerField(verbose_name='Совместных заказов')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='co_purchases', to='catalog.book', verbose_name='Книга')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bought_with', to='catalog.book', verbose_name='Покупают вместе')),
+            ],
+            options={
+                'verbose_name': 'Совместная покупка',
+                'verbose_name_plural': 'Совместные покупки',
+                'ordering': ['book', '-score'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='copurchase',
+            index=models.Index(fields=['book', '-score'], name='catalog_copurchase_score'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='copurchase',
+            unique_together={('book', 'related')},
+        ),
+    ]
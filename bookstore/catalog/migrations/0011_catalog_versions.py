@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-17 05:10
+
+import time
+
+from django.db import migrations, models
+
+# Сущности на момент миграции (см. cache.NAMESPACES); версии новых
+# сущностей создает bump_version
+NAMESPACES = ('book', 'author', 'category', 'publisher', 'recommendation')
+
+
+def seed_versions(apps, schema_editor):
+    CatalogVersion = apps.get_model('catalog', 'CatalogVersion')
+    # Раньше версии в кэше начинались с метки времени в наносекундах;
+    # начинаем выше, чтобы новые версии не совпали с уже выданными
+    start = time.time_ns()
+    CatalogVersion.objects.bulk_create([
+        CatalogVersion(namespace=namespace, version=start) for namespace in NAMESPACES
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=50, unique=True, verbose_name='Сущность')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия каталога',
+                'verbose_name_plural': 'Версии каталога',
+            },
+        ),
+        migrations.RunPython(seed_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-17 05:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_books_count(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    Through = Book.categories.through
+    for name, rows in [
+        ('Category', Through.objects.filter(category=OuterRef('pk')).values('category')),
+        ('Author', Book.objects.filter(author=OuterRef('pk')).values('author')),
+        ('Publisher', Book.objects.filter(publisher=OuterRef('pk')).values('publisher')),
+    ]:
+        count = Coalesce(Subquery(rows.annotate(count=Count('pk')).values('count')), Value(0))
+        apps.get_model('catalog', name).objects.update(books_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='books_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество книг'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='books_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество книг'),
+        ),
+        migrations.AddField(
+            model_name='publisher',
+            name='books_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество книг'),
+        ),
+        migrations.RunPython(fill_books_count, migrations.RunPython.noop),
+    ]
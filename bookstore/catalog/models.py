@@ -1,11 +1,13 @@
 from django.conf import settings
-from django.db import models  # Для использования встроенной модели User, если нужно
+from django.db import models, transaction  # Для использования встроенной модели User, если нужно
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.urls import reverse
 from django.utils import timezone
 import datetime
 from django.contrib.auth.models import AbstractUser
 
+from .cache import invalidate_cart_badge
+
 class User(AbstractUser):
     ROLE_CHOICES = (
         ('admin', 'Администратор'),
@@ -52,6 +54,11 @@ class User(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # Новые пользователи за период и фильтр по роли в админ-панели
+            models.Index(fields=['date_joined'], name='catalog_user_joined_idx'),
+            models.Index(fields=['role'], name='catalog_user_role_idx'),
+        ]
     
     def __str__(self):
         return self.username
@@ -77,6 +84,8 @@ class Category(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name="Название категории")
     slug = models.SlugField(max_length=100, unique=True, verbose_name="URL категории")
     description = models.TextField(blank=True, verbose_name="Описание категории")
+    # Количество книг, поддерживается сигналами (см. counters.py)
+    books_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Количество книг")
 
     class Meta:
         verbose_name = "Категория"
@@ -93,6 +102,10 @@ class Author(models.Model):
     bio = models.TextField(blank=True, verbose_name="Биография")
     birth_date = models.DateField(null=True, blank=True, verbose_name="Дата рождения")
     website = models.URLField(blank=True, verbose_name="Веб-сайт")
+    # Нормализованные имя и фамилия для поиска без учета регистра (заполняется в signals.py)
+    search_key = models.CharField(max_length=201, blank=True, db_index=True, editable=False, verbose_name="Ключ поиска")
+    # Количество книг, поддерживается сигналами (см. counters.py)
+    books_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Количество книг")
 
     class Meta:
         verbose_name = "Автор"
@@ -100,13 +113,20 @@ class Author(models.Model):
         ordering = ['last_name', 'first_name']
 
     def __str__(self):
-        return f"{self.last_name} {self.first_name}"
+        return self.full_name(self.first_name, self.last_name)
+
+    @staticmethod
+    def full_name(first_name, last_name):
+        """Имя автора для показа; используется и без загрузки модели (BookValuesSerializer)"""
+        return f"{last_name} {first_name}"
 
 # 3. Издательства
 class Publisher(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name="Название издательства")
     address = models.CharField(max_length=255, blank=True, verbose_name="Адрес")
     website = models.URLField(blank=True, verbose_name="Веб-сайт")
+    # Количество книг, поддерживается сигналами (см. counters.py)
+    books_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Количество книг")
 
     class Meta:
         verbose_name = "Издательство"
@@ -116,6 +136,9 @@ class Publisher(models.Model):
     def __str__(self):
         return self.name
 
+# Порог «заканчивается на складе» для админ-панели (под него есть частичный индекс)
+LOW_STOCK_THRESHOLD = 10
+
 # 4. Книги
 class Book(models.Model):
     title = models.CharField(max_length=200, verbose_name="Название")
@@ -127,18 +150,57 @@ class Book(models.Model):
     description = models.TextField(blank=True, verbose_name="Описание")
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name="Цена")
     stock_quantity = models.PositiveIntegerField(verbose_name="Количество на складе")
+    # Сумма активных резервов в корзинах, поддерживается services.hold_stock/release_holds
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False, verbose_name="Зарезервировано")
+    # Счетчики продаж, обновляются при оформлении заказа (см. services.place_order)
+    order_count = models.PositiveIntegerField(default=0, db_index=True, editable=False, verbose_name="Количество заказов")
+    units_sold = models.PositiveIntegerField(default=0, editable=False, verbose_name="Продано экземпляров")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания записи")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления записи")
     image = models.ImageField(upload_to='images/', help_text="Добавьте изображение обложки", null=True, blank=True)
+    # Нормализованные название и ISBN для поиска без учета регистра (заполняется в signals.py)
+    search_key = models.CharField(max_length=214, blank=True, db_index=True, editable=False, verbose_name="Ключ поиска")
+    # Когда последний раз пересчитывались похожие книги (см. related.py)
+    related_built_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Похожие книги пересчитаны")
 
     class Meta:
         verbose_name = "Книга"
         verbose_name_plural = "Книги"
         ordering = ['title']
+        indexes = [
+            # Фильтр по цене и сортировки по цене и новизне (каталог, API, главная)
+            models.Index(fields=['price'], name='catalog_book_price_idx'),
+            models.Index(fields=['-created_at'], name='catalog_book_created_idx'),
+            # Частичный индекс только по заканчивающимся книгам
+            models.Index(
+                fields=['stock_quantity'],
+                name='catalog_book_low_stock_idx',
+                condition=models.Q(stock_quantity__lt=LOW_STOCK_THRESHOLD),
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Загруженные автор и издательство - чтобы при сохранении пересчитать
+        # счетчики книг у прежних (см. counters.py); если поля отложены через
+        # only(), их прочитает pre_save
+        deferred = instance.get_deferred_fields()
+        if not {'author_id', 'publisher_id'} & deferred:
+            instance._counted_refs = (instance.author_id, instance.publisher_id)
+        # Загруженная цена - чтобы при ее изменении пересчитать корзины
+        if 'price' not in deferred:
+            instance._stored_price = instance.price
+        return instance
+
+    @property
+    def available_quantity(self):
+        """Количество, доступное для добавления в корзину"""
+        return max(self.stock_quantity - self.reserved_quantity, 0)
+
 # 8. Заказы
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -183,6 +245,30 @@ class Order(models.Model):
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ['-created_at']
+        indexes = [
+            # Последние заказы, список заказов в админ-панели с фильтром по статусу
+            # и список заказов пользователя
+            models.Index(fields=['-created_at'], name='catalog_order_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='catalog_order_status_idx'),
+            models.Index(fields=['user', '-created_at'], name='catalog_order_user_idx'),
+        ]
+
+    # Поля, из которых складывается rollup_state()
+    ROLLUP_FIELDS = {'created_at', 'status', 'total_amount'}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем загруженное состояние для дневных сводок (см. rollups.py).
+        # Если эти поля отложены через only(), состояние прочитает pre_save.
+        if not cls.ROLLUP_FIELDS & instance.get_deferred_fields():
+            instance._rollup_state = instance.rollup_state()
+        return instance
+
+    def rollup_state(self):
+        if self.created_at is None:
+            return None
+        return (timezone.localdate(self.created_at), self.status, self.total_amount or 0)
 
     def __str__(self):
         return f"Order #{self.id} for {self.customer.user.username} ({self.status})"
@@ -215,6 +301,9 @@ class Cart(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+    # Денормализованные итоги, меняются вместе с позициями (см. _adjust_totals)
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Количество товаров')
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Сумма товаров')
 
     class Meta:
         verbose_name = 'Корзина'
@@ -225,52 +314,105 @@ class Cart(models.Model):
 
     @property
     def total_items(self):
-        return self.items.aggregate(total=models.Sum('quantity'))['total'] or 0
+        return self.item_count
 
     def total_price(self):
         """Возвращает общую стоимость товаров в корзине"""
-        total = 0
-        for item in self.items.all():
-            total += item.total_price()
-        return total
+        return self.subtotal
 
-    def add_item(self, book, quantity=1):
-        """Добавить товар в корзину"""
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=self,
-            book=book,
-            defaults={'quantity': quantity}
+    def _adjust_totals(self, quantity, amount):
+        """Атомарно сдвигает итоги корзины на заданные величины"""
+        Cart.objects.filter(pk=self.pk).update(
+            item_count=models.F('item_count') + quantity,
+            subtotal=models.F('subtotal') + amount,
+        )
+        self.item_count += quantity
+        self.subtotal += amount
+        invalidate_cart_badge(self.user_id)
+
+    def recalculate(self):
+        """Пересчитывает итоги по позициям (исправляет расхождения)"""
+        totals = self.items.aggregate(
+            count=models.Sum('quantity'),
+            amount=models.Sum(models.F('quantity') * models.F('book__price')),
         )
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        self.item_count = totals['count'] or 0
+        self.subtotal = totals['amount'] or 0
+        Cart.objects.filter(pk=self.pk).update(item_count=self.item_count, subtotal=self.subtotal)
+        invalidate_cart_badge(self.user_id)
+
+    @classmethod
+    def reprice(cls, book_ids):
+        """Пересчитывает суммы корзин, в которых лежат книги с изменившейся ценой"""
+        from django.db.models.functions import Coalesce
+
+        items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+        amount = Coalesce(
+            models.Subquery(items.annotate(total=models.Sum(models.F('quantity') * models.F('book__price'))).values('total')),
+            models.Value(0),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        )
+        carts = CartItem.objects.filter(book_id__in=book_ids).values('cart_id')
+        return cls.objects.filter(pk__in=carts).update(subtotal=amount)
+
+    def add_item(self, book, quantity=1):
+        """Добавить товар в корзину и зарезервировать его на складе"""
+        from .services import hold_stock
+
+        with transaction.atomic():
+            cart_item, created = CartItem.objects.get_or_create(
+                cart=self,
+                book=book,
+                defaults={'quantity': quantity}
+            )
+            if not created:
+                cart_item.quantity += quantity
+                cart_item.save()
+            hold_stock(cart_item)
+            self._adjust_totals(quantity, quantity * book.price)
         return cart_item
 
     def remove_item(self, book):
         """Удалить товар из корзины"""
         try:
-            cart_item = CartItem.objects.get(cart=self, book=book)
-            cart_item.delete()
-            return True
+            cart_item = CartItem.objects.select_related('book').get(cart=self, book=book)
         except CartItem.DoesNotExist:
             return False
+        with transaction.atomic():
+            cart_item.delete()
+            self._adjust_totals(-cart_item.quantity, -cart_item.total_price())
+        return True
 
     def update_item_quantity(self, book, quantity):
         """Обновить количество товара"""
+        from .services import hold_stock
+
         try:
-            cart_item = CartItem.objects.get(cart=self, book=book)
+            cart_item = CartItem.objects.select_related('book').get(cart=self, book=book)
+        except CartItem.DoesNotExist:
+            return False
+        with transaction.atomic():
+            delta = max(quantity, 0) - cart_item.quantity
             if quantity <= 0:
                 cart_item.delete()
             else:
                 cart_item.quantity = quantity
                 cart_item.save()
-            return True
-        except CartItem.DoesNotExist:
-            return False
+                hold_stock(cart_item)
+            self._adjust_totals(delta, delta * cart_item.book.price)
+        return True
 
     def clear(self):
         """Очистить корзину"""
-        self.items.all().delete()
+        from .services import release_holds
+
+        with transaction.atomic():
+            release_holds(StockHold.objects.filter(cart_item__cart=self))
+            self.items.all().delete()
+            Cart.objects.filter(pk=self.pk).update(item_count=0, subtotal=0)
+            self.item_count = 0
+            self.subtotal = 0
+            invalidate_cart_badge(self.user_id)
 
 class CartItem(models.Model):
     cart = models.ForeignKey(
@@ -296,4 +438,110 @@ class CartItem(models.Model):
         return f'{self.quantity} x {self.book.title}'
 
     def total_price(self):
-        return self.quantity * self.book.price
\ No newline at end of file
+        return self.quantity * self.book.price
+
+
+class StockHold(models.Model):
+    """Резерв товара под позицию корзины, действует до expires_at"""
+    cart_item = models.OneToOneField(
+        CartItem,
+        on_delete=models.CASCADE,
+        related_name='hold',
+        verbose_name='Позиция корзины'
+    )
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name='holds',
+        verbose_name='Книга'
+    )
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='Действует до')
+
+    class Meta:
+        verbose_name = 'Резерв'
+        verbose_name_plural = 'Резервы'
+
+    def __str__(self):
+        return f'{self.quantity} x {self.book_id} до {self.expires_at}'
+
+
+class DailySalesRollup(models.Model):
+    """Количество заказов и выручка за день в разрезе статуса заказа"""
+    date = models.DateField(verbose_name='Дата')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='Статус заказа')
+    order_count = models.IntegerField(default=0, verbose_name='Количество заказов')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Сумма заказов')
+
+    class Meta:
+        verbose_name = 'Сводка продаж за день'
+        verbose_name_plural = 'Сводки продаж за день'
+        ordering = ['date', 'status']
+        unique_together = ['date', 'status']
+
+    def __str__(self):
+        return f'{self.date} {self.status}: {self.order_count}'
+
+
+class DailySignupRollup(models.Model):
+    """Количество регистраций за день"""
+    date = models.DateField(unique=True, verbose_name='Дата')
+    new_users = models.IntegerField(default=0, verbose_name='Новых пользователей')
+
+    class Meta:
+        verbose_name = 'Сводка регистраций за день'
+        verbose_name_plural = 'Сводки регистраций за день'
+        ordering = ['date']
+
+    def __str__(self):
+        return f'{self.date}: {self.new_users}'
+
+
+class RelatedBook(models.Model):
+    """Предрасчитанная рекомендация: похожая книга и ее вес (см. related.py)"""
+    book = models.ForeignKey(Book, related_name='related_entries', on_delete=models.CASCADE, verbose_name='Книга')
+    related = models.ForeignKey(Book, related_name='recommended_in', on_delete=models.CASCADE, verbose_name='Похожая книга')
+    score = models.FloatField(verbose_name='Вес')
+    shared_categories = models.PositiveIntegerField(default=0, verbose_name='Общих категорий')
+    co_purchases = models.PositiveIntegerField(default=0, verbose_name='Совместных покупок')
+
+    class Meta:
+        verbose_name = 'Похожая книга'
+        verbose_name_plural = 'Похожие книги'
+        ordering = ['book', '-score']
+        unique_together = ['book', 'related']
+        indexes = [models.Index(fields=['book', '-score'], name='catalog_related_book_score')]
+
+    def __str__(self):
+        return f'{self.book_id} -> {self.related_id} ({self.score})'
+
+
+class CoPurchase(models.Model):
+    """«С этой книгой покупают»: соседи книги по совместным покупкам (см. copurchase.py)"""
+    book = models.ForeignKey(Book, related_name='co_purchases', on_delete=models.CASCADE, verbose_name='Книга')
+    related = models.ForeignKey(Book, related_name='bought_with', on_delete=models.CASCADE, verbose_name='Покупают вместе')
+    score = models.FloatField(verbose_name='Нормированный вес')
+    orders = models.PositiveIntegerField(verbose_name='Совместных заказов')
+
+    class Meta:
+        verbose_name = 'Совместная покупка'
+        verbose_name_plural = 'Совместные покупки'
+        ordering = ['book', '-score']
+        unique_together = ['book', 'related']
+        indexes = [models.Index(fields=['book', '-score'], name='catalog_copurchase_score')]
+
+    def __str__(self):
+        return f'{self.book_id} -> {self.related_id} ({self.score:.3f})'
+
+
+class CatalogVersion(models.Model):
+    """Версия данных каталога; копия хранится в кэше (см. cache.get_versions)"""
+    namespace = models.CharField(max_length=50, unique=True, verbose_name='Сущность')
+    version = models.BigIntegerField(default=0, verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = 'Версии каталога'
+
+    def __str__(self):
+        return f'{self.namespace}: {self.version}'
@@ -0,0 +1,200 @@
+"""Пагинация без COUNT(*) и OFFSET.
+
+KeysetPagination используется в API: позиция страницы хранится в
+непрозрачном курсоре (значение поля сортировки + id), и следующая страница
+выбирается условием WHERE по индексу, а не сдвигом OFFSET. Ответ всегда
+имеет вид {next, previous, results} без count; next и previous - готовые
+ссылки, которые клиент не разбирает.
+
+CachedCountPaginator используется в HTML-страницах: общее количество
+объектов кэшируется или оценивается по плану запроса.
+"""
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация по полю сортировки с id в качестве второго ключа.
+
+    Представление сообщает поле сортировки через get_keyset_ordering()
+    (например, 'title' или '-price'). Порядок, который не выражается
+    условием WHERE (релевантность поиска), листается по номеру страницы
+    (параметр page) - с тем же видом ответа, но ссылками ?page=N вместо курсора.
+    """
+    cursor_query_param = 'cursor'
+    page_query_param = 'page'
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+    invalid_cursor_message = 'Некорректный курсор'
+    invalid_page_message = 'Некорректный номер страницы'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_number = None
+        ordering = view.get_keyset_ordering() if hasattr(view, 'get_keyset_ordering') else None
+        if ordering is None:
+            return self.paginate_by_page(queryset, request)
+
+        self.descending = ordering.startswith('-')
+        self.field = ordering.lstrip('-')
+        model_field = queryset.model._meta.get_field(self.field)
+
+        position = self.decode_cursor(request, model_field)
+        reverse = position is not None and position[2]
+        # Для предыдущей страницы выбираем в обратном порядке и затем разворачиваем
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+        if position is not None:
+            value, pk, _ = position
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{lookup}': value}) |
+                Q(**{self.field: value, f'id__{lookup}': pk})
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def paginate_by_page(self, queryset, request):
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message)
+        offset = (self.page_number - 1) * self.page_size
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.has_previous = self.page_number > 1
+        self.page = results[:self.page_size]
+        return self.page
+
+    def page_link(self, number):
+        url = self.request.build_absolute_uri()
+        if number == 1:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, number)
+
+    def decode_cursor(self, request, model_field):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            return model_field.to_python(data['v']), int(data['id']), bool(data.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        # Страница может состоять из объектов или из строк .values()
+        if isinstance(obj, dict):
+            value, pk = obj[self.field], obj['id']
+        else:
+            value, pk = getattr(obj, self.field), obj.pk
+        data = {'v': value if isinstance(value, str) else str(value), 'id': pk}
+        if reverse:
+            data['r'] = 1
+        cursor = base64.urlsafe_b64encode(json.dumps(data).encode()).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        if self.page_number is not None:
+            return self.page_link(self.page_number + 1)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page_number is not None:
+            return self.page_link(self.page_number - 1)
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, который не выполняет COUNT(*) на каждый запрос.
+
+    Режим задается настройкой PAGINATOR_COUNT_MODE:
+    'exact'     - обычный COUNT(*);
+    'cached'    - COUNT(*) кэшируется на PAGINATOR_COUNT_TIMEOUT секунд;
+    'estimated' - на PostgreSQL берется оценка строк из EXPLAIN,
+                  на остальных СУБД работает как 'cached'.
+    """
+
+    def __init__(self, *args, count_mode=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_mode = count_mode or getattr(settings, 'PAGINATOR_COUNT_MODE', 'cached')
+        self.count_timeout = getattr(settings, 'PAGINATOR_COUNT_TIMEOUT', 60)
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or self.count_mode == 'exact':
+            return super().count
+
+        sql, params = query.sql_with_params()
+        if self.count_mode == 'estimated':
+            estimate = self._estimate(sql, params)
+            if estimate is not None:
+                return estimate
+
+        key = 'paginator_count:' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, self.count_timeout)
+        return count
+
+    def _estimate(self, sql, params):
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,106 @@
+"""Похожие книги для страницы книги и API.
+
+Для каждой книги заранее считается список похожих книг и сохраняется в
+RelatedBook. Вес кандидата складывается из числа общих категорий и числа
+заказов, в которых обе книги были куплены вместе. Чтение - один запрос
+по индексу (book, -score).
+
+Пересчет инкрементальный (команда rebuild_related_books): обрабатываются
+книги, которые еще не считались, изменились после прошлого расчета или
+попали в новые заказы вместе с другими книгами.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import Book, OrderItem, RelatedBook
+
+# Сколько похожих книг хранить для каждой книги
+LIMIT = getattr(settings, 'RELATED_BOOKS_LIMIT', 8)
+CATEGORY_WEIGHT = getattr(settings, 'RELATED_BOOKS_CATEGORY_WEIGHT', 1.0)
+CO_PURCHASE_WEIGHT = getattr(settings, 'RELATED_BOOKS_CO_PURCHASE_WEIGHT', 3.0)
+# Сколько лучших кандидатов каждого вида рассматривать
+CANDIDATES = 50
+
+
+def related_books(book, limit=4):
+    """Похожие книги из предрасчитанной таблицы"""
+    return (
+        Book.objects.filter(recommended_in__book=book)
+        .select_related('author').order_by('-recommended_in__score')[:limit]
+    )
+
+
+def _category_candidates(book_id):
+    """{id книги: число общих категорий}"""
+    through = Book.categories.through
+    categories = through.objects.filter(book_id=book_id).values('category_id')
+    rows = (
+        through.objects.filter(category_id__in=categories).exclude(book_id=book_id)
+        .values('book_id').annotate(shared=Count('category_id'))
+        .order_by('-shared', '-book__order_count')[:CANDIDATES]
+    )
+    return {row['book_id']: row['shared'] for row in rows}
+
+
+def _co_purchase_candidates(book_id):
+    """{id книги: число заказов, где она куплена вместе с book_id}"""
+    orders = OrderItem.objects.filter(book_id=book_id).values('order_id')
+    rows = (
+        OrderItem.objects.filter(order_id__in=orders).exclude(book_id=book_id)
+        .values('book_id').annotate(orders=Count('order_id', distinct=True))
+        .order_by('-orders')[:CANDIDATES]
+    )
+    return {row['book_id']: row['orders'] for row in rows}
+
+
+def compute(book_id):
+    """Список RelatedBook для книги, отсортированный по весу"""
+    shared = _category_candidates(book_id)
+    bought = _co_purchase_candidates(book_id)
+    entries = [
+        RelatedBook(
+            book_id=book_id,
+            related_id=related_id,
+            shared_categories=shared.get(related_id, 0),
+            co_purchases=bought.get(related_id, 0),
+            score=CATEGORY_WEIGHT * shared.get(related_id, 0) + CO_PURCHASE_WEIGHT * bought.get(related_id, 0),
+        )
+        for related_id in shared.keys() | bought.keys()
+    ]
+    entries.sort(key=lambda entry: (-entry.score, entry.related_id))
+    return entries[:LIMIT]
+
+
+def stale_book_ids():
+    """Книги, похожие для которых нужно пересчитать"""
+    last_run = Book.objects.aggregate(last=Max('related_built_at'))['last']
+    stale = Q(related_built_at__isnull=True) | Q(updated_at__gt=F('related_built_at'))
+    ids = set(Book.objects.filter(stale).values_list('id', flat=True))
+    if last_run is not None:
+        # Новые заказы меняют совместные покупки всех книг в них
+        ids.update(
+            OrderItem.objects.filter(order__created_at__gt=last_run)
+            .values_list('book_id', flat=True).distinct()
+        )
+    return ids
+
+
+def rebuild(book_ids=None, batch_size=500):
+    """Пересчитывает похожие книги; по умолчанию только для устаревших"""
+    if book_ids is None:
+        book_ids = stale_book_ids()
+    book_ids = sorted(book_ids)
+    for start in range(0, len(book_ids), batch_size):
+        batch = book_ids[start:start + batch_size]
+        entries = [entry for book_id in batch for entry in compute(book_id)]
+        with transaction.atomic():
+            RelatedBook.objects.filter(book_id__in=batch).delete()
+            RelatedBook.objects.bulk_create(entries)
+            # update() не трогает updated_at, поэтому книга не станет снова устаревшей
+            Book.objects.filter(pk__in=batch).update(related_built_at=timezone.now())
+    if book_ids:
+        bump_version('recommendation')
+    return len(book_ids)
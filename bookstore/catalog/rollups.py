@@ -0,0 +1,80 @@
+"""Дневные сводки продаж и регистраций для статистики админ-панели.
+
+Сводки обновляются сигналами при создании заказа, смене его статуса или
+суммы и при регистрации или удалении пользователя (см. signals.py). Команда
+rebuild_sales_rollups пересчитывает их по исходным таблицам, читает
+сводки модуль stats.py.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySalesRollup, DailySignupRollup, Order, User
+
+
+def _bump(model, lookup, **deltas):
+    """Прибавляет значения к строке сводки, создавая ее при необходимости"""
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        model.objects.filter(**lookup).update(**changes)
+
+
+def apply_order_change(old_state, new_state):
+    """Переносит заказ из одной ячейки сводки в другую.
+
+    Состояние - кортеж (дата, статус, сумма) из Order.rollup_state(),
+    None означает отсутствие заказа (создание или удаление).
+    """
+    if old_state == new_state:
+        return
+    if old_state is not None:
+        date, status, amount = old_state
+        _bump(DailySalesRollup, {'date': date, 'status': status}, order_count=-1, revenue=-amount)
+    if new_state is not None:
+        date, status, amount = new_state
+        _bump(DailySalesRollup, {'date': date, 'status': status}, order_count=1, revenue=amount)
+
+
+def record_signup(user, delta=1):
+    """Учитывает регистрацию (delta=1) или удаление пользователя (delta=-1)"""
+    _bump(DailySignupRollup, {'date': timezone.localdate(user.date_joined)}, new_users=delta)
+
+
+def rebuild(start=None, end=None):
+    """Пересчитывает сводки за период [start, end] (по умолчанию за все время)"""
+    orders = Order.objects.all()
+    users = User.objects.all()
+    sales = DailySalesRollup.objects.all()
+    signups = DailySignupRollup.objects.all()
+    if start:
+        orders = orders.filter(created_at__date__gte=start)
+        users = users.filter(date_joined__date__gte=start)
+        sales = sales.filter(date__gte=start)
+        signups = signups.filter(date__gte=start)
+    if end:
+        orders = orders.filter(created_at__date__lte=end)
+        users = users.filter(date_joined__date__lte=end)
+        sales = sales.filter(date__lte=end)
+        signups = signups.filter(date__lte=end)
+
+    with transaction.atomic():
+        sales.delete()
+        signups.delete()
+        DailySalesRollup.objects.bulk_create([
+            DailySalesRollup(date=row['day'], status=row['status'],
+                             order_count=row['orders'], revenue=row['revenue'] or 0)
+            for row in orders.annotate(day=TruncDate('created_at')).order_by()
+            .values('day', 'status').annotate(orders=Count('id'), revenue=Sum('total_amount'))
+        ], batch_size=1000)
+        DailySignupRollup.objects.bulk_create([
+            DailySignupRollup(date=row['day'], new_users=row['users'])
+            for row in users.annotate(day=TruncDate('date_joined')).order_by()
+            .values('day').annotate(users=Count('id'))
+        ], batch_size=1000)
@@ -0,0 +1,43 @@
+"""Чтение каталога с реплик базы данных.
+
+ReplicaRouter отправляет чтение моделей каталога (книги, авторы,
+категории, издательства и предрасчитанные рекомендации) на одну из реплик
+из DATABASE_REPLICAS, но только если это разрешено для текущего запроса
+(см. middleware.ReplicaRoutingMiddleware). Все остальное - запись, корзина,
+заказы, пользователи, фоновые задачи и команды - идет в основную базу.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+CATALOG_MODELS = {'book', 'book_categories', 'author', 'category', 'publisher', 'relatedbook', 'copurchase'}
+
+# Разрешено ли читать каталог с реплики в текущем запросе
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or not replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        if model._meta.app_label != 'catalog' or model._meta.model_name not in CATALOG_MODELS:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит из основной базы вместе с репликацией
+        return db not in replicas()
@@ -0,0 +1,31 @@
+"""Счетчики продаж книг."""
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def sales_subqueries():
+    """Подзапросы с фактическими счетчиками книги по позициям заказов"""
+    from .models import OrderItem
+
+    items = OrderItem.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    return {
+        'order_count': Coalesce(Subquery(items.annotate(total=Count('id')).values('total')), Value(0)),
+        'units_sold': Coalesce(Subquery(items.annotate(total=Sum('quantity')).values('total')), Value(0)),
+    }
+
+
+def rebuild_book_sales():
+    """Пересчитывает счетчики всех книг одним UPDATE"""
+    from .models import Book
+
+    return Book.objects.update(**sales_subqueries())
+
+
+def record_sale(book_id, quantity, orders=1):
+    """Добавляет (или при отрицательных значениях вычитает) продажу книги"""
+    from .models import Book
+
+    Book.objects.filter(pk=book_id).update(
+        order_count=Greatest(F('order_count') + orders, Value(0)),
+        units_sold=Greatest(F('units_sold') + quantity, Value(0)),
+    )
@@ -0,0 +1,405 @@
+"""Полнотекстовый поиск по книгам.
+
+Инвертированный индекс строится по названию, имени автора, ISBN и описанию
+книги и обновляется сигналами при сохранении Book/Author (см. signals.py).
+На SQLite индекс хранится в виртуальной таблице FTS5, в остальных случаях
+используется индекс в памяти процесса. Оба бэкенда ранжируют результаты
+по BM25 с весами полей FIELD_WEIGHTS и отдают их постранично
+(limit/offset), без общего ограничения на число результатов. Исключение -
+search_books() на индексе в памяти: порядок передается в SQL списком id,
+поэтому в запрос попадают только RANK_LIMIT самых релевантных книг.
+"""
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, IntegerField, Q, When
+from django.db.models.expressions import RawSQL
+
+from .cache import bump_version, get_versions
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Порядок полей совпадает с порядком колонок в таблице FTS5
+FIELDS = ('title', 'author', 'isbn', 'description')
+FIELD_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+
+FTS_TABLE = 'catalog_book_fts'
+
+BATCH_SIZE = 2000
+
+# Сколько лучших книг индекс в памяти передает в SQL (см. rank_queryset)
+RANK_LIMIT = getattr(settings, 'SEARCH_RANK_LIMIT', 1000)
+
+# Версия индекса в памяти: изменения в одном процессе заставляют остальные
+# перестроить свой индекс (таблица FTS5 общая и версии не требует)
+VERSION_NAMESPACE = 'search'
+
+
+def normalize(text):
+    """Приводит текст к виду, в котором он хранится в индексе.
+
+    Регистр сворачивается через casefold() (SQLite умеет сравнивать без учета
+    регистра только ASCII), а «ё» приравнивается к «е».
+    """
+    return (text or '').casefold().replace('ё', 'е')
+
+
+def book_search_key(book):
+    return normalize(f'{book.title} {book.isbn}')
+
+
+def author_search_key(author):
+    return normalize(f'{author.first_name} {author.last_name}')
+
+
+def key_prefix_lookup(field, text):
+    """Условие «ключ начинается с text» диапазоном по индексу.
+
+    __startswith компилируется в LIKE 'text%', а LIKE без учета регистра
+    в SQLite (и без pattern_ops в PostgreSQL) индекс не использует.
+    """
+    prefix = normalize(text).strip()
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+def match_expression(query):
+    """Запрос FTS5: каждый токен ищется как префикс, все токены должны совпасть"""
+    tokens = tokenize(query)
+    return ' '.join(f'"{token}"*' for token in tokens) if tokens else None
+
+
+def book_document(book):
+    """Возвращает индексируемые поля книги в порядке FIELDS"""
+    author = book.author
+    return (
+        ' '.join(tokenize(book.title)),
+        ' '.join(tokenize(author_search_key(author))) if author else '',
+        ' '.join(tokenize(book.isbn)),
+        ' '.join(tokenize(book.description)),
+    )
+
+
+def _iter_books(book_ids=None):
+    from .models import Book
+
+    books = Book.objects.select_related('author').only(
+        'id', 'title', 'isbn', 'description', 'author__first_name', 'author__last_name'
+    )
+    if book_ids is not None:
+        books = books.filter(id__in=book_ids)
+    return books.iterator(chunk_size=BATCH_SIZE)
+
+
+class FTS5Backend:
+    """Индекс в виртуальной таблице SQLite FTS5 (создается миграцией 0002)"""
+
+    def index(self, books):
+        rows = [(book.id, *book_document(book)) for book in books]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, author, isbn, description) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove(self, book_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in book_ids])
+
+    rank_sql = f"bm25({FTS_TABLE}, {', '.join(str(weight) for weight in FIELD_WEIGHTS)})"
+
+    def search(self, query, limit=None, offset=0):
+        match = match_expression(query)
+        if match is None:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY {self.rank_sql}, rowid LIMIT %s OFFSET %s',
+                [match, -1 if limit is None else limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def rank_queryset(self, queryset, query):
+        """Фильтр и сортировка по релевантности прямо в SQL: LIMIT/OFFSET
+        страницы применяются к запросу к индексу, id в Python не выбираются"""
+        match = match_expression(query)
+        if match is None:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        matched = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        rank = RawSQL(
+            f'SELECT {self.rank_sql} FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+            [match],
+        )
+        return queryset.filter(pk__in=matched).alias(search_rank=rank).order_by('search_rank', 'pk')
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        batch = []
+        for book in _iter_books():
+            batch.append(book)
+            if len(batch) >= BATCH_SIZE:
+                self.index(batch)
+                batch = []
+        self.index(batch)
+
+
+class MemoryBackend:
+    """Инвертированный индекс в памяти процесса с ранжированием BM25.
+
+    Строится лениво при первом поиске. Изменения применяются только после
+    фиксации транзакции, чтобы откаченные правки не попадали в индекс.
+    Индекс есть в каждом процессе, поэтому изменения также увеличивают
+    версию 'search', и процесс с устаревшей версией перестраивает индекс.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._rebuilding = False
+        self.version = None
+        self._clear()
+
+    def _clear(self):
+        self.postings = defaultdict(dict)  # токен -> {book_id: взвешенная частота}
+        self.doc_terms = {}                # book_id -> токены документа
+        self.doc_lengths = {}
+        self.total_length = 0.0
+        self.vocabulary = []               # отсортированный список токенов для поиска по префиксу
+
+    def _add(self, book_id, document):
+        self._discard(book_id)
+        frequencies = defaultdict(float)
+        length = 0.0
+        for text, weight in zip(document, FIELD_WEIGHTS):
+            for token in text.split():
+                frequencies[token] += weight
+                length += weight
+        for token, frequency in frequencies.items():
+            postings = self.postings[token]
+            if not postings:
+                bisect.insort(self.vocabulary, token)
+            postings[book_id] = frequency
+        self.doc_terms[book_id] = tuple(frequencies)
+        self.doc_lengths[book_id] = length
+        self.total_length += length
+
+    def _discard(self, book_id):
+        terms = self.doc_terms.pop(book_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(book_id)
+        for token in terms:
+            postings = self.postings[token]
+            postings.pop(book_id, None)
+            if not postings:
+                del self.postings[token]
+                position = bisect.bisect_left(self.vocabulary, token)
+                if position < len(self.vocabulary) and self.vocabulary[position] == token:
+                    del self.vocabulary[position]
+
+    def _build(self):
+        # Версию читаем до данных: изменения во время построения увеличат ее снова
+        version = get_versions(VERSION_NAMESPACE)[VERSION_NAMESPACE]
+        fresh = MemoryBackend()
+        for book in _iter_books():
+            fresh._add(book.id, book_document(book))
+        # Запросы читают старый индекс, пока строится новый
+        with self._lock:
+            self.postings, self.doc_terms, self.doc_lengths = fresh.postings, fresh.doc_terms, fresh.doc_lengths
+            self.total_length, self.vocabulary = fresh.total_length, fresh.vocabulary
+            self.version = version
+            self._built = True
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._build()
+            return
+        if get_versions(VERSION_NAMESPACE)[VERSION_NAMESPACE] == self.version:
+            return
+        # Индекс изменил другой процесс. Перестраивает один запрос,
+        # остальные тем временем ищут по предыдущему индексу
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        try:
+            self._build()
+        finally:
+            self._rebuilding = False
+
+    def _expand(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + '\U0010ffff')
+        return self.vocabulary[start:end]
+
+    def _advance_version(self):
+        # Изменение уже применено к индексу этого процесса. Если версия ушла
+        # дальше, чем на собственное увеличение, индекс менял и другой процесс:
+        # тогда версия остается старой и индекс перестроится при поиске
+        current = get_versions(VERSION_NAMESPACE)[VERSION_NAMESPACE]
+        if current == self.version + 1:
+            self.version = current
+
+    def index(self, books):
+        documents = [(book.id, book_document(book)) for book in books]
+        # on_commit bump_version выполняется раньше apply, зарегистрированного ниже
+        bump_version(VERSION_NAMESPACE)
+
+        def apply():
+            if not self._built:
+                return
+            with self._lock:
+                for book_id, document in documents:
+                    self._add(book_id, document)
+                self._advance_version()
+
+        transaction.on_commit(apply)
+
+    def remove(self, book_ids):
+        book_ids = list(book_ids)
+        bump_version(VERSION_NAMESPACE)
+
+        def apply():
+            if not self._built:
+                return
+            with self._lock:
+                for book_id in book_ids:
+                    self._discard(book_id)
+                self._advance_version()
+
+        transaction.on_commit(apply)
+
+    def search(self, query, limit=None, offset=0):
+        ranked = self._ranked(query)
+        return ranked[offset:None if limit is None else offset + limit]
+
+    def rank_queryset(self, queryset, query):
+        # Каждая книга - отдельный WHEN в SQL, поэтому их число ограничено
+        book_ids = self._ranked(query)[:RANK_LIMIT]
+        if not book_ids:
+            return queryset.none()
+        rank = Case(
+            *[When(pk=pk, then=position) for position, pk in enumerate(book_ids)],
+            output_field=IntegerField(),
+        )
+        return queryset.filter(pk__in=book_ids).alias(search_rank=rank).order_by('search_rank')
+
+    def _ranked(self, query):
+        """Все найденные id по убыванию релевантности"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        self._ensure_built()
+        with self._lock:
+            total_docs = len(self.doc_lengths)
+            if not total_docs:
+                return []
+            avg_length = self.total_length / total_docs
+            scores = None
+            for token in tokens:
+                token_scores = defaultdict(float)
+                for term in self._expand(token):
+                    postings = self.postings[term]
+                    idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for book_id, frequency in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[book_id] / avg_length)
+                        token_scores[book_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    # Документ должен содержать все токены запроса
+                    scores = {
+                        book_id: score + token_scores[book_id]
+                        for book_id, score in scores.items()
+                        if book_id in token_scores
+                    }
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [book_id for book_id, _ in ranked]
+
+    def rebuild(self):
+        self._build()
+
+
+_fts5_backend = FTS5Backend()
+_memory_backend = MemoryBackend()
+_fts5_available = None
+
+
+def _has_fts5_table():
+    global _fts5_available
+    if _fts5_available is None:
+        if connection.vendor != 'sqlite':
+            _fts5_available = False
+        else:
+            try:
+                _fts5_available = FTS_TABLE in connection.introspection.table_names()
+            except OperationalError:
+                _fts5_available = False
+    return _fts5_available
+
+
+def get_backend():
+    """Выбирает бэкенд по настройке SEARCH_BACKEND: 'auto', 'fts5' или 'memory'"""
+    name = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if name == 'memory':
+        return _memory_backend
+    if name == 'fts5' or _has_fts5_table():
+        return _fts5_backend
+    return _memory_backend
+
+
+def index_books(books):
+    get_backend().index(books)
+
+
+def index_books_by_id(book_ids):
+    get_backend().index(list(_iter_books(book_ids)))
+
+
+def remove_books(book_ids):
+    get_backend().remove(book_ids)
+
+
+def rebuild_index():
+    get_backend().rebuild()
+
+
+def search_book_ids(query, limit=None, offset=0):
+    """Возвращает страницу id книг, отсортированных по релевантности"""
+    return get_backend().search(query, limit, offset)
+
+
+def search_books(query, queryset=None):
+    """Фильтрует queryset книг по запросу и сортирует по релевантности.
+
+    Queryset остается ленивым: страницу выбирает срез (пагинатор), а не
+    заранее ограниченный список id.
+    """
+    from .models import Book
+
+    if queryset is None:
+        queryset = Book.objects.all()
+    return get_backend().rank_queryset(queryset, query)
@@ -1,8 +1,250 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from django.contrib.auth import authenticate
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models import FileField, Prefetch
 from .models import User, Book, Category, Author, Publisher, Order, OrderItem, Cart, CartItem
 
-class UserSerializer(serializers.ModelSerializer):
+class QueryPlanMixin:
+    """Сериализатор сам описывает, какие связи нужно подгрузить.
+
+    В Meta указываются select_related и prefetch_related для собственных полей,
+    а связи вложенных сериализаторов добавляются автоматически: вложенный
+    объект подтягивается через select_related, вложенный список - через
+    Prefetch с queryset, подготовленным дочерним сериализатором.
+    """
+
+    @classmethod
+    def get_query_plan(cls):
+        meta = getattr(cls, 'Meta', None)
+        select = list(getattr(meta, 'select_related', ()))
+        prefetch = list(getattr(meta, 'prefetch_related', ()))
+
+        for name, field in cls._declared_fields.items():
+            many = isinstance(field, serializers.ListSerializer)
+            child = field.child if many else field
+            if not isinstance(child, QueryPlanMixin):
+                continue
+            source = field.source or name
+            if many:
+                queryset = child.setup_queryset(child.Meta.model._default_manager.all())
+                prefetch.append(Prefetch(source, queryset=queryset))
+                continue
+            child_select, child_prefetch = child.get_query_plan()
+            _add_child_plan(select, prefetch, source, child_select, child_prefetch)
+        return select, prefetch
+
+    @classmethod
+    def setup_queryset(cls, queryset):
+        select, prefetch = cls.get_query_plan()
+        return _apply_plan(queryset, select, prefetch)
+
+
+def _add_child_plan(select, prefetch, source, child_select, child_prefetch):
+    select.append(source)
+    select.extend(f'{source}__{lookup}' for lookup in child_select)
+    for lookup in child_prefetch:
+        if isinstance(lookup, Prefetch):
+            prefetch.append(Prefetch(f'{source}__{lookup.prefetch_through}', queryset=lookup.queryset))
+        else:
+            prefetch.append(f'{source}__{lookup}')
+
+
+def _apply_plan(queryset, select, prefetch):
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def _lookup_path(lookup):
+    return lookup.prefetch_through if isinstance(lookup, Prefetch) else lookup
+
+
+def parse_selection(value):
+    """'id,items.book.title' -> {'id': {}, 'items': {'book': {'title': {}}}}"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for part in path.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def selection_params(request):
+    """Значения ?fields= и ?expand= запроса на чтение (None, если параметра нет)"""
+    if request is None or request.method not in SAFE_METHODS:
+        return None, None
+    params = getattr(request, 'query_params', request.GET)
+    return params.get('fields'), params.get('expand')
+
+
+class SparseFieldsMixin(QueryPlanMixin):
+    """Набор полей ответа задается параметрами ?fields= и ?expand=.
+
+    fields=id,title,items.quantity оставляет только перечисленные поля,
+    поля вложенных сериализаторов указываются через точку.
+    expand=items.book перечисляет связи из Meta.expandable, которые нужно
+    отдать вложенными объектами, остальные связи из Meta.expandable
+    отдаются id. Без параметров ответ не меняется. Параметры учитываются
+    только в запросах на чтение, чтобы не мешать валидации при записи.
+
+    plan_queryset() подгружает связи и колонки только для выбранных полей.
+    """
+
+    def get_selection(self, param):
+        root = self.root
+        params = root.__dict__.get('_selection_params')
+        if params is None:
+            fields, expand = selection_params(root.context.get('request'))
+            params = root._selection_params = {
+                'fields': parse_selection(fields) if fields is not None else None,
+                'expand': parse_selection(expand) if expand is not None else None,
+            }
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        selection = params[param]
+        for name in reversed(path):
+            if selection is None:
+                break
+            selection = selection.get(name)
+        return selection
+
+    @property
+    def is_sparse(self):
+        return self.get_selection('fields') is not None or self.get_selection('expand') is not None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand = self.get_selection('expand')
+        if expand is not None:
+            for name, serializer_class in getattr(self.Meta, 'expandable', {}).items():
+                if name in fields:
+                    fields[name] = self._expandable_field(name, fields[name], serializer_class, name in expand)
+        selected = self.get_selection('fields')
+        if selected:
+            fields = {name: field for name, field in fields.items() if name in selected}
+        return fields
+
+    def _expandable_field(self, name, field, serializer_class, expand):
+        if isinstance(field, serializers.BaseSerializer) == expand:
+            return field
+        kwargs = {'read_only': True}
+        if isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+            kwargs['many'] = True
+        if field.source not in (None, name):
+            kwargs['source'] = field.source
+        if expand:
+            return serializer_class(**kwargs)
+        return serializers.PrimaryKeyRelatedField(**kwargs)
+
+    def plan_queryset(self, queryset, required=()):
+        """setup_queryset с учетом ?fields= и ?expand=.
+
+        Если набор полей сокращен, связи подгружаются только для выбранных
+        полей, а лишние колонки откладываются через only(). required -
+        колонки, которые нужны вызывающему коду (например, поле сортировки).
+        """
+        if not self.is_sparse:
+            return self.setup_queryset(queryset)
+        return self._plan_queryset(queryset, required)
+
+    def _plan_queryset(self, queryset, required=()):
+        select, prefetch = self._instance_query_plan()
+        queryset = _apply_plan(queryset, select, prefetch)
+        columns = self.get_only_fields()
+        joined = queryset.query.select_related
+        if columns is None or joined is True:
+            return queryset
+        # Связи, которые queryset уже подтягивает, нельзя откладывать
+        if joined:
+            required = [*required, *joined]
+        return queryset.only(*columns, *required)
+
+    def _instance_query_plan(self):
+        """get_query_plan по полям этого экземпляра"""
+        opts = self.Meta.model._meta
+        select = list(getattr(self.Meta, 'select_related', ()))
+        prefetch = list(getattr(self.Meta, 'prefetch_related', ()))
+        sources = {field.source.split('.')[0] for field in self.fields.values()}
+        # source='*' (SerializerMethodField) может читать любые связи из Meta
+        if '*' not in sources:
+            select = [lookup for lookup in select if lookup.split('__')[0] in sources]
+            prefetch = [lookup for lookup in prefetch if _lookup_path(lookup).split('__')[0] in sources]
+
+        id_lists = []
+        for field in self.fields.values():
+            if field.write_only:
+                continue
+            source = field.source
+            if isinstance(field, serializers.ManyRelatedField):
+                id_lists.append(source)
+                continue
+            many = isinstance(field, serializers.ListSerializer)
+            child = field.child if many else field
+            if not isinstance(child, QueryPlanMixin):
+                continue
+            if many:
+                queryset = child.Meta.model._default_manager.all()
+                if isinstance(child, SparseFieldsMixin):
+                    queryset = child._plan_queryset(queryset, _reverse_fk(opts, source))
+                else:
+                    queryset = child.setup_queryset(queryset)
+                prefetch.append(Prefetch(source, queryset=queryset))
+                continue
+            if isinstance(child, SparseFieldsMixin):
+                child_select, child_prefetch = child._instance_query_plan()
+            else:
+                child_select, child_prefetch = child.get_query_plan()
+            _add_child_plan(select, prefetch, source, child_select, child_prefetch)
+
+        # Списки id без вложенного сериализатора: только ключи связанных строк
+        seen = {_lookup_path(lookup) for lookup in prefetch}
+        for source in id_lists:
+            if source not in seen:
+                related_model = opts.get_field(source).related_model
+                queryset = related_model._default_manager.only('pk', *_reverse_fk(opts, source))
+                prefetch.append(Prefetch(source, queryset=queryset))
+        return select, prefetch
+
+    def get_only_fields(self):
+        """Колонки модели для only() или None, если какое-то поле читает не только колонки"""
+        opts = self.Meta.model._meta
+        columns = [opts.pk.name]
+        for field in self.fields.values():
+            if field.write_only:
+                continue
+            head, _, rest = field.source.partition('.')
+            try:
+                model_field = opts.get_field(head)
+            except FieldDoesNotExist:
+                return None
+            if model_field.many_to_many or model_field.one_to_many:
+                continue
+            if rest or not model_field.concrete:
+                return None
+            if head not in columns:
+                columns.append(head)
+            if isinstance(field, SparseFieldsMixin):
+                child_columns = field.get_only_fields()
+                if child_columns is not None:
+                    columns.extend(f'{head}__{column}' for column in child_columns)
+        return columns
+
+
+def _reverse_fk(opts, source):
+    """Внешний ключ связанной модели, по которому prefetch раскладывает строки"""
+    model_field = opts.get_field(source)
+    return (model_field.field.name,) if model_field.one_to_many else ()
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 
@@ -35,23 +277,39 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         )
         return user
 
-class CategorySerializer(serializers.ModelSerializer):
+class BooksCountMixin:
+    """books_count только в ответах о самой категории, авторе или издательстве.
+
+    Внутри книги счетчик не отдается: фрагменты книг (см. fragments.py)
+    не сбрасываются, когда у соседних книг меняется автор или категории.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            fields.pop('books_count', None)
+        return fields
+
+class CategorySerializer(BooksCountMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'description']
+        fields = ['id', 'name', 'slug', 'description', 'books_count']
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorSerializer(BooksCountMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Author
-        fields = ['id', 'first_name', 'last_name', 'bio', 'birth_date', 'website']
+        fields = ['id', 'first_name', 'last_name', 'bio', 'birth_date', 'website', 'books_count']
 
-class PublisherSerializer(serializers.ModelSerializer):
+class PublisherSerializer(BooksCountMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Publisher
-        fields = ['id', 'name', 'address', 'website']
+        fields = ['id', 'name', 'address', 'website', 'books_count']
 
-class BookSerializer(serializers.ModelSerializer):
-    author_name = serializers.CharField(source='author.__str__', read_only=True)
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    author_name = serializers.SerializerMethodField()
     categories_list = CategorySerializer(source='categories', many=True, read_only=True)
     
     class Meta:
@@ -59,8 +317,201 @@ class BookSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'slug', 'author', 'author_name', 'publisher', 
                  'categories', 'categories_list', 'isbn', 'description', 'price', 
                  'stock_quantity', 'image', 'created_at', 'updated_at']
+        # author_name читает автора, categories использует кэш categories_list
+        select_related = ['author']
+        expandable = {'author': AuthorSerializer, 'publisher': PublisherSerializer}
+
+    def get_author_name(self, book):
+        return str(book.author) if book.author_id is not None else None
+
+
+class ValuesSerializer:
+    """Быстрый сериализатор только для чтения по строкам .values().
+
+    Поля и форматирование значений берутся из model_serializer, поэтому
+    ответ совпадает с ответом обычного сериализатора байт в байт, но объекты
+    моделей не создаются: выбираются только нужные колонки, а связи
+    многие-ко-многим подгружаются одним запросом на всю страницу.
+
+    Поддерживаются поля модели, внешние ключи (PrimaryKeyRelatedField),
+    вложенные объекты по внешнему ключу, списки id и вложенные сериализаторы
+    для многие-ко-многим. Для SerializerMethodField подкласс определяет метод
+    get_<поле>(row), а нужные ему колонки перечисляет в method_columns.
+    Набор полей учитывает ?fields= и ?expand= (см. SparseFieldsMixin).
+    """
+    model_serializer = None
+    method_columns = {}
+
+    def __init__(self, model_serializer=None, context=None, fields=None):
+        if model_serializer is not None:
+            self.model_serializer = model_serializer
+        self.context = context or {}
+        if fields is None:
+            fields = self.model_serializer(context=self.context).fields
+        self.fields = fields
+        self.model = self.model_serializer.Meta.model
+        self.related = {}
+        self._compile()
+
+    def _compile(self):
+        opts = self.model._meta
+        self.pk_column = opts.pk.name
+        self.columns = [self.pk_column]
+        self.readers = []
+        self.relations = {}
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                self.readers.append((name, self._method_reader(name, field)))
+            elif isinstance(field, (serializers.ManyRelatedField, serializers.ListSerializer)):
+                self.readers.append((name, self._many_reader(name, field)))
+            elif isinstance(field, serializers.BaseSerializer):
+                self.readers.append((name, self._nested_reader(name, field)))
+            else:
+                self.readers.append((name, self._column_reader(name, field)))
+
+    def _add_columns(self, columns):
+        self.columns.extend(column for column in columns if column not in self.columns)
+
+    def _method_reader(self, name, field):
+        method = getattr(self, field.method_name, None)
+        if method is None:
+            raise ImproperlyConfigured(f'{type(self).__name__}: для поля {name} нужен метод {field.method_name}(row)')
+        self._add_columns(self.method_columns.get(name, ()))
+        return method
+
+    def _model_field(self, name, source):
+        try:
+            return self.model._meta.get_field(source)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(
+                f'{type(self).__name__}: поле {name} (source={source!r}) не является полем модели'
+            )
+
+    def _column_reader(self, name, field):
+        model_field = self._model_field(name, field.source)
+        if model_field.many_to_many or model_field.one_to_many:
+            raise ImproperlyConfigured(f'{type(self).__name__}: поле {name} должно быть списком')
+        column = field.source
+        self._add_columns([column])
+
+        if isinstance(model_field, FileField):
+            # Обложка хранится именем файла, ссылку строит хранилище поля
+            def convert(value):
+                return field.to_representation(model_field.attr_class(None, model_field, value))
+        elif isinstance(field, serializers.RelatedField):
+            # values() по внешнему ключу уже возвращает id
+            pk_field = getattr(field, 'pk_field', None)
+            convert = pk_field.to_representation if pk_field is not None else None
+        else:
+            convert = field.to_representation
+
+        if convert is None:
+            return lambda row: row[column]
+
+        def read(row):
+            value = row[column]
+            return None if value is None else convert(value)
+        return read
+
+    def _many_reader(self, name, field):
+        model_field = self._model_field(name, field.source)
+        if not model_field.many_to_many or model_field.auto_created:
+            raise ImproperlyConfigured(
+                f'{type(self).__name__}: список {name} поддерживается только для ManyToManyField'
+            )
+        if isinstance(field, serializers.ListSerializer):
+            child = ValuesSerializer(type(field.child), self.context, field.child.fields)
+            if child.relations:
+                raise ImproperlyConfigured(f'{type(self).__name__}: вложенные списки в {name} не поддерживаются')
+            convert = child.to_representation
+        else:
+            pk_field = getattr(field.child_relation, 'pk_field', None)
+            child = None
+            convert = pk_field.to_representation if pk_field is not None else None
+
+        self.relations.setdefault(field.source, (model_field, []))[1].append(child)
+        source = field.source
+
+        def read(row):
+            items = self.related[source].get(row[self.pk_column], [])
+            if child is not None:
+                return [convert(item) for item in items]
+            pks = [item['pk'] for item in items]
+            return [convert(pk) for pk in pks] if convert is not None else pks
+        return read
+
+    def _nested_reader(self, name, field):
+        model_field = self._model_field(name, field.source)
+        if not (model_field.many_to_one or model_field.one_to_one) or not model_field.concrete:
+            raise ImproperlyConfigured(f'{type(self).__name__}: вложенный объект {name} поддерживается только для ForeignKey')
+        child = ValuesSerializer(type(field), self.context, field.fields)
+        if child.relations:
+            raise ImproperlyConfigured(f'{type(self).__name__}: вложенные списки в {name} не поддерживаются')
+        prefix = f'{field.source}__'
+        self._add_columns(prefix + column for column in child.columns)
+        pk_column = prefix + child.pk_column
+
+        def read(row):
+            if row[pk_column] is None:
+                return None
+            return child.to_representation({column: row[prefix + column] for column in child.columns})
+        return read
+
+    def setup_queryset(self, queryset, required=()):
+        """Queryset строк .values() только с нужными колонками и колонками из required"""
+        columns = self.columns + [column for column in required if column not in self.columns]
+        return queryset.prefetch_related(None).values(*columns)
+
+    def load_related(self, rows):
+        """Один запрос на каждую связь многие-ко-многим для всех строк сразу"""
+        pks = [row[self.pk_column] for row in rows]
+        self.related = {}
+        for source, (model_field, children) in self.relations.items():
+            owner = model_field.related_query_name()
+            columns = ['pk']
+            for child in children:
+                if child is not None:
+                    columns.extend(column for column in child.columns if column not in columns)
+            # Порядок как у prefetch_related: сортировка связанной модели по умолчанию
+            queryset = model_field.related_model._default_manager.filter(**{f'{owner}__in': pks})
+            grouped = self.related[source] = {}
+            for item in queryset.values(owner, *columns):
+                grouped.setdefault(item[owner], []).append(item)
+
+    def to_representation(self, row):
+        return {name: read(row) for name, read in self.readers}
+
+    def serialize(self, rows):
+        rows = list(rows)
+        if self.relations:
+            self.load_related(rows)
+        return [self.to_representation(row) for row in rows]
+
+
+class CategoryValuesSerializer(ValuesSerializer):
+    model_serializer = CategorySerializer
+
+
+class AuthorValuesSerializer(ValuesSerializer):
+    model_serializer = AuthorSerializer
+
+
+class PublisherValuesSerializer(ValuesSerializer):
+    model_serializer = PublisherSerializer
+
+
+class BookValuesSerializer(ValuesSerializer):
+    model_serializer = BookSerializer
+    method_columns = {'author_name': ('author', 'author__last_name', 'author__first_name')}
+
+    def get_author_name(self, row):
+        if row['author'] is None:
+            return None
+        return Author.full_name(row['author__first_name'], row['author__last_name'])
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
     book_id = serializers.PrimaryKeyRelatedField(
         queryset=Book.objects.all(), 
@@ -73,7 +524,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['id', 'book', 'book_id', 'quantity', 'total_price', 'added_at']
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -82,15 +533,16 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['id', 'user', 'items', 'total_items', 'total_price', 'created_at', 'updated_at']
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
 
     class Meta:
         model = OrderItem
         fields = ['id', 'book', 'quantity', 'price', 'total_price']
+        expandable = {'book': BookSerializer}
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     user = UserSerializer(read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
@@ -99,13 +551,15 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['id', 'user', 'created_at', 'updated_at', 'total_amount', 
                  'status', 'status_display', 'shipping_address', 'items']
+        expandable = {'user': UserSerializer, 'items': OrderItemSerializer}
 
-class OrderCreateSerializer(serializers.ModelSerializer):
+class OrderCreateSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
         fields = ['id', 'shipping_address', 'items', 'total_amount', 'status']
+        expandable = {'items': OrderItemSerializer}
 
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
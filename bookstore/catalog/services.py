@@ -0,0 +1,202 @@
+"""Бизнес-операции, которые затрагивают несколько моделей сразу."""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, PositiveIntegerField, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .cache import bump_version, invalidate_cart_badge
+from .models import Book, Cart, CartItem, Order, OrderItem, StockHold
+
+# Сколько держится резерв товара, добавленного в корзину
+HOLD_TTL = getattr(settings, 'CART_HOLD_TTL', timedelta(minutes=15))
+
+
+class CheckoutError(Exception):
+    """Заказ не может быть оформлен"""
+
+
+class EmptyCartError(CheckoutError):
+    def __init__(self):
+        super().__init__('Корзина пуста')
+
+
+class InsufficientStockError(CheckoutError):
+    def __init__(self, titles):
+        self.titles = titles
+        super().__init__(f"Недостаточно товара: {', '.join(titles)}")
+
+
+def _per_book(lines, values):
+    """CASE id WHEN ... THEN ... END для построчных значений в одном UPDATE"""
+    return Case(
+        *[When(pk=line['book_id'], then=Value(values(line))) for line in lines],
+        output_field=PositiveIntegerField(),
+    )
+
+
+def hold_stock(cart_item):
+    """Резервирует под позицию корзины ее текущее количество.
+
+    Доступный остаток (stock_quantity - reserved_quantity) проверяется и
+    меняется одним условным UPDATE, поэтому проверка не требует суммирования
+    резервов. Если товара не хватает, сначала освобождаются просроченные
+    резервы, и попытка повторяется один раз.
+    """
+    with transaction.atomic():
+        hold = StockHold.objects.select_for_update().filter(cart_item=cart_item).first()
+        delta = cart_item.quantity - (hold.quantity if hold else 0)
+        if delta > 0 and not _reserve(cart_item.book_id, delta):
+            release_expired_holds()
+            if not _reserve(cart_item.book_id, delta):
+                raise InsufficientStockError([cart_item.book.title])
+        elif delta < 0:
+            _unreserve({cart_item.book_id: -delta})
+
+        expires_at = timezone.now() + HOLD_TTL
+        if hold:
+            hold.quantity = cart_item.quantity
+            hold.expires_at = expires_at
+            hold.save(update_fields=['quantity', 'expires_at'])
+        else:
+            hold = StockHold.objects.create(
+                cart_item=cart_item,
+                book_id=cart_item.book_id,
+                quantity=cart_item.quantity,
+                expires_at=expires_at,
+            )
+    return hold
+
+
+def _reserve(book_id, quantity):
+    return Book.objects.filter(
+        pk=book_id,
+        stock_quantity__gte=F('reserved_quantity') + quantity,
+    ).update(reserved_quantity=F('reserved_quantity') + quantity)
+
+
+def _unreserve(quantities):
+    """Уменьшает reserved_quantity книг одним UPDATE: {book_id: количество}"""
+    if not quantities:
+        return
+    released = Case(
+        *[When(pk=book_id, then=Value(quantity)) for book_id, quantity in quantities.items()],
+        output_field=PositiveIntegerField(),
+    )
+    Book.objects.filter(pk__in=quantities).update(
+        reserved_quantity=Greatest(F('reserved_quantity') - released, Value(0))
+    )
+
+
+def release_holds(holds):
+    """Снимает резервы из queryset набором запросов, не зависящим от их числа"""
+    with transaction.atomic():
+        quantities = dict(
+            holds.order_by().values('book_id').annotate(total=Sum('quantity'))
+            .values_list('book_id', 'total')
+        )
+        _unreserve(quantities)
+        # Обнуляем количество, чтобы сигнал post_delete не списал резерв повторно
+        holds.update(quantity=0)
+        holds.delete()
+    return sum(quantities.values())
+
+
+def release_expired_holds():
+    return release_holds(StockHold.objects.filter(expires_at__lte=timezone.now()))
+
+
+def release_hold(hold):
+    """Снимает один резерв (вызывается из сигнала post_delete StockHold)"""
+    if hold.quantity:
+        _unreserve({hold.book_id: hold.quantity})
+
+
+def place_order(user, shipping_address, delivery_method='pickup', delivery_cost=0):
+    """Оформляет заказ из корзины пользователя в одной транзакции.
+
+    Резервы корзины снимаются, позиции создаются одним bulk_create, остатки
+    списываются одним условным UPDATE (свободный остаток >= n) вместе с
+    обновлением счетчиков продаж, корзина
+    очищается одним DELETE. Если хотя бы одной книги не хватает, транзакция
+    откатывается целиком.
+    """
+    try:
+        return _place_order(user, shipping_address, delivery_method, delivery_cost)
+    except _StockConflict as conflict:
+        # После отката резервы этой корзины снова входят в reserved_quantity,
+        # поэтому вычитаем их, как это делает _place_order
+        own_held = (
+            StockHold.objects.filter(book=OuterRef('pk'), cart_item__cart__user=user)
+            .order_by().values('book').annotate(total=Sum('quantity')).values('total')
+        )
+        short = Book.objects.annotate(
+            own_held=Coalesce(Subquery(own_held), 0),
+        ).filter(
+            pk__in=[line['book_id'] for line in conflict.lines],
+            stock_quantity__lt=(
+                F('reserved_quantity') - F('own_held')
+                + _per_book(conflict.lines, lambda line: line['quantity'])
+            ),
+        )
+        raise InsufficientStockError(list(short.values_list('title', flat=True))) from None
+
+
+class _StockConflict(Exception):
+    def __init__(self, lines):
+        self.lines = lines
+
+
+def _place_order(user, shipping_address, delivery_method, delivery_cost):
+    with transaction.atomic():
+        lines = list(
+            CartItem.objects.filter(cart__user=user)
+            .values('book_id', 'quantity', 'book__price')
+        )
+        if not lines:
+            raise EmptyCartError()
+
+        # Резервы этой корзины переходят в списание со склада
+        release_holds(StockHold.objects.filter(cart_item__cart__user=user))
+
+        book_ids = [line['book_id'] for line in lines]
+        needed = _per_book(lines, lambda line: line['quantity'])
+        updated = Book.objects.filter(
+            pk__in=book_ids,
+            stock_quantity__gte=F('reserved_quantity') + needed,
+        ).update(
+            stock_quantity=F('stock_quantity') - needed,
+            order_count=F('order_count') + 1,
+            units_sold=F('units_sold') + needed,
+            updated_at=timezone.now(),
+        )
+        if updated != len(book_ids):
+            raise _StockConflict(lines)
+        # Остатки входят в ответы каталога (см. conditional.py)
+        bump_version('book')
+
+        items_total = sum(line['quantity'] * line['book__price'] for line in lines)
+        total = items_total + delivery_cost
+        order = Order.objects.create(
+            user=user,
+            delivery_method=delivery_method,
+            delivery_cost=delivery_cost,
+            shipping_address=shipping_address,
+            total_price=total,
+            total_amount=total,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                book_id=line['book_id'],
+                quantity=line['quantity'],
+                price=line['book__price'],
+            )
+            for line in lines
+        ])
+        CartItem.objects.filter(cart__user=user).delete()
+        Cart.objects.filter(user=user).update(item_count=0, subtotal=0)
+        invalidate_cart_badge(user.pk)
+    return order
@@ -0,0 +1,226 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import counters, rollups, search, suggest
+from .cache import bump_version
+from .models import Author, Book, Cart, Category, Order, OrderItem, Publisher, StockHold, User
+from .sales import record_sale
+from .services import release_hold
+
+
+# Нормализованные ключи поиска
+@receiver(pre_save, sender=Book)
+def set_book_search_key(sender, instance, **kwargs):
+    instance.search_key = search.book_search_key(instance)
+
+
+@receiver(pre_save, sender=Author)
+def set_author_search_key(sender, instance, **kwargs):
+    instance.search_key = search.author_search_key(instance)
+
+
+# Поисковый индекс
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    search.index_books([instance])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    search.remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def reindex_author_books(sender, instance, created, **kwargs):
+    if not created:
+        search.index_books_by_id(instance.books.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+def remember_author_books(sender, instance, **kwargs):
+    # После удаления автора у книг обнуляется author_id, поэтому id книг запоминаем заранее
+    instance._book_ids = list(instance.books.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def reindex_orphaned_books(sender, instance, **kwargs):
+    search.index_books_by_id(getattr(instance, '_book_ids', []))
+
+
+# Подсказки автодополнения
+@receiver(post_save, sender=Book)
+def update_book_suggestions(sender, instance, **kwargs):
+    suggest.index.update(suggest.BOOK, instance.pk, suggest.book_entries(instance))
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_suggestions(sender, instance, **kwargs):
+    suggest.index.remove(suggest.BOOK, instance.pk)
+
+
+@receiver(post_save, sender=Author)
+def update_author_suggestions(sender, instance, **kwargs):
+    suggest.index.update(suggest.AUTHOR, instance.pk, suggest.author_entries(instance))
+
+
+@receiver(post_delete, sender=Author)
+def remove_author_suggestions(sender, instance, **kwargs):
+    suggest.index.remove(suggest.AUTHOR, instance.pk)
+
+
+# Резервы товара
+@receiver(post_delete, sender=StockHold)
+def release_deleted_hold(sender, instance, **kwargs):
+    release_hold(instance)
+
+
+# Версии данных для кэша
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def bump_book_version(sender, **kwargs):
+    # Заказы меняют книги через update() и 'home' не увеличивают
+    bump_version('book', 'home')
+
+
+@receiver(post_save, sender=Author)
+def bump_author_version(sender, **kwargs):
+    bump_version('author')
+
+
+@receiver(post_save, sender=Category)
+def bump_category_version(sender, **kwargs):
+    bump_version('category')
+
+
+@receiver(post_save, sender=Publisher)
+def bump_publisher_version(sender, **kwargs):
+    bump_version('publisher')
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Publisher)
+def bump_versions_on_delete(sender, **kwargs):
+    # Удаление меняет книги массово (SET_NULL, строки m2m) без сигналов Book
+    bump_version(sender._meta.model_name, 'book')
+
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def book_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Категории входят в представление книги, поэтому у книг обновляется
+    # updated_at (см. fragments.py), а у категорий - books_count. Перед
+    # clear() запоминаются книги категории или категории книги
+    if action == 'pre_clear':
+        if reverse:
+            instance._cleared_book_ids = list(instance.books.values_list('pk', flat=True))
+        else:
+            instance._cleared_category_ids = list(instance.categories.values_list('pk', flat=True))
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        book_ids = [instance.pk]
+        category_ids = instance.__dict__.pop('_cleared_category_ids', []) if action == 'post_clear' else pk_set
+    else:
+        book_ids = instance.__dict__.pop('_cleared_book_ids', []) if action == 'post_clear' else pk_set
+        category_ids = [instance.pk]
+    Book.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
+    bump_version('book')
+    counters.recount(Category, category_ids)
+
+
+# Счетчики книг (см. counters.py)
+@receiver(pre_save, sender=Book)
+def load_book_counted_refs(sender, instance, raw, **kwargs):
+    if raw or hasattr(instance, '_counted_refs'):
+        return
+    stored = Book.objects.filter(pk=instance.pk).values_list('author_id', 'publisher_id').first() if instance.pk else None
+    instance._counted_refs = stored or (None, None)
+
+
+@receiver(post_save, sender=Book)
+def count_book(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    old_author_id, old_publisher_id = instance._counted_refs
+    if old_author_id != instance.author_id:
+        counters.recount(Author, [old_author_id, instance.author_id])
+    if old_publisher_id != instance.publisher_id:
+        counters.recount(Publisher, [old_publisher_id, instance.publisher_id])
+    instance._counted_refs = (instance.author_id, instance.publisher_id)
+
+
+@receiver(pre_delete, sender=Book)
+def remember_book_categories(sender, instance, **kwargs):
+    instance._category_ids = list(instance.categories.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Book)
+def uncount_book(sender, instance, **kwargs):
+    counters.recount(Author, [instance.author_id])
+    counters.recount(Publisher, [instance.publisher_id])
+    counters.recount(Category, instance.__dict__.pop('_category_ids', []))
+
+
+# Суммы корзин считаются по текущей цене книги
+@receiver(pre_save, sender=Book)
+def load_book_price(sender, instance, raw, **kwargs):
+    if raw or hasattr(instance, '_stored_price'):
+        return
+    instance._stored_price = Book.objects.filter(pk=instance.pk).values_list('price', flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender=Book)
+def reprice_carts(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if not created and instance._stored_price != instance.price:
+        Cart.reprice([instance.pk])
+    instance._stored_price = instance.price
+
+
+# Счетчики продаж. Заказы из корзины создают позиции через bulk_create,
+# их счетчики обновляет services.place_order
+@receiver(post_save, sender=OrderItem)
+def count_order_item(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        record_sale(instance.book_id, instance.quantity)
+
+
+@receiver(post_delete, sender=OrderItem)
+def uncount_order_item(sender, instance, **kwargs):
+    record_sale(instance.book_id, -instance.quantity, orders=-1)
+
+
+# Дневные сводки продаж и регистраций
+@receiver(pre_save, sender=Order)
+def load_order_rollup_state(sender, instance, raw, **kwargs):
+    if raw or hasattr(instance, '_rollup_state'):
+        return
+    stored = Order.objects.filter(pk=instance.pk).first() if instance.pk else None
+    instance._rollup_state = stored.rollup_state() if stored else None
+
+
+@receiver(post_save, sender=Order)
+def update_order_rollup(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    new_state = instance.rollup_state()
+    rollups.apply_order_change(instance._rollup_state, new_state)
+    instance._rollup_state = new_state
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_rollup(sender, instance, **kwargs):
+    rollups.apply_order_change(getattr(instance, '_rollup_state', instance.rollup_state()), None)
+
+
+@receiver(post_save, sender=User)
+def update_signup_rollup(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        rollups.record_signup(instance)
+
+
+@receiver(post_delete, sender=User)
+def remove_signup_rollup(sender, instance, **kwargs):
+    rollups.record_signup(instance, -1)
@@ -0,0 +1,137 @@
+"""Сводные показатели для статистики админ-панели.
+
+dashboard_stats() собирает все агрегаты панели минимальным числом
+сгруппированных запросов и возвращает DashboardStats. Источник данных
+задается настройкой ADMIN_STATS_SOURCE:
+'rollup' - дневные сводки (см. rollups.py), по умолчанию;
+'live'   - запросы прямо к таблице заказов, без предрасчета.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Book, DailySalesRollup, DailySignupRollup, Order, User
+
+SOURCES = ('rollup', 'live')
+
+# Статус, по которому считается выручка
+REVENUE_STATUS = 'delivered'
+
+
+@dataclass
+class DashboardStats:
+    total_books: int = 0
+    total_users: int = 0
+    new_users: int = 0
+    total_orders: int = 0
+    total_revenue: Decimal = Decimal('0')
+    recent_orders: int = 0
+    recent_revenue: Decimal = Decimal('0')
+    # [(дата, выручка)] по дням, включая дни без продаж
+    sales_by_day: list = field(default_factory=list)
+    # [{'status': ..., 'count': ...}]
+    order_stats: list = field(default_factory=list)
+
+    @property
+    def sales_data(self):
+        return [float(revenue) for day, revenue in self.sales_by_day]
+
+    @property
+    def sales_dates(self):
+        return [day.strftime('%d.%m') for day, revenue in self.sales_by_day]
+
+
+def dashboard_stats(today=None, recent_days=30, chart_days=7, source=None):
+    """Показатели панели: итоги, итоги за recent_days и график за chart_days"""
+    source = source or getattr(settings, 'ADMIN_STATS_SOURCE', 'rollup')
+    if source not in SOURCES:
+        raise ValueError(f'Неизвестный источник статистики: {source}')
+    today = today or timezone.localdate()
+    since = today - timedelta(days=recent_days)
+    chart_start = today - timedelta(days=chart_days - 1)
+
+    stats = DashboardStats(total_books=Book.objects.count())
+    if source == 'live':
+        _live_orders(stats, since, chart_start, today)
+        _live_users(stats, since)
+    else:
+        _rollup_orders(stats, since, chart_start, today)
+        _rollup_users(stats, since)
+    return stats
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _fill_days(start, end, revenue):
+    days = (end - start).days + 1
+    return [(start + timedelta(days=i), revenue.get(start + timedelta(days=i), Decimal('0'))) for i in range(days)]
+
+
+def _live_orders(stats, since, chart_start, today):
+    recent = Q(created_at__gte=_day_start(since))
+    _apply_status_rows(stats, Order.objects.order_by().values('status').annotate(
+        orders=Count('id'),
+        amount=Sum('total_amount'),
+        recent_orders=Count('id', filter=recent),
+        recent_amount=Sum('total_amount', filter=recent),
+    ))
+    by_day = dict(
+        Order.objects.filter(status=REVENUE_STATUS, created_at__gte=_day_start(chart_start))
+        .annotate(day=TruncDate('created_at')).order_by()
+        .values('day').annotate(revenue=Sum('total_amount'))
+        .values_list('day', 'revenue')
+    )
+    stats.sales_by_day = _fill_days(chart_start, today, by_day)
+
+
+def _rollup_orders(stats, since, chart_start, today):
+    recent = Q(date__gte=since)
+    _apply_status_rows(stats, DailySalesRollup.objects.order_by().values('status').annotate(
+        orders=Sum('order_count'),
+        amount=Sum('revenue'),
+        recent_orders=Sum('order_count', filter=recent),
+        recent_amount=Sum('revenue', filter=recent),
+    ))
+    by_day = dict(
+        DailySalesRollup.objects.filter(date__range=(chart_start, today), status=REVENUE_STATUS)
+        .values_list('date', 'revenue')
+    )
+    stats.sales_by_day = _fill_days(chart_start, today, by_day)
+
+
+def _apply_status_rows(stats, rows):
+    """Итоги, итоги за период и разбивка по статусам из одной группировки по статусу"""
+    for row in rows:
+        if not row['orders']:
+            continue
+        stats.order_stats.append({'status': row['status'], 'count': row['orders']})
+        stats.total_orders += row['orders']
+        stats.recent_orders += row['recent_orders'] or 0
+        if row['status'] == REVENUE_STATUS:
+            stats.total_revenue = row['amount'] or Decimal('0')
+            stats.recent_revenue = row['recent_amount'] or Decimal('0')
+
+
+def _live_users(stats, since):
+    users = User.objects.aggregate(
+        total=Count('id'),
+        new=Count('id', filter=Q(date_joined__gte=_day_start(since))),
+    )
+    stats.total_users, stats.new_users = users['total'], users['new']
+
+
+def _rollup_users(stats, since):
+    # Удаленные пользователи вычитаются из сводки, поэтому сумма за все дни
+    # совпадает с количеством пользователей
+    users = DailySignupRollup.objects.aggregate(
+        total=Sum('new_users'),
+        new=Sum('new_users', filter=Q(date__gte=since)),
+    )
+    stats.total_users, stats.new_users = users['total'] or 0, users['new'] or 0
@@ -0,0 +1,192 @@
+"""Подсказки для автодополнения в поиске.
+
+Нормализованные названия книг и имена авторов хранятся в памяти процесса
+в отсортированном списке, поиск по префиксу выполняется через bisect.
+Индекс строится при старте процесса (см. bookstore/wsgi.py) и дальше
+обновляется сигналами сохранения и удаления Book/Author (см. signals.py).
+Сигналы доходят только до процесса, который записал изменения, поэтому
+они также увеличивают версию 'suggest', а остальные процессы, заметив
+новую версию, перестраивают индекс.
+"""
+import bisect
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .cache import bump_version, get_versions
+from .search import normalize
+
+BOOK = 'book'
+AUTHOR = 'author'
+
+# Ограничения, чтобы индекс не разрастался неограниченно. Ключи сверх
+# MAX_ENTRIES в индекс не попадают: при построении отбрасываются последние
+# по алфавиту, при обновлении - новые ключи, пока индекс заполнен
+MAX_ENTRIES = getattr(settings, 'SUGGEST_MAX_ENTRIES', 200000)
+MAX_KEY_LENGTH = 100
+VERSION_NAMESPACE = 'suggest'
+
+
+def book_entries(book):
+    return [(normalize(book.title)[:MAX_KEY_LENGTH], book.title)]
+
+
+def author_entries(author):
+    label = f'{author.first_name} {author.last_name}'.strip()
+    # Автора можно найти как по имени, так и по фамилии
+    keys = {
+        normalize(f'{author.first_name} {author.last_name}').strip(),
+        normalize(f'{author.last_name} {author.first_name}').strip(),
+    }
+    return [(key[:MAX_KEY_LENGTH], label) for key in keys if key]
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._rebuilding = False
+        self.version = None
+        self._clear()
+
+    def _clear(self):
+        self.keys = []     # отсортированные кортежи (ключ, тип, id)
+        self.labels = {}   # (тип, id) -> отображаемый текст
+        self.owned = {}    # (тип, id) -> ключи объекта, нужны для удаления
+
+    def _add(self, kind, pk, entries):
+        self._discard(kind, pk)
+        if len(self.keys) + len(entries) > MAX_ENTRIES:
+            # Индекс заполнен (см. MAX_ENTRIES): объект в подсказках не показывается
+            return
+        keys = []
+        for key, label in entries:
+            item = (key, kind, pk)
+            bisect.insort(self.keys, item)
+            keys.append(item)
+            self.labels[(kind, pk)] = label
+        self.owned[(kind, pk)] = keys
+
+    def _discard(self, kind, pk):
+        for item in self.owned.pop((kind, pk), ()):
+            position = bisect.bisect_left(self.keys, item)
+            if position < len(self.keys) and self.keys[position] == item:
+                del self.keys[position]
+        self.labels.pop((kind, pk), None)
+
+    def _entries(self, kind, pk):
+        label = self.labels.get((kind, pk))
+        return sorted((key, label) for key, _, _ in self.owned.get((kind, pk), ()))
+
+    def build(self):
+        from .models import Author, Book
+
+        # Версию читаем до данных: изменения во время построения увеличат ее снова
+        version = get_versions(VERSION_NAMESPACE)[VERSION_NAMESPACE]
+        items = []
+        labels = {}
+        for book in Book.objects.only('id', 'title').iterator(chunk_size=2000):
+            for key, label in book_entries(book):
+                items.append((key, BOOK, book.id))
+                labels[(BOOK, book.id)] = label
+        for author in Author.objects.only('id', 'first_name', 'last_name').iterator(chunk_size=2000):
+            for key, label in author_entries(author):
+                items.append((key, AUTHOR, author.id))
+                labels[(AUTHOR, author.id)] = label
+        items.sort()
+        del items[MAX_ENTRIES:]
+        owned = {}
+        for item in items:
+            owned.setdefault((item[1], item[2]), []).append(item)
+
+        # Запросы читают старый индекс, пока строится новый
+        with self._lock:
+            self.keys = items
+            self.labels = {owner: labels[owner] for owner in owned}
+            self.owned = owned
+            self.version = version
+            self._built = True
+
+    def warm_up(self):
+        """Строит индекс при старте процесса"""
+        try:
+            self.build()
+        except DatabaseError:
+            # Миграции еще не применены: индекс построится при первом обращении
+            pass
+
+    def _ensure_current(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self.build()
+            return
+        if get_versions(VERSION_NAMESPACE)[VERSION_NAMESPACE] == self.version:
+            return
+        # Данные изменил другой процесс. Перестраивает один запрос,
+        # остальные тем временем отвечают по предыдущему индексу
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        try:
+            self.build()
+        finally:
+            self._rebuilding = False
+
+    def update(self, kind, pk, entries):
+        if self._built and self._entries(kind, pk) == sorted(entries):
+            # Ключи не изменились, перестраивать индекс в других процессах незачем
+            return
+        # on_commit bump_version выполняется раньше apply, зарегистрированного ниже
+        bump_version(VERSION_NAMESPACE)
+
+        def apply():
+            if self._built:
+                with self._lock:
+                    self._add(kind, pk, entries)
+                    self._advance_version()
+
+        transaction.on_commit(apply)
+
+    def remove(self, kind, pk):
+        bump_version(VERSION_NAMESPACE)
+
+        def apply():
+            if self._built:
+                with self._lock:
+                    self._discard(kind, pk)
+                    self._advance_version()
+
+        transaction.on_commit(apply)
+
+    def _advance_version(self):
+        # Изменение уже применено к индексу этого процесса. Если версия ушла
+        # дальше, чем на собственное увеличение, индекс менял и другой процесс:
+        # тогда версия остается старой и индекс перестроится при запросе
+        current = get_versions(VERSION_NAMESPACE)[VERSION_NAMESPACE]
+        if current == self.version + 1:
+            self.version = current
+
+    def suggest(self, prefix, limit=10):
+        prefix = normalize(prefix).strip()
+        if not prefix:
+            return []
+        self._ensure_current()
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect.bisect_left(self.keys, (prefix,))
+            while position < len(self.keys) and len(results) < limit:
+                key, kind, pk = self.keys[position]
+                if not key.startswith(prefix):
+                    break
+                if (kind, pk) not in seen:
+                    seen.add((kind, pk))
+                    results.append({'type': kind, 'id': pk, 'label': self.labels[(kind, pk)]})
+                position += 1
+        return results
+
+
+index = SuggestIndex()
@@ -1,3 +1,1404 @@
-from django.test import TestCase
+import json
+import re
+import tempfile
+import time
+import unittest
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from .cache import (
+    bump_version, get_cart_badge, get_new_books, get_popular_books, get_versions, versioned_key,
+)
+from .context_processors import cart_items_count
+from .fragments import FRAGMENT_CACHE
+from .importer import CatalogImporter, read_records
+from .middleware import PIN_COOKIE, ReplicaRoutingMiddleware
+from .pagination import CachedCountPaginator, KeysetPagination
+from . import copurchase, importer, related, search, suggest
+from .models import (
+    LOW_STOCK_THRESHOLD, Author, Book, Cart, CartItem, Category, DailySalesRollup, Order, OrderItem, Publisher,
+    StockHold, User,
+)
+from .routers import ReplicaRouter
+from .serializers import (
+    AuthorSerializer, AuthorValuesSerializer, BookSerializer, BookValuesSerializer, CategorySerializer,
+    CategoryValuesSerializer, PublisherSerializer, PublisherValuesSerializer,
+)
+from .services import EmptyCartError, InsufficientStockError, place_order
+from .stats import dashboard_stats
+
+
+def make_book(index, **kwargs):
+    defaults = {
+        'title': f'Книга {index}',
+        'slug': f'book-{index}',
+        'isbn': f'{index:013d}',
+        'price': Decimal('100.00'),
+        'stock_quantity': 10,
+    }
+    defaults.update(kwargs)
+    return Book.objects.create(**defaults)
+
+
+class SearchBackendTests(TestCase):
+    """Оба бэкенда поиска: индексация сигналами, удаление, переиндексация автора, ранжирование"""
+    backends = ['memory', 'fts5'] if connection.vendor == 'sqlite' else ['memory']
+
+    def setUp(self):
+        cache.clear()
+        self.tolstoy = Author.objects.create(first_name='Лев', last_name='Толстой')
+        self.chekhov = Author.objects.create(first_name='Антон', last_name='Чехов')
+
+    def for_each_backend(self):
+        for name in self.backends:
+            with self.subTest(backend=name), override_settings(SEARCH_BACKEND=name):
+                search.rebuild_index()
+                yield
+
+    def write(self):
+        # Индекс в памяти применяет изменения после фиксации транзакции
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def test_index_remove_and_author_reindex(self):
+        for _ in self.for_each_backend():
+            with self.write():
+                war = make_book(1, title='Война и мир', author=self.tolstoy)
+                garden = make_book(2, title='Вишневый сад', author=self.chekhov)
+            self.assertEqual(search.search_book_ids('войн'), [war.pk])
+            self.assertEqual(search.search_book_ids('толстой мир'), [war.pk])
+            self.assertEqual(search.search_book_ids('ВИШНЁВЫЙ'), [garden.pk])
+
+            with self.write():
+                self.chekhov.last_name = 'Чехонте'
+                self.chekhov.save()
+            self.assertEqual(search.search_book_ids('чехонте'), [garden.pk])
+            self.assertEqual(search.search_book_ids('чехов'), [])
+
+            with self.write():
+                war.delete()
+            self.assertEqual(search.search_book_ids('войн'), [])
+            with self.write():
+                Book.objects.all().delete()
+
+    def test_ranking_and_pages(self):
+        for _ in self.for_each_backend():
+            with self.write():
+                in_description = make_book(1, title='Сборник', description='Рассказы про море')
+                in_title = make_book(2, title='Море')
+                others = [make_book(index, title=f'Море {index}', description='шторм шторм шторм') for index in range(3, 8)]
+            ranked = search.search_book_ids('море')
+            # Совпадение в названии весит больше, чем в описании
+            self.assertEqual(ranked[0], in_title.pk)
+            self.assertEqual(ranked[-1], in_description.pk)
+            self.assertEqual(len(ranked), 7)
+            self.assertEqual(search.search_book_ids('море', limit=3, offset=2), ranked[2:5])
+            self.assertEqual(list(search.search_books('море').values_list('pk', flat=True)), ranked)
+            self.assertEqual(
+                list(search.search_books('море').filter(pk__in=[book.pk for book in others])[1:3].values_list('pk', flat=True)),
+                [pk for pk in ranked if pk in {book.pk for book in others}][1:3],
+            )
+            with self.write():
+                Book.objects.all().delete()
+
+    @override_settings(SEARCH_BACKEND='memory')
+    def test_own_writes_update_memory_index_in_place(self):
+        search.rebuild_index()
+        backend = search.get_backend()
+        with mock.patch.object(backend, '_build', wraps=backend._build) as build:
+            with self.write():
+                book = make_book(1, title='Война и мир', author=self.tolstoy)
+            self.assertEqual(search.search_book_ids('войн'), [book.pk])
+            with self.write():
+                book.title = 'Анна Каренина'
+                book.save()
+            self.assertEqual(search.search_book_ids('каренина'), [book.pk])
+            self.assertEqual(build.call_count, 0)
+
+            # Изменение из другого процесса: версия ушла дальше собственной
+            with self.captureOnCommitCallbacks(execute=True):
+                bump_version(search.VERSION_NAMESPACE)
+            search.search_book_ids('каренина')
+            self.assertEqual(build.call_count, 1)
+
+    @override_settings(SEARCH_BACKEND='memory')
+    def test_memory_ranking_in_sql_is_capped(self):
+        with self.write():
+            books = [make_book(index, title=f'Море {index}') for index in range(5)]
+        search.rebuild_index()
+        with mock.patch.object(search, 'RANK_LIMIT', 3):
+            found = list(search.search_books('море').values_list('pk', flat=True))
+        self.assertEqual(found, search.search_book_ids('море')[:3])
+        self.assertEqual(len(books), 5)
+
+
+class AdminBookSearchTests(TestCase):
+    def setUp(self):
+        self.war = make_book(1, title='Ёлка и Война')
+        self.peace = make_book(2, title='Мир')
+        admin = User.objects.create_user(username='admin', password='password123', role='admin')
+        self.client.force_login(admin)
+
+    def found(self, query):
+        response = self.client.get('/admin/books/', {'search': query})
+        return {book.pk for book in response.context['books']}
+
+    def test_prefix_and_isbn(self):
+        self.assertEqual(self.found('елка и'), {self.war.pk})
+        self.assertEqual(self.found('ЁЛКА'), {self.war.pk})
+        self.assertEqual(self.found(self.peace.isbn), {self.peace.pk})
+        self.assertEqual(self.found('война'), set())
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'План запроса проверяется в формате SQLite')
+    def test_prefix_uses_index(self):
+        sql, params = Book.objects.filter(search.key_prefix_lookup('search_key', 'елка')).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('USING INDEX catalog_book_search_key', plan)
+
+
+class SuggestIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Индекс процесса не должен зависеть от книг из других тестов
+        patcher = mock.patch.object(suggest, 'index', suggest.SuggestIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.author = Author.objects.create(first_name='Лев', last_name='Толстой')
+
+    def test_warm_up_and_changes_from_other_process(self):
+        # Отдельный экземпляр играет роль индекса в другом процессе:
+        # сигналы обновляют только suggest.index
+        other = suggest.SuggestIndex()
+        other.warm_up()
+        self.assertTrue(other._built)
+        self.assertEqual(other.suggest('войн'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book = make_book(1, title='Война и мир', author=self.author)
+        self.assertEqual(other.suggest('войн'), [{'type': suggest.BOOK, 'id': book.pk, 'label': 'Война и мир'}])
+        self.assertEqual(
+            [item['type'] for item in other.suggest('толстой')], [suggest.AUTHOR],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertEqual(other.suggest('войн'), [])
+
+    def test_own_writes_update_index_in_place(self):
+        suggest.index.build()
+        with mock.patch.object(suggest.index, 'build', wraps=suggest.index.build) as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                book = make_book(1, title='Война и мир', author=self.author)
+            with self.captureOnCommitCallbacks(execute=True):
+                book.title = 'Анна Каренина'
+                book.save()
+            self.assertEqual([item['id'] for item in suggest.index.suggest('анна')], [book.pk])
+            self.assertEqual(suggest.index.suggest('войн'), [])
+            self.assertEqual(build.call_count, 0)
+
+    def test_api_limit_is_clamped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_book(1, title='Война и мир')
+            make_book(2, title='Война миров')
+        for limit, expected in [('0', 1), ('-5', 1), ('1000', 2), ('x', 2)]:
+            with self.subTest(limit=limit):
+                response = self.client.get('/api/search/suggest/', {'q': 'войн', 'limit': limit}, HTTP_ACCEPT='application/json')
+                self.assertEqual(len(response.json()['results']), expected)
+
+    def test_unchanged_keys_keep_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = make_book(1, title='Война и мир')
+        suggest.index.build()
+        before = get_versions(suggest.VERSION_NAMESPACE)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.stock_quantity = 5
+            book.save()
+        self.assertEqual(get_versions(suggest.VERSION_NAMESPACE), before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.title = 'Анна Каренина'
+            book.save()
+        self.assertNotEqual(get_versions(suggest.VERSION_NAMESPACE), before)
+
+    def test_latency(self):
+        Book.objects.bulk_create([
+            Book(title=f'Книга номер {i}', slug=f'book-{i}', isbn=f'{i:013d}',
+                 price=Decimal('100.00'), stock_quantity=10)
+            for i in range(5000)
+        ])
+        index = suggest.SuggestIndex()
+        index.warm_up()
+        self.assertEqual(len(index.suggest('книга номер 12', 10)), 10)
+
+        runs = 200
+        started = time.perf_counter()
+        for i in range(runs):
+            index.suggest(f'книга номер {i % 50}', 10)
+        elapsed = (time.perf_counter() - started) / runs
+        self.assertLess(elapsed, 0.005)
+
+
+class CartQueryBudgetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password123')
+        self.cart = Cart.objects.create(user=self.user)
+        self.author = Author.objects.create(first_name='Лев', last_name='Толстой')
+        self.category = Category.objects.create(name='Классика', slug='classic')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_items(self, count):
+        for index in range(self.cart.items.count(), self.cart.items.count() + count):
+            book = make_book(index, author=self.author)
+            book.categories.add(self.category)
+            self.cart.add_item(book, 2)
+
+    def test_cart_list_query_count_does_not_depend_on_items(self):
+        self.add_items(2)
+        # корзина, позиции с книгами и авторами, категории книг
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(response.data['total_items'], 4)
+
+        self.add_items(10)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(len(response.data['items']), 12)
+        self.assertEqual(response.data['total_items'], 24)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('2400.00'))
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password123')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def test_checkout_query_count_does_not_depend_on_lines(self):
+        # позиции корзины, снятие резервов, UPDATE остатков, заказ,
+        # bulk_create позиций, очистка корзины, строка дневной сводки
+        # и точки сохранения транзакции; версия каталога увеличивается
+        # уже после фиксации
+        small = User.objects.create_user(username='small')
+        cart = Cart.objects.create(user=small)
+        for index in range(100, 102):
+            cart.add_item(make_book(index, stock_quantity=5), 2)
+        with self.assertNumQueries(21):
+            place_order(small, shipping_address='Самовывоз')
+        # второй заказ снова создает строку сводки, как и первый
+        DailySalesRollup.objects.all().delete()
+
+        books = [make_book(index, stock_quantity=5) for index in range(50)]
+        for book in books:
+            self.cart.add_item(book, 2)
+
+        with self.assertNumQueries(21):
+            order = place_order(self.user, shipping_address='Самовывоз')
+
+        self.assertEqual(order.items.count(), 50)
+        self.assertEqual(order.total_amount, Decimal('10000.00'))
+        self.assertFalse(self.cart.items.exists())
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (0, 0))
+        self.assertEqual(set(Book.objects.values_list('stock_quantity', flat=True)), {3})
+        self.assertEqual(set(Book.objects.values_list('reserved_quantity', flat=True)), {0})
+        self.assertEqual(set(Book.objects.values_list('order_count', 'units_sold')), {(1, 2)})
+
+        Book.objects.update(order_count=0, units_sold=0)
+        call_command('rebuild_book_sales', stdout=StringIO())
+        self.assertEqual(set(Book.objects.values_list('order_count', 'units_sold')), {(1, 2)})
+
+    def test_insufficient_stock_rolls_back_everything(self):
+        enough = make_book(1, stock_quantity=5)
+        scarce = make_book(2, stock_quantity=1)
+        CartItem.objects.create(cart=self.cart, book=enough, quantity=2)
+        CartItem.objects.create(cart=self.cart, book=scarce, quantity=2)
+
+        with self.assertRaises(InsufficientStockError) as context:
+            place_order(self.user, shipping_address='Самовывоз')
+
+        self.assertEqual(context.exception.titles, [scarce.title])
+        enough.refresh_from_db()
+        self.assertEqual(enough.stock_quantity, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_own_holds_are_not_reported_as_shortage(self):
+        held = make_book(1, stock_quantity=2)
+        scarce = make_book(2, stock_quantity=3)
+        self.cart.add_item(held, 2)
+        self.cart.add_item(scarce, 2)
+        Book.objects.filter(pk=scarce.pk).update(stock_quantity=1)
+
+        with self.assertRaises(InsufficientStockError) as context:
+            place_order(self.user, shipping_address='Самовывоз')
+
+        self.assertEqual(context.exception.titles, [scarce.title])
+        held.refresh_from_db()
+        self.assertEqual((held.stock_quantity, held.reserved_quantity), (2, 2))
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCartError):
+            place_order(self.user, shipping_address='Самовывоз')
+
+
+class StockHoldTests(TestCase):
+    def setUp(self):
+        self.book = make_book(1, stock_quantity=3)
+        self.first = Cart.objects.create(user=User.objects.create_user(username='first'))
+        self.second = Cart.objects.create(user=User.objects.create_user(username='second'))
+
+    def test_hold_blocks_oversell_until_released(self):
+        self.first.add_item(self.book, 2)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_quantity, 1)
+
+        with self.assertRaises(InsufficientStockError):
+            self.second.add_item(self.book, 2)
+        self.assertFalse(self.second.items.exists())
+
+        self.first.remove_item(self.book)
+        self.second.add_item(self.book, 2)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reserved_quantity, 2)
+
+    def test_expired_holds_are_released_on_demand(self):
+        self.first.add_item(self.book, 3)
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.second.add_item(self.book, 1)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reserved_quantity, 1)
+        self.assertFalse(StockHold.objects.filter(cart_item__cart=self.first).exists())
+
+    def test_quantity_change_adjusts_hold(self):
+        self.first.add_item(self.book, 1)
+        self.first.update_item_quantity(self.book, 3)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reserved_quantity, 3)
+
+        self.first.clear()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reserved_quantity, 0)
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create(user=User.objects.create_user(username='buyer'))
+        self.first = make_book(1, price=Decimal('150.00'))
+        self.second = make_book(2, price=Decimal('40.00'))
+
+    def assertTotals(self, count, amount):
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual((cart.item_count, cart.subtotal), (count, Decimal(amount)))
+
+    def test_mutations_keep_totals_in_sync(self):
+        self.cart.add_item(self.first, 2)
+        self.cart.add_item(self.second)
+        self.assertTotals(3, '340.00')
+
+        self.cart.update_item_quantity(self.second, 3)
+        self.assertTotals(5, '420.00')
+
+        self.cart.remove_item(self.first)
+        self.assertTotals(3, '120.00')
+
+        self.cart.clear()
+        self.assertTotals(0, '0')
+
+    def test_reconcile_repairs_drift(self):
+        self.cart.add_item(self.first, 2)
+        Cart.objects.filter(pk=self.cart.pk).update(item_count=7, subtotal=1)
+
+        call_command('reconcile_cart_totals', stdout=StringIO())
+
+        self.assertTotals(2, '300.00')
+
+    def test_price_change_reprices_carts(self):
+        self.cart.add_item(self.first, 3)
+        self.cart.add_item(self.second)
+
+        book = Book.objects.get(pk=self.first.pk)
+        book.price = Decimal('200.00')
+        book.save()
+        self.assertTotals(4, '640.00')
+
+        self.cart.remove_item(self.first)
+        self.assertTotals(1, '40.00')
+
+    def test_import_reprices_carts(self):
+        self.cart.add_item(self.second, 2)
+        catalog_importer = CatalogImporter()
+        catalog_importer.run([{
+            'isbn': self.second.isbn, 'title': self.second.title, 'slug': self.second.slug,
+            'price': '55.00', 'stock_quantity': '10',
+        }])
+        catalog_importer.finish()
+        self.assertTotals(2, '110.00')
+
+
+class HomeCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password123')
+        self.books = [make_book(index) for index in range(3)]
+
+    def test_checkout_keeps_home_blocks(self):
+        new_books = get_new_books()
+        popular = get_popular_books()
+
+        self.user.cart = Cart.objects.create(user=self.user)
+        self.user.cart.add_item(self.books[2])
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.user, shipping_address='Москва')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_new_books(), new_books)
+            self.assertEqual(get_popular_books(), popular)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].title = 'Новое название'
+            self.books[0].save()
+        self.assertIn('Новое название', [book.title for book in get_new_books()])
+
+    def test_refresh_command(self):
+        self.assertNotEqual(get_popular_books()[0], self.books[1])
+        Book.objects.filter(pk=self.books[1].pk).update(order_count=5)
+
+        call_command('refresh_popular_books', stdout=StringIO())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_popular_books()[0], self.books[1])
+
+
+class CartBadgeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password123')
+        self.cart = Cart.objects.create(user=self.user)
+        self.book = make_book(1)
+
+    def test_badge_is_cached_and_invalidated(self):
+        self.assertEqual(get_cart_badge(self.user.pk), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_badge(self.user.pk), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cart.add_item(self.book, 2)
+        self.assertEqual(get_cart_badge(self.user.pk), 2)
+
+    def test_badge_is_lazy(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            context = cart_items_count(request)
+        self.assertEqual(str(context['cart_items_count']), '0')
+
+
+class DailySalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer')
+        self.today = timezone.localdate()
+
+    def rollup(self):
+        return {
+            row.status: (row.order_count, row.revenue)
+            for row in DailySalesRollup.objects.filter(date=self.today, order_count__gt=0)
+        }
+
+    def test_rollup_follows_order_lifecycle(self):
+        order = Order.objects.create(user=self.user, shipping_address='x', total_amount=Decimal('500.00'))
+        self.assertEqual(self.rollup(), {'pending': (1, Decimal('500.00'))})
+
+        order = Order.objects.get(pk=order.pk)
+        order.status = 'delivered'
+        order.save()
+        self.assertEqual(self.rollup(), {'delivered': (1, Decimal('500.00'))})
+
+        stats = dashboard_stats(source='rollup')
+        self.assertEqual(stats.recent_revenue, Decimal('500.00'))
+        self.assertEqual(stats.new_users, 1)
+
+        order.delete()
+        self.assertEqual(self.rollup(), {})
+
+    def test_rebuild_matches_incremental_updates(self):
+        for amount in ('100.00', '250.00'):
+            Order.objects.create(user=self.user, shipping_address='x', total_amount=Decimal(amount))
+        before = self.rollup()
+
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+
+        self.assertEqual(self.rollup(), before)
+        self.assertEqual(before, {'pending': (2, Decimal('350.00'))})
+
+
+class DashboardStatsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='buyer')
+        now = timezone.now()
+        for days, status, amount in [(0, 'delivered', '100.00'), (3, 'delivered', '50.00'),
+                                     (3, 'pending', '70.00'), (40, 'delivered', '30.00')]:
+            order = Order.objects.create(user=user, shipping_address='x', status=status, total_amount=Decimal(amount))
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=days))
+        make_book(1)
+        old_user = User.objects.create_user(username='old')
+        User.objects.filter(pk=old_user.pk).update(date_joined=now - timedelta(days=40))
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+
+    def test_sources_agree_within_query_budget(self):
+        results = {}
+        for source in ('live', 'rollup'):
+            # книги, группировка заказов по статусу, график, пользователи
+            with self.assertNumQueries(4):
+                results[source] = dashboard_stats(source=source)
+
+        stats = results['live']
+        self.assertEqual(stats, results['rollup'])
+        self.assertEqual((stats.total_orders, stats.total_revenue), (4, Decimal('180.00')))
+        self.assertEqual((stats.recent_orders, stats.recent_revenue), (3, Decimal('150.00')))
+        self.assertEqual(len(stats.sales_by_day), 7)
+        self.assertEqual(stats.sales_data[-1], 100.0)
+        self.assertEqual(sum(stats.sales_data), 150.0)
+        self.assertEqual(
+            sorted((row['status'], row['count']) for row in stats.order_stats),
+            [('delivered', 3), ('pending', 1)],
+        )
+        self.assertEqual((stats.total_users, stats.new_users), (2, 1))
+
+    def test_signup_rollup_follows_users(self):
+        User.objects.create_user(username='new')
+        User.objects.get(username='old').delete()
+        live, rollup = dashboard_stats(source='live'), dashboard_stats(source='rollup')
+        self.assertEqual((rollup.total_users, rollup.new_users), (live.total_users, live.new_users))
+        self.assertEqual((rollup.total_users, rollup.new_users), (2, 2))
+
+
+class RelatedBooksTests(TestCase):
+    def setUp(self):
+        self.classic = Category.objects.create(name='Классика', slug='classic')
+        self.books = [make_book(index) for index in range(4)]
+        for book in self.books[:3]:
+            book.categories.add(self.classic)
+        # Последняя книга без общих категорий, но ее покупают вместе с первой
+        user = User.objects.create_user(username='buyer')
+        for _ in range(2):
+            order = Order.objects.create(user=user, shipping_address='x')
+            OrderItem.objects.create(order=order, book=self.books[0], quantity=1, price=1)
+            OrderItem.objects.create(order=order, book=self.books[3], quantity=1, price=1)
+
+    def test_rebuild_combines_categories_and_co_purchases(self):
+        first, second, third, bought = self.books
+        call_command('rebuild_related_books', stdout=StringIO())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(related.related_books(first)), [bought, second, third])
+        self.assertEqual(related.stale_book_ids(), set())
+
+        response = APIClient().get(f'/api/books/{second.pk}/related/')
+        self.assertEqual([item['id'] for item in response.json()], [first.pk, third.pk])
+
+    def test_incremental_rebuild_picks_up_new_orders(self):
+        first, second, third, bought = self.books
+        related.rebuild()
+        order = Order.objects.create(user=User.objects.get(), shipping_address='x')
+        OrderItem.objects.create(order=order, book=second, quantity=1, price=1)
+        OrderItem.objects.create(order=order, book=bought, quantity=1, price=1)
+
+        self.assertEqual(related.stale_book_ids(), {second.pk, bought.pk})
+        related.rebuild()
+        self.assertEqual(list(related.related_books(bought)), [first, second])
+
+
+class CoPurchaseTests(TestCase):
+    def setUp(self):
+        self.books = [make_book(index) for index in range(4)]
+        self.user = User.objects.create_user(username='buyer')
+
+    def order(self, *books):
+        order = Order.objects.create(user=self.user, shipping_address='x')
+        for book in books:
+            OrderItem.objects.create(order=order, book=book, quantity=1, price=1)
+
+    def test_top_neighbours_are_normalized_and_chunked(self):
+        first, second, third, rare = self.books
+        for _ in range(3):
+            self.order(first, second)
+        self.order(first, third)
+        self.order(first, third, rare)
+        self.order(third)
+
+        # Порция меньше заказа из трех книг проверяет склейку заказов между порциями
+        saved = copurchase.rebuild(top_k=2, min_orders=2, chunk_size=2)
+
+        self.assertEqual(saved, 4)
+        self.assertEqual(list(copurchase.also_bought(first)), [second, third])
+        self.assertEqual(list(copurchase.also_bought(rare)), [])
+        pair = first.co_purchases.get(related=second)
+        # 3 совместных заказа / sqrt(5 заказов * 3 заказа)
+        self.assertAlmostEqual(pair.score, 3 / 15 ** 0.5)
+
+        response = APIClient().get(f'/api/books/{third.pk}/also-bought/')
+        self.assertEqual([item['id'] for item in response.json()], [first.pk])
+
+    def test_books_outside_snapshot_are_ignored(self):
+        first, second, third, last = self.books
+        self.order(first, second)
+        self.order(second, third)
+        self.order(last)
+        # Снимок без second и last, как если бы они появились после него
+        snapshot = copurchase.np.array([first.pk, third.pk], dtype=copurchase.np.int64)
+
+        counts = copurchase.co_occurrence(snapshot).toarray()
+
+        self.assertEqual(counts.tolist(), [[1, 0], [0, 1]])
+
+    def test_book_detail_renders_also_bought(self):
+        first, second = self.books[:2]
+        self.order(first, second)
+        copurchase.rebuild(top_k=2, min_orders=1)
+        response = self.client.get(f'/books/{first.pk}/')
+        self.assertContains(response, 'С этой книгой покупают')
+        self.assertContains(response, second.title)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'План запроса проверяется в формате SQLite')
+class HotQueryPlanTests(TestCase):
+    """Горячие запросы из views.py должны идти по индексам, а не полным перебором"""
+
+    def hot_queries(self):
+        user = User.objects.create_user(username='buyer')
+        since = timezone.now() - timedelta(days=30)
+        return {
+            'цена от и до': Book.objects.filter(price__gte=100, price__lte=500).order_by('price'),
+            'новые книги': Book.objects.order_by('-created_at')[:8],
+            'заканчиваются': Book.objects.filter(stock_quantity__lt=LOW_STOCK_THRESHOLD).order_by('stock_quantity')[:5],
+            'последние заказы': Order.objects.order_by('-created_at')[:4],
+            'заказы по статусу': Order.objects.filter(status='pending'),
+            'график выручки': Order.objects.filter(status='delivered', created_at__gte=since),
+            'заказы пользователя': Order.objects.filter(user=user).order_by('-created_at'),
+            'новые пользователи': User.objects.filter(date_joined__gte=since),
+            'пользователи по роли': User.objects.filter(role='admin'),
+        }
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                plan = self.plan(queryset)
+                table = queryset.model._meta.db_table
+                full_scans = [line for line in plan if re.fullmatch(rf'SCAN {table}', line)]
+                self.assertFalse(full_scans, f'{name}: {plan}')
+                self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, f'{name}: {plan}')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'PRAGMA есть только у SQLite')
+class SQLitePragmaTests(TestCase):
+    def test_connection_is_configured(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], PRIMARY_DB_PATHS=['/cart/'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def route(self, request, authenticate=None):
+        """Куда ушло бы чтение книг и заказов во время запроса"""
+        routes = {}
+
+        def view(request):
+            if authenticate is not None:
+                # Так DRF сохраняет пользователя, вошедшего по токену
+                request.user = authenticate
+            router = ReplicaRouter()
+            routes['book'] = router.db_for_read(Book)
+            routes['order'] = router.db_for_read(Order)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return routes, response
+
+    def test_catalog_reads_go_to_replica(self):
+        routes, response = self.route(RequestFactory().get('/books/'))
+        self.assertEqual(routes, {'book': 'replica1', 'order': 'default'})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        # Вне запроса (команды, фоновые задачи) - только основная база
+        self.assertEqual(ReplicaRouter().db_for_read(Book), 'default')
+
+    def test_primary_paths_and_writes_use_primary(self):
+        routes, response = self.route(RequestFactory().get('/cart/'))
+        self.assertEqual(routes['book'], 'default')
+
+        routes, response = self.route(RequestFactory().post('/books/'))
+        self.assertEqual(routes['book'], 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_writer_is_pinned_to_primary(self):
+        request = RequestFactory().get('/books/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        routes, response = self.route(request)
+        self.assertEqual(routes['book'], 'default')
+
+    def test_api_clients_without_cookie_are_pinned(self):
+        user = User.objects.create_user(username='buyer')
+        token = Token.objects.create(user=user)
+        header = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+
+        self.route(RequestFactory().post('/api/books/', **header), authenticate=user)
+
+        routes, response = self.route(RequestFactory().get('/books/', **header))
+        self.assertEqual(routes['book'], 'default')
+        session_get = RequestFactory().get('/books/')
+        session_get.user = user
+        routes, response = self.route(session_get)
+        self.assertEqual(routes['book'], 'default')
+        routes, response = self.route(RequestFactory().get('/books/'))
+        self.assertEqual(routes['book'], 'replica1')
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Пары книг с одинаковой ценой: порядок внутри пары задает id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books = [
+                make_book(index, title=f'Роман {index}', price=Decimal(100 + index // 2))
+                for index in range(7)
+            ]
+        search.rebuild_index()
+        self.client = APIClient()
+
+    def walk(self, url, link):
+        ids, pages = [], []
+        while url:
+            payload = self.client.get(url, HTTP_ACCEPT='application/json').json()
+            ids.extend(item['id'] for item in payload['results'])
+            pages.append(payload)
+            url = payload[link]
+        return ids, pages
+
+    def test_cursor_forward_and_back_with_ties(self):
+        expected = list(Book.objects.order_by('price', 'id').values_list('id', flat=True))
+        with mock.patch.object(KeysetPagination, 'page_size', 2):
+            ids, pages = self.walk('/api/books/?sort=price', 'next')
+            self.assertEqual(ids, expected)
+            self.assertEqual([len(page['results']) for page in pages], [2, 2, 2, 1])
+            self.assertIsNone(pages[0]['previous'])
+
+            # С последней страницы назад: страницы те же, в обратном порядке
+            back, back_pages = self.walk(pages[-1]['previous'], 'previous')
+            self.assertEqual(
+                [[item['id'] for item in page['results']] for page in back_pages],
+                [[item['id'] for item in page['results']] for page in reversed(pages[:-1])],
+            )
+            self.assertIsNotNone(back_pages[-1]['next'])
+
+    def test_invalid_cursor(self):
+        for cursor in ['not-base64!', 'e30=', 'eyJ2IjogIngiLCAiaWQiOiAxfQ==']:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/api/books/?sort=price&cursor={cursor}', HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json()['detail'], 'Некорректный курсор')
+
+    def test_relevance_pages_have_the_same_shape(self):
+        expected = search.search_book_ids('роман')
+        with mock.patch.object(KeysetPagination, 'page_size', 3):
+            ids, pages = self.walk('/api/books/?q=%D1%80%D0%BE%D0%BC%D0%B0%D0%BD', 'next')
+            self.assertEqual(ids, expected)
+            self.assertEqual({tuple(page) for page in pages}, {('next', 'previous', 'results')})
+            self.assertIn('page=2', pages[0]['next'])
+
+            back, _ = self.walk(pages[-1]['previous'], 'previous')
+            self.assertEqual(back, expected[3:6] + expected[:3])
+            self.assertNotIn('page=', pages[1]['previous'])
+
+        for page in ['0', 'x']:
+            response = self.client.get(f'/api/books/?q=роман&page={page}', HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 404)
+
+    def test_cached_count(self):
+        books = Book.objects.filter(price__gte=101)
+        with self.assertNumQueries(1):
+            self.assertEqual(CachedCountPaginator(books, 2, count_mode='cached').count, 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(CachedCountPaginator(books, 2, count_mode='cached').count, 5)
+            # На SQLite оценки из EXPLAIN нет, используется кэш
+            self.assertEqual(CachedCountPaginator(books, 2, count_mode='estimated').count, 5)
+        with self.assertNumQueries(1):
+            self.assertEqual(CachedCountPaginator(books, 2, count_mode='exact').count, 5)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = make_book(1)
+        self.client = APIClient()
+
+    def assertRevalidates(self, url, queries=0):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # Проверка ETag не загружает строки и не рендерит ответ
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_api_returns_304_until_catalog_changes(self):
+        url = '/api/books/'
+        etag = self.assertRevalidates(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.price = Decimal('120.00')
+            self.book.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_checkout_invalidates_stock(self):
+        etag = self.assertRevalidates(f'/api/books/{self.book.pk}/')
+        user = User.objects.create_user(username='buyer')
+        Cart.objects.create(user=user).add_item(self.book, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(user, shipping_address='Самовывоз')
+
+        response = self.client.get(f'/api/books/{self.book.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['stock_quantity'], 9)
+
+    def test_book_detail_page(self):
+        self.assertRevalidates(f'/books/{self.book.pk}/')
+        self.assertRevalidates('/api/categories/')
+
+    def test_book_detail_follows_publisher(self):
+        publisher = Publisher.objects.create(name='Эксмо')
+        self.book.publisher = publisher
+        self.book.save()
+        url = f'/books/{self.book.pk}/'
+        etag = self.assertRevalidates(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            publisher.name = 'АСТ'
+            publisher.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'АСТ')
+
+    def test_page_depends_on_session_state(self):
+        url = f'/books/{self.book.pk}/'
+        etag = self.assertRevalidates(url)
+
+        # Новый CSRF-секрет - токен в закэшированной форме уже недействителен
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'a' * 32
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        user = User.objects.create_user(username='reader', password='password123')
+        self.client.force_login(user)
+        # сессия и пользователь
+        etag = self.assertRevalidates(url, queries=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Cart.objects.create(user=user).add_item(self.book, 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_with_pending_messages_is_not_revalidated(self):
+        self.client.force_login(User.objects.create_user(username='reader'))
+        url = f'/books/{self.book.pk}/'
+        etag = self.assertRevalidates(url, queries=2)
+
+        self.client.post(reverse('cart'), {'clear_cart': '1'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class CatalogVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_versions_survive_cache_flush(self):
+        before = get_versions('book', 'author')
+        key = versioned_key('books', 'book', 'author')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version('book')
+        cache.clear()
+
+        after = get_versions('book', 'author')
+        self.assertEqual(after['book'], before['book'] + 1)
+        self.assertEqual(after['author'], before['author'])
+        self.assertNotEqual(versioned_key('books', 'book', 'author'), key)
+
+    def test_delete_cascade_bumps_books(self):
+        category = Category.objects.create(name='Классика', slug='classic')
+        make_book(1).categories.add(category)
+        before = get_versions('book')['book']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            category.delete()
+
+        self.assertGreater(get_versions('book')['book'], before)
+
+
+class BookFragmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches[FRAGMENT_CACHE].clear()
+        self.category = Category.objects.create(name='Классика', slug='classic')
+        self.author = Author.objects.create(first_name='Лев', last_name='Толстой')
+        for index in range(3):
+            make_book(index, author=self.author).categories.add(self.category)
+        self.client = APIClient()
+
+    def expected(self, url):
+        """Ответ без кэша фрагментов: обычная сериализация DRF"""
+        request = RequestFactory().get(url)
+        request = Request(request)
+        books = Book.objects.order_by('title', 'id')
+        data = BookSerializer(books, many=True, context={'request': request}).data
+        return JSONRenderer().render(data)
+
+    def results(self, url='/api/books/'):
+        content = self.client.get(url, HTTP_ACCEPT='application/json').content
+        start = content.index(b'"results":') + len(b'"results":')
+        return content[start:-1]
+
+    def test_fragments_match_plain_serialization(self):
+        cold = self.results()
+        warm = self.results()
+        self.assertEqual(cold, warm)
+        self.assertEqual(cold, self.expected('/api/books/'))
+        self.assertEqual(json.loads(cold)[0]['categories_list'][0]['name'], 'Классика')
+
+    def test_fragments_follow_changes(self):
+        self.results()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Проза'
+            self.category.save()
+        self.assertEqual(json.loads(self.results())[0]['categories_list'][0]['name'], 'Проза')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.books.clear()
+        self.assertEqual(json.loads(self.results())[0]['categories_list'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.last_name = 'Н. Толстой'
+            self.author.save()
+        self.assertEqual(json.loads(self.results())[0]['author_name'], 'Н. Толстой Лев')
+
+    def test_fragments_use_own_cache(self):
+        cold = self.results()
+        # Очистка общего кэша не затрагивает фрагменты
+        cache.clear()
+        with mock.patch.object(BookValuesSerializer, 'serialize', side_effect=AssertionError):
+            self.assertEqual(self.results(), cold)
+        self.assertEqual(FRAGMENT_CACHE, 'book_fragments')
+
+    def test_search_uses_fragments(self):
+        response = self.client.get('/api/search/?q=Книга', HTTP_ACCEPT='application/json')
+        payload = json.loads(response.content)
+        self.assertEqual(payload['count'], 3)
+        self.assertEqual(payload['results'][0]['author_name'], 'Толстой Лев')
+
+
+class ValuesSerializerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        classic = Category.objects.create(name='Классика', slug='classic', description='Старые книги')
+        prose = Category.objects.create(name='Проза', slug='prose')
+        author = Author.objects.create(first_name='Лев', last_name='Толстой', birth_date='1828-09-09')
+        Author.objects.create(first_name='Антон', last_name='Чехов', website='https://example.com')
+        publisher = Publisher.objects.create(name='Азбука', address='Москва')
+        first = make_book(1, author=author, publisher=publisher, price=Decimal('99.5'), image='images/cover.png')
+        first.categories.add(classic, prose)
+        make_book(2, author=author).categories.add(prose)
+        make_book(3)
+        self.request = Request(RequestFactory().get('/api/books/'))
+
+    def assertSameOutput(self, serializer_class, values_class, queryset):
+        context = {'request': self.request}
+        expected = serializer_class(serializer_class.setup_queryset(queryset), many=True, context=context).data
+        serializer = values_class(context=context)
+        actual = serializer.serialize(serializer.setup_queryset(queryset))
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_output_matches_model_serializers(self):
+        self.assertSameOutput(BookSerializer, BookValuesSerializer, Book.objects.order_by('title', 'id'))
+        self.assertSameOutput(AuthorSerializer, AuthorValuesSerializer, Author.objects.all())
+        self.assertSameOutput(CategorySerializer, CategoryValuesSerializer, Category.objects.all())
+        self.assertSameOutput(PublisherSerializer, PublisherValuesSerializer, Publisher.objects.all())
+
+    def test_book_page_without_model_instances(self):
+        serializer = BookValuesSerializer(context={'request': self.request})
+        with self.assertNumQueries(2):
+            data = serializer.serialize(serializer.setup_queryset(Book.objects.all()))
+        self.assertEqual(data[0]['author_name'], 'Толстой Лев')
+        self.assertEqual(data[0]['price'], '99.50')
+        self.assertEqual(data[0]['image'], 'http://testserver/media/images/cover.png')
+        self.assertEqual([item['name'] for item in data[0]['categories_list']], ['Классика', 'Проза'])
+        self.assertIsNone(data[2]['author_name'])
+        self.assertEqual(data[2]['categories'], [])
+
+    def test_api_lists_and_cursor(self):
+        client = APIClient()
+        ids, url = [], '/api/books/?sort=-price'
+        with mock.patch.object(KeysetPagination, 'page_size', 1):
+            while url:
+                payload = client.get(url, HTTP_ACCEPT='application/json').json()
+                ids.extend(item['id'] for item in payload['results'])
+                url = payload['next']
+        self.assertEqual(ids, list(Book.objects.order_by('-price', '-id').values_list('id', flat=True)))
+
+        response = client.get('/api/authors/', HTTP_ACCEPT='application/json')
+        self.assertEqual(sorted(item['last_name'] for item in response.json()['results']), ['Толстой', 'Чехов'])
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password123')
+        author = Author.objects.create(first_name='Лев', last_name='Толстой')
+        category = Category.objects.create(name='Классика', slug='classic')
+        self.books = [make_book(index, author=author) for index in range(3)]
+        for book in self.books:
+            book.categories.add(category)
+        for book in self.books:
+            order = Order.objects.create(user=self.user, shipping_address='-', total_amount=Decimal('100.00'))
+            OrderItem.objects.create(order=order, book=book, quantity=1, price=book.price)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [query['sql'] for query in queries]
+
+    def test_book_fields(self):
+        full, _ = self.get('/api/books/')
+        payload, queries = self.get('/api/books/?fields=id,title,price')
+        self.assertEqual(list(payload['results'][0]), ['id', 'title', 'price'])
+        self.assertEqual(payload['results'][0]['title'], full['results'][0]['title'])
+        book_queries = [sql for sql in queries if 'FROM "catalog_book"' in sql]
+        self.assertEqual(len(book_queries), 1)
+        self.assertNotIn('description', book_queries[0])
+        self.assertFalse(any('catalog_book_categories' in sql for sql in queries))
+
+        # Полный ответ по-прежнему берется из своих фрагментов
+        self.assertEqual(self.get('/api/books/')[0], full)
+
+    def test_book_expand(self):
+        payload, _ = self.get('/api/books/?fields=id,author&expand=author')
+        self.assertEqual(payload['results'][0]['author']['last_name'], 'Толстой')
+        payload, _ = self.get(f'/api/books/{self.books[0].pk}/?fields=title,author&expand=author')
+        self.assertEqual(payload, {'title': 'Книга 0', 'author': {
+            'id': self.books[0].author_id, 'first_name': 'Лев', 'last_name': 'Толстой',
+            'bio': '', 'birth_date': None, 'website': '',
+        }})
+
+    def test_order_collapse_and_expand(self):
+        full, _ = self.get('/api/orders/')
+        self.assertEqual(full['results'][0]['user']['username'], 'buyer')
+
+        payload, queries = self.get('/api/orders/?expand=')
+        self.assertEqual(payload['results'][0]['user'], self.user.pk)
+        self.assertEqual(len(payload['results'][0]['items']), 1)
+        self.assertIsInstance(payload['results'][0]['items'][0], int)
+        # книги участвуют только в сортировке позиций, их колонки не выбираются
+        self.assertFalse(any('"catalog_book"."description"' in sql for sql in queries))
+
+        payload, queries = self.get('/api/orders/?expand=items.book&fields=id,items.quantity,items.book.title')
+        self.assertEqual(payload['results'][-1], {
+            'id': Order.objects.order_by('created_at', 'id').first().pk,
+            'items': [{'book': {'title': 'Книга 0'}, 'quantity': 1}],
+        })
+        # заказы, затем позиции вместе с книгами одним запросом
+        self.assertEqual(len(queries), 2)
+
+
+class BooksCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tolstoy = Author.objects.create(first_name='Лев', last_name='Толстой')
+        self.chekhov = Author.objects.create(first_name='Антон', last_name='Чехов')
+        self.publisher = Publisher.objects.create(name='Эксмо', address='-')
+        self.classic = Category.objects.create(name='Классика', slug='classic')
+        self.drama = Category.objects.create(name='Драма', slug='drama')
+
+    def counts(self):
+        return (
+            Author.objects.get(pk=self.tolstoy.pk).books_count,
+            Author.objects.get(pk=self.chekhov.pk).books_count,
+            Publisher.objects.get(pk=self.publisher.pk).books_count,
+            Category.objects.get(pk=self.classic.pk).books_count,
+            Category.objects.get(pk=self.drama.pk).books_count,
+        )
+
+    def test_counts_follow_books(self):
+        book = make_book(1, author=self.tolstoy, publisher=self.publisher)
+        make_book(2, author=self.tolstoy)
+        self.assertEqual(self.counts(), (2, 0, 1, 0, 0))
+
+        book.categories.add(self.classic, self.drama)
+        self.assertEqual(self.counts(), (2, 0, 1, 1, 1))
+        # remove() категории, которой у книги нет, счетчик не сдвигает
+        book.categories.remove(self.drama)
+        book.categories.remove(self.drama)
+        self.assertEqual(self.counts(), (2, 0, 1, 1, 0))
+
+        book = Book.objects.only('title').get(pk=book.pk)
+        book.author = self.chekhov
+        book.publisher = None
+        book.save()
+        self.assertEqual(self.counts(), (1, 1, 0, 1, 0))
+
+        book.categories.clear()
+        self.assertEqual(self.counts(), (1, 1, 0, 0, 0))
+        self.drama.books.add(book)
+        self.assertEqual(self.counts(), (1, 1, 0, 0, 1))
+        self.drama.books.clear()
+        self.assertEqual(self.counts(), (1, 1, 0, 0, 0))
+
+        book.categories.add(self.classic)
+        book.delete()
+        self.assertEqual(self.counts(), (1, 0, 0, 0, 0))
+
+    def test_rebuild_command(self):
+        make_book(1, author=self.tolstoy).categories.add(self.classic)
+        Author.objects.update(books_count=5)
+        Category.objects.update(books_count=0)
+        call_command('rebuild_book_counts', stdout=StringIO())
+        self.assertEqual(self.counts(), (1, 0, 0, 1, 0))
+
+    def test_api_exposes_counts_without_aggregation(self):
+        make_book(1, author=self.tolstoy).categories.add(self.classic)
+        client = APIClient()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/categories/', HTTP_ACCEPT='application/json')
+        counts = {category['slug']: category['books_count'] for category in response.json()['results']}
+        self.assertEqual(counts, {'classic': 1, 'drama': 0})
+        self.assertFalse(any('GROUP BY' in query['sql'] for query in queries))
+
+        response = client.get(f'/api/authors/{self.tolstoy.pk}/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['books_count'], 1)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            make_book(2, author=self.tolstoy)
+        response = client.get(f'/api/authors/{self.tolstoy.pk}/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['books_count'], 2)
+
+        # Заказ меняет книги (остатки), но не счетчики: ETag автора прежний
+        etag = response['ETag']
+        user = User.objects.create_user(username='buyer')
+        Cart.objects.create(user=user).add_item(Book.objects.get(isbn=f'{2:013d}'), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(user, shipping_address='Самовывоз')
+        response = client.get(f'/api/authors/{self.tolstoy.pk}/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Внутри книги счетчика нет
+        book = client.get('/api/books/', HTTP_ACCEPT='application/json').json()['results'][0]
+        self.assertNotIn('books_count', book['categories_list'][0])
+
+
+CSV_FEED = """ISBN,Title,Author,Publisher,Categories,Price,Stock_Quantity
+978-5-17-000001-0,Война и мир,Лев Толстой,Эксмо,Классика;Роман,500.00,3
+5170000028,Анна Каренина,Лев Толстой,ЭКСМО,Классика,450,
+9785170000034,,Лев Толстой,Эксмо,,1,1
+"""
+
+ONIX_FEED = """<?xml version="1.0" encoding="UTF-8"?>
+<ONIXMessage xmlns="http://ns.editeur.org/onix/3.0/reference" release="3.0">
+  <Header><Sender><SenderName>Эксмо</SenderName></Sender></Header>
+  <Product>
+    <RecordReference>1</RecordReference>
+    <ProductIdentifier><ProductIDType>15</ProductIDType><IDValue>9785170000041</IDValue></ProductIdentifier>
+    <DescriptiveDetail>
+      <TitleDetail><TitleType>01</TitleType><TitleElement><TitleElementLevel>01</TitleElementLevel>
+        <TitleText>Вишневый сад</TitleText></TitleElement></TitleDetail>
+      <Contributor><ContributorRole>A01</ContributorRole>
+        <NamesBeforeKey>Антон</NamesBeforeKey><KeyNames>Чехов</KeyNames></Contributor>
+      <Subject><SubjectSchemeIdentifier>10</SubjectSchemeIdentifier><SubjectHeadingText>Драма</SubjectHeadingText></Subject>
+    </DescriptiveDetail>
+    <CollateralDetail><TextContent><TextType>03</TextType><Text>Пьеса в четырех действиях</Text></TextContent></CollateralDetail>
+    <PublishingDetail><Publisher><PublisherName>Азбука</PublisherName></Publisher></PublishingDetail>
+    <ProductSupply><SupplyDetail>
+      <Stock><OnHand>7</OnHand></Stock>
+      <Price><PriceAmount>320.50</PriceAmount></Price>
+    </SupplyDetail></ProductSupply>
+  </Product>
+</ONIXMessage>
+"""
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_import(self, text, format, batch_size=2):
+        catalog_importer = CatalogImporter(batch_size=batch_size)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = catalog_importer.run(read_records(SimpleUploadedFile('feed', text.encode()), format))
+            catalog_importer.finish()
+        return result
+
+    def test_csv_creates_and_updates_by_isbn(self):
+        versions = get_versions('book', 'category')
+        result = self.run_import(CSV_FEED, 'csv')
+        self.assertEqual((result.rows, result.created, result.updated, result.skipped), (3, 2, 0, 1))
+        self.assertEqual(result.errors, [(3, 'не указано название')])
+
+        war = Book.objects.get(isbn='9785170000010')
+        anna = Book.objects.get(isbn='9785170000029')  # ISBN-10 переведен в ISBN-13
+        self.assertEqual(war.author_id, anna.author_id)
+        self.assertEqual(war.publisher_id, anna.publisher_id)
+        self.assertEqual(anna.stock_quantity, 0)
+        self.assertEqual(sorted(war.categories.values_list('name', flat=True)), ['Классика', 'Роман'])
+        self.assertEqual(Author.objects.get().books_count, 2)
+        self.assertEqual(Category.objects.get(name='Классика').books_count, 2)
+        self.assertEqual(search.search_book_ids('каренина'), [anna.pk])
+        self.assertNotEqual(get_versions('book', 'category'), versions)
+
+        # Повторная загрузка обновляет книги, категории заменяются
+        slug, created_at = war.slug, war.created_at
+        result = self.run_import(CSV_FEED.replace('500.00', '550.00').replace('Классика;Роман', 'Роман'), 'csv')
+        self.assertEqual((result.created, result.updated), (0, 2))
+        war.refresh_from_db()
+        self.assertEqual(war.price, Decimal('550.00'))
+        self.assertEqual((war.slug, war.created_at), (slug, created_at))
+        self.assertGreater(war.updated_at, created_at)
+        self.assertEqual(list(war.categories.values_list('name', flat=True)), ['Роман'])
+        self.assertEqual(Category.objects.get(name='Классика').books_count, 1)
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_json_streams_array_and_lines(self):
+        records = [
+            {'isbn': f'97851700001{index:02d}', 'title': f'Книга {index}', 'author': 'Антон Чехов', 'price': 100.5}
+            for index in range(5)
+        ]
+        array = json.dumps(records, ensure_ascii=False, indent=2)
+        lines = '\n'.join(json.dumps(record, ensure_ascii=False) for record in records)
+        for text in (array, lines):
+            # Куски меньше одного объекта: объекты собираются из нескольких чтений
+            with mock.patch.object(importer, 'CHUNK_SIZE', 16):
+                parsed = list(read_records(SimpleUploadedFile('feed', text.encode()), 'json'))
+            self.assertEqual([record['isbn'] for record in parsed], [record['isbn'] for record in records])
+        self.assertEqual(parsed[0]['price'], Decimal('100.5'))
+
+        result = self.run_import(array, 'json')
+        self.assertEqual(result.created, 5)
+        self.assertEqual(Author.objects.get().books_count, 5)
+
+    def test_onix(self):
+        self.run_import(ONIX_FEED, 'onix')
+        book = Book.objects.select_related('author', 'publisher').get()
+        self.assertEqual(
+            (book.isbn, book.title, str(book.author), book.publisher.name, book.price, book.stock_quantity),
+            ('9785170000041', 'Вишневый сад', 'Чехов Антон', 'Азбука', Decimal('320.50'), 7),
+        )
+        self.assertEqual(book.description, 'Пьеса в четырех действиях')
+        self.assertEqual(list(book.categories.values_list('name', flat=True)), ['Драма'])
+
+    def test_slug_collisions_do_not_abort_import(self):
+        make_book(1, slug='voina-i-mir')
+        make_book(2, slug='anna')
+        make_book(3, slug='anna-9785170000003')
+        catalog_importer = CatalogImporter(batch_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = catalog_importer.run([
+                {'isbn': f'{1:013d}', 'title': 'Война и мир', 'slug': 'other', 'price': '500'},
+                {'isbn': '9785170000001', 'title': 'Война и мир', 'slug': 'voina-i-mir', 'price': '500'},
+                {'isbn': '9785170000002', 'title': 'Новая', 'slug': 'novaya', 'price': '100'},
+                {'isbn': '9785170000004', 'title': 'Новая', 'slug': 'novaya', 'price': '100'},
+                {'isbn': '9785170000003', 'title': 'Анна', 'slug': 'anna', 'price': '450'},
+            ])
+            catalog_importer.finish()
+
+        self.assertEqual((result.created, result.updated, result.skipped), (3, 1, 1))
+        self.assertEqual(result.errors, [(5, "slug 'anna' занят другой книгой")])
+        slugs = dict(Book.objects.values_list('isbn', 'slug'))
+        self.assertEqual(slugs[f'{1:013d}'], 'voina-i-mir')
+        self.assertEqual(slugs['9785170000001'], 'voina-i-mir-9785170000001')
+        self.assertEqual(slugs['9785170000002'], 'novaya')
+        self.assertEqual(slugs['9785170000004'], 'novaya-9785170000004')
+
+    def test_category_spelling_variants_share_one_link(self):
+        Category.objects.create(name='Классика', slug='classic')
+        catalog_importer = CatalogImporter(batch_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = catalog_importer.run([
+                {'isbn': '9785170000001', 'title': 'Война и мир', 'price': '500',
+                 'categories': 'Классика;классика;Роман'},
+                {'isbn': '9785170000002', 'title': 'Анна Каренина', 'price': '450',
+                 'categories': 'роман;Роман '},
+            ])
+            catalog_importer.finish()
+
+        self.assertEqual((result.created, result.errors), (2, []))
+        war = Book.objects.get(isbn='9785170000001')
+        self.assertEqual(sorted(war.categories.values_list('name', flat=True)), ['Классика', 'Роман'])
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Category.objects.get(name='Роман').books_count, 2)
+
+    @override_settings(SEARCH_BACKEND='memory')
+    def test_other_processes_see_import(self):
+        # Индексы другого процесса: сигналы и finish() до них не доходят,
+        # изменения видны через версии 'search' и 'suggest'
+        other_search = search.MemoryBackend()
+        other_search.rebuild()
+        other_suggest = suggest.SuggestIndex()
+        other_suggest.build()
+
+        self.run_import(CSV_FEED, 'csv')
+
+        anna = Book.objects.get(isbn='9785170000029')
+        self.assertEqual(other_search.search('каренина'), [anna.pk])
+        self.assertEqual([item['id'] for item in other_suggest.suggest('анна')], [anna.pk])
+
+    def test_command_and_admin_endpoint(self):
+        out = StringIO()
+        with tempfile.NamedTemporaryFile(suffix='.csv') as feed:
+            feed.write(CSV_FEED.encode())
+            feed.flush()
+            call_command('import_catalog', feed.name, stdout=out, stderr=StringIO())
+        self.assertIn('создано 2', out.getvalue())
+
+        admin = User.objects.create_user(username='admin', password='password123', role='admin')
+        self.client.force_login(admin)
+        upload = SimpleUploadedFile('feed.xml', ONIX_FEED.encode())
+        response = self.client.post('/admin/books/import/', {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result'].created, 1)
+        self.assertTrue(Book.objects.filter(isbn='9785170000041').exists())
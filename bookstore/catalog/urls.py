@@ -34,6 +34,7 @@ urlpatterns = [
     path('admin/statistics/', views.admin_statistics, name='admin_statistics'),
     path('admin/books/', views.admin_books, name='admin_books'),
     path('admin/books/create/', views.admin_book_create, name='admin_book_create'),
+    path('admin/books/import/', views.admin_book_import, name='admin_book_import'),
     path('admin/books/<int:book_id>/', views.admin_book_detail, name='admin_book_detail'),
     path('admin/books/<int:book_id>/delete/', views.admin_book_delete, name='admin_book_delete'),
     path('admin/orders/', views.admin_orders, name='admin_orders'),
@@ -81,6 +82,8 @@ urlpatterns = [
     # Books
     path('api/books/', views.BookListView.as_view(), name='book-list'),
     path('api/books/<int:pk>/', views.BookDetailView.as_view(), name='book-detail'),
+    path('api/books/<int:pk>/related/', views.RelatedBooksView.as_view(), name='book-related'),
+    path('api/books/<int:pk>/also-bought/', views.AlsoBoughtView.as_view(), name='book-also-bought'),
     
     # Categories
     path('api/categories/', views.CategoryListView.as_view(), name='category-list'),
@@ -100,4 +103,5 @@ urlpatterns = [
     
     # Search
     path('api/search/', views.SearchAPIView.as_view(), name='search'),
+    path('api/search/suggest/', views.SuggestAPIView.as_view(), name='search-suggest'),
 ]
@@ -4,33 +4,38 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, Prefetch, Sum
-from django.core.paginator import Paginator
-from .models import Book, Category, Author, Order, OrderItem, Cart, CartItem
-from .forms import LoginForm, RegisterForm, UserProfileForm, OrderForm, BookForm, CategoryForm, AuthorForm, PublisherForm
+from django.db.models import Q
+from .models import Book, Category, Author, Order, Cart, CartItem, LOW_STOCK_THRESHOLD
+from .forms import LoginForm, RegisterForm, UserProfileForm, OrderForm, BookForm, CategoryForm, AuthorForm, PublisherForm, CatalogImportForm
+from .importer import CatalogImportError, CatalogImporter, detect_format, read_records
+from .search import key_prefix_lookup, search_books
+from . import copurchase, related, suggest
+from .stats import dashboard_stats
+from .conditional import ConditionalGetMixin, catalog_condition
+from .fragments import FragmentJSONRenderer, FragmentListMixin, serialize_books
+from .cache import get_cart_badge, get_home_categories, get_new_books, get_popular_books
+from .pagination import CachedCountPaginator, KeysetPagination
+from .services import CheckoutError, InsufficientStockError, place_order
 from django.contrib.auth.views import LoginView
 from django.contrib.admin.models import LogEntry
 from . serializers import *
 from rest_framework.response import Response
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.views import APIView
 from rest_framework import generics, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.authtoken.models import Token
-from django.utils import timezone
-from datetime import timedelta
 
 
 def home(request):
-    # Новые книги
-    new_books = Book.objects.order_by('-created_at')[:8]
+    # Блоки главной страницы берутся из кэша (см. cache.py)
+    new_books = get_new_books()
     
     # Популярные книги (по количеству заказов)
-    popular_books = Book.objects.annotate(
-        order_count=Count('order_items')
-    ).order_by('-order_count')[:8]
+    popular_books = get_popular_books()
     
     # Категории с количеством книг
-    categories = Category.objects.annotate(book_count=Count('books'))
+    categories = get_home_categories()
     
     context = {
         'new_books': new_books,
@@ -39,26 +44,15 @@ def home(request):
     }
     return render(request, 'catalog/home.html', context)
 
+@catalog_condition('book', 'author', 'category')
 def book_list(request):
     books = Book.objects.all()
     
     # Поиск
     query = request.GET.get('search')
     if query:
-        # Базовый поиск (без учета регистра)
-        books = books.filter(
-            Q(title__icontains=query) | 
-            Q(author__first_name__icontains=query) |
-            Q(author__last_name__icontains=query)
-        )
-        # с учетом регистра
-        if query and query[0].islower():
-            query_capitalized = query.capitalize()
-            books = books | Book.objects.filter(
-                Q(title__icontains=query_capitalized) | 
-                Q(author__first_name__icontains=query_capitalized) |
-                Q(author__last_name__icontains=query_capitalized)
-            )
+        # Поиск по индексу, результаты отсортированы по релевантности
+        books = search_books(query, books)
     # Фильтрация по автору
     author_id = request.GET.get('author')
     if author_id:
@@ -73,8 +67,8 @@ def book_list(request):
     if max_price:
         books = books.filter(price__lte=max_price)
     
-    # Пагинация
-    paginator = Paginator(books, 12)
+    # Пагинация (количество книг кэшируется, см. CachedCountPaginator)
+    paginator = CachedCountPaginator(books, 12)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
@@ -89,24 +83,30 @@ def book_list(request):
     }
     return render(request, 'catalog/book_list.html', context)
 
+@catalog_condition('book', 'author', 'category', 'publisher', 'recommendation')
 def book_detail(request, book_id):
     book = get_object_or_404(Book, id=book_id)
-    related_books = Book.objects.filter(
-        categories__in=book.categories.all()
-    ).exclude(id=book.id).distinct()[:4]
+    # Похожие книги предрасчитаны (см. related.py); пока их нет - книги из тех же категорий
+    related_books = list(related.related_books(book))
+    if not related_books:
+        related_books = Book.objects.filter(
+            categories__in=book.categories.all()
+        ).exclude(id=book.id).distinct()[:4]
     
     context = {
         'book': book,
         'related_books': related_books,
+        'also_bought': copurchase.also_bought(book),
     }
     return render(request, 'catalog/book_detail.html', context)
 
+@catalog_condition('book', 'author', 'category')
 def category_books(request, slug):
     category = get_object_or_404(Category, slug=slug)
     books = Book.objects.filter(categories=category)
     
-    # Пагинация
-    paginator = Paginator(books, 12)
+    # Пагинация (количество книг кэшируется, см. CachedCountPaginator)
+    paginator = CachedCountPaginator(books, 12)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
@@ -154,8 +154,7 @@ def profile(request):
         form = UserProfileForm(instance=request.user)
     
     orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    cart = Cart.objects.filter(user=request.user)
-    cartItems = cart[0].total_items
+    cartItems = get_cart_badge(request.user.pk)
     
     context = {
         'form': form,
@@ -165,11 +164,6 @@ def profile(request):
     return render(request, 'catalog/profile.html', context)
 
 
-from django.shortcuts import get_object_or_404, redirect, render
-from django.contrib import messages
-from django.contrib.auth.decorators import login_required
-from .models import Cart, CartItem, Book
-
 @login_required
 def cart_view(request):
     try:
@@ -180,7 +174,7 @@ def cart_view(request):
     if request.method == 'POST':
         # Обработка очистки корзины
         if 'clear_cart' in request.POST:
-            cart.items.all().delete()
+            cart.clear()
             messages.success(request, 'Корзина очищена')
             return redirect('cart')
         
@@ -190,8 +184,11 @@ def cart_view(request):
         
         if book_id:
             book = get_object_or_404(Book, id=book_id)
-            cart.add_item(book, quantity)
-            messages.success(request, f'Книга "{book.title}" добавлена в корзину!')
+            try:
+                cart.add_item(book, quantity)
+                messages.success(request, f'Книга "{book.title}" добавлена в корзину!')
+            except InsufficientStockError:
+                messages.error(request, f'Книги "{book.title}" недостаточно на складе')
         
         return redirect('cart')
     
@@ -206,12 +203,14 @@ def update_cart(request, item_id):
     
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
+        try:
+            cart_item.cart.update_item_quantity(cart_item.book_id, quantity)
+        except InsufficientStockError:
+            messages.error(request, 'Недостаточно товара на складе')
+            return redirect('cart')
         if quantity <= 0:
-            cart_item.delete()
             messages.success(request, 'Товар удален из корзины')
         else:
-            cart_item.quantity = quantity
-            cart_item.save()
             messages.success(request, 'Количество обновлено')
     
     return redirect('cart')
@@ -219,7 +218,7 @@ def update_cart(request, item_id):
 @login_required
 def remove_from_cart(request, item_id):
     cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    cart_item.delete()
+    cart_item.cart.remove_item(cart_item.book_id)
     messages.success(request, 'Товар удален из корзины')
     return redirect('cart')
 
@@ -252,31 +251,16 @@ def checkout(request):
             else:
                 shipping_address = 'Самовывоз'
             
-            # Создаем заказ
-            order = Order.objects.create(
-                user=request.user,
-                delivery_method=delivery_method,
-                delivery_cost=delivery_cost,
-                total_price=cart.total_price() + delivery_cost,
-                shipping_address=shipping_address,
-                total_amount=cart.total_price() + delivery_cost
-            )
-            
-            # Создаем позиции заказа
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    book=cart_item.book,
-                    quantity=cart_item.quantity,
-                    price=cart_item.book.price
+            try:
+                order = place_order(
+                    request.user,
+                    shipping_address=shipping_address,
+                    delivery_method=delivery_method,
+                    delivery_cost=delivery_cost,
                 )
-                
-                # Обновляем количество на складе
-                cart_item.book.stock_quantity -= cart_item.quantity
-                cart_item.book.save()
-            
-            # Очищаем корзину
-            cart.items.all().delete()
+            except CheckoutError as e:
+                messages.error(request, str(e))
+                return redirect('cart')
             
             messages.success(request, f'Заказ #{order.id} успешно создан!')
             return redirect('order_detail', order_id=order.id)
@@ -347,9 +331,6 @@ def admin_required(view_func):
     return _wrapped_view
 
 def admin_statistics(request):
-    # Статистика за последние 30 дней
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-
     recent_actions = []
     log_entries = LogEntry.objects.select_related('user', 'content_type').order_by('-action_time')[:10]
     
@@ -379,49 +360,32 @@ def admin_statistics(request):
             'action_flag': action.action_flag,
             'object_name': object_name
         })
-    # Данные для графиков
-    # График продаж по дням за последние 7 дней
-    sales_data = []
-    dates = []
-    for i in range(6, -1, -1):
-        date = timezone.now() - timedelta(days=i)
-        daily_sales = Order.objects.filter(
-            created_at__date=date.date(),
-            status='delivered'
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        sales_data.append(float(daily_sales))
-        dates.append(date.strftime('%d.%m'))
-    
-
-    
-    popular_categories = Category.objects.annotate(
-        book_count=Count('books')
-    ).order_by('-book_count')[:5]
+    popular_categories = Category.objects.order_by('-books_count')[:5]
     
+    # Все агрегаты панели - несколькими сгруппированными запросами
+    stats = dashboard_stats()
     
     context = {
-        'total_books': Book.objects.count(),
-        'total_orders': Order.objects.count(),
-        'total_users': User.objects.count(),
-        'total_revenue': Order.objects.filter(status='delivered').aggregate(Sum('total_amount'))['total_amount__sum'] or 0,
+        'total_books': stats.total_books,
+        'total_orders': stats.total_orders,
+        'total_users': stats.total_users,
+        'total_revenue': stats.total_revenue,
         
-        'recent_orders': Order.objects.filter(created_at__gte=thirty_days_ago).count(),
-        'recent_revenue': Order.objects.filter(created_at__gte=thirty_days_ago, status='delivered')
-                         .aggregate(Sum('total_amount'))['total_amount__sum'] or 0,
-        'new_users': User.objects.filter(date_joined__gte=thirty_days_ago).count(),
+        'recent_orders': stats.recent_orders,
+        'recent_revenue': stats.recent_revenue,
+        'new_users': stats.new_users,
         
-        'popular_books': Book.objects.annotate(order_count=Count('order_items'))
-                       .order_by('-order_count')[:5],
+        'popular_books': Book.objects.order_by('-order_count')[:5],
         
-        'order_stats': Order.objects.values('status').annotate(count=Count('id')),
+        'order_stats': stats.order_stats,
         
         'latest_orders': Order.objects.select_related('user').order_by('-created_at')[:4],
         
-        'low_stock_books': Book.objects.filter(stock_quantity__lt=10).order_by('stock_quantity')[:5],
+        'low_stock_books': Book.objects.filter(stock_quantity__lt=LOW_STOCK_THRESHOLD).order_by('stock_quantity')[:5],
         
         # Данные для графиков
-        'sales_data': sales_data,
-        'sales_dates': dates,
+        'sales_data': stats.sales_data,
+        'sales_dates': stats.sales_dates,
         'popular_categories': popular_categories,
 
         'recent_actions': recent_actions,
@@ -439,16 +403,14 @@ def admin_books(request):
     low_stock = request.GET.get('low_stock', '')
     
     if search:
-        books = books.filter(Q(title__icontains=search) | Q(isbn__icontains=search))
-    if search and search[0].islower():
-            search_capitalized = search.capitalize()
-            books = books | Book.objects.filter(Q(title__icontains=search_capitalized) | Q(isbn__icontains=search_capitalized))
+        # Начало названия по нормализованному ключу или точный ISBN - оба по индексу
+        books = books.filter(key_prefix_lookup('search_key', search) | Q(isbn=search.strip()))
     if category:
         books = books.filter(categories__id=category)
     if author:
         books = books.filter(author__id=author)
     if low_stock:
-        books = books.filter(stock_quantity__lt=10)
+        books = books.filter(stock_quantity__lt=LOW_STOCK_THRESHOLD)
     
     categories = Category.objects.all()
     authors = Author.objects.all()
@@ -502,6 +464,38 @@ def admin_book_create(request):
     
     return render(request, 'admin/book_create.html', context)
 
+@admin_required
+def admin_book_import(request):
+    # Файл обрабатывается прямо в запросе; большие выгрузки лучше
+    # загружать командой import_catalog
+    result = None
+    if request.method == 'POST':
+        form = CatalogImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            importer = CatalogImporter()
+            try:
+                format = form.cleaned_data['format'] or detect_format(upload.name)
+                result = importer.run(read_records(upload, format))
+            except CatalogImportError as exc:
+                form.add_error(None, str(exc))
+            finally:
+                importer.finish()
+            if result is not None:
+                messages.success(
+                    request,
+                    f'Импорт завершен: создано {result.created}, обновлено {result.updated}, пропущено {result.skipped}',
+                )
+    else:
+        form = CatalogImportForm()
+
+    context = {
+        'form': form,
+        'result': result,
+    }
+
+    return render(request, 'admin/book_import.html', context)
+
 @admin_required
 def admin_book_delete(request, book_id):
     book = get_object_or_404(Book, id=book_id)
@@ -591,7 +585,7 @@ def admin_users(request):
 
 @admin_required
 def admin_categories(request):
-    categories = Category.objects.annotate(book_count=Count('books'))
+    categories = Category.objects.all()
     
     if request.method == 'POST':
         form = CategoryForm(request.POST)
@@ -612,7 +606,6 @@ def admin_categories(request):
 @admin_required
 def admin_category_delete(request, category_id):
     category = get_object_or_404(Category, id=category_id)
-    category.book_count = category.books.count()  # Подсчитываем количество книг
     
     if request.method == 'POST':
         category.delete()
@@ -650,7 +643,7 @@ def admin_authors(request):
         return redirect('admin_authors')
     
     # GET запрос - показать список авторов
-    authors = Author.objects.annotate(book_count=Count('books'))
+    authors = Author.objects.all()
     context = {'authors': authors}
     return render(request, 'admin/authors.html', context)
 
@@ -668,9 +661,6 @@ def admin_author_delete(request, author_id):
         messages.success(request, 'Автор удален!')
         return redirect('admin_authors')
     
-    # Аннотируем количество книг для отображения в шаблоне
-    author.book_count = author.books.count()
-    
     context = {
         'author': author,
     }
@@ -701,17 +691,16 @@ def admin_publishers(request):
         return redirect('admin_publishers')
     
     # GET запрос - показать список издательств
-    publishers = Publisher.objects.annotate(book_count=Count('books'))
+    publishers = Publisher.objects.all()
     context = {'publishers': publishers}
     return render(request, 'admin/publishers.html', context)
 
 @admin_required
 def admin_publisher_delete(request, publisher_id):
     publisher = get_object_or_404(Publisher, id=publisher_id)
-    publisher.book_count = publisher.books.count()
     
     if request.method == 'POST':
-        if publisher.book_count > 0:
+        if publisher.books.exists():
             messages.error(request, 'Нельзя удалить издательство с книгами!')
             return redirect('admin_publishers')
         publisher.delete()
@@ -722,6 +711,46 @@ def admin_publisher_delete(request, publisher_id):
 
 
 # API
+class QueryPlanMixin:
+    """Подгружает связи, которые объявлены в сериализаторе (см. serializers.QueryPlanMixin).
+
+    Если клиент сократил ответ через ?fields= или ?expand=, подгружаются
+    только связи и колонки выбранных полей.
+    """
+
+    # Колонки, которые нужны самому представлению, а не сериализатору
+    required_columns = ()
+
+    def get_required_columns(self):
+        columns = list(self.required_columns)
+        ordering = self.get_keyset_ordering() if hasattr(self, 'get_keyset_ordering') else None
+        if ordering:
+            # Значение поля сортировки попадает в курсор
+            columns.append(ordering.lstrip('-'))
+        return columns
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return self.get_serializer().plan_queryset(queryset, self.get_required_columns())
+
+
+class ValuesListMixin:
+    """GET-список через values_serializer_class (строки .values() вместо объектов).
+
+    Создание и формы браузерного API по-прежнему используют serializer_class.
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.values_serializer_class(context=self.get_serializer_context())
+        queryset = serializer.setup_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        data = serializer.serialize(page if page is not None else queryset)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
 class LoginView(APIView):
     permission_classes = [permissions.AllowAny]
     
@@ -763,22 +792,21 @@ class RegisterView(generics.CreateAPIView):
         }, status=status.HTTP_201_CREATED)
     
 
-class BookListView(generics.ListCreateAPIView):
-    queryset = Book.objects.select_related('author', 'publisher').prefetch_related('categories')
+class BookListView(ConditionalGetMixin, FragmentListMixin, QueryPlanMixin, generics.ListCreateAPIView):
+    queryset = Book.objects.all()
     serializer_class = BookSerializer
+    values_serializer_class = BookValuesSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
+    renderer_classes = [FragmentJSONRenderer, BrowsableAPIRenderer]
+    sort_fields = ['title', 'price', 'created_at', '-price', '-created_at']
     
     def get_queryset(self):
         queryset = super().get_queryset()
         
         search_query = self.request.GET.get('q')
         if search_query:
-            queryset = queryset.filter(
-                Q(title__icontains=search_query) |
-                Q(author__first_name__icontains=search_query) |
-                Q(author__last_name__icontains=search_query) |
-                Q(description__icontains=search_query)
-            )
+            queryset = search_books(search_query, queryset)
         
         category = self.request.GET.get('category')
         if category:
@@ -795,47 +823,80 @@ class BookListView(generics.ListCreateAPIView):
         if max_price:
             queryset = queryset.filter(price__lte=max_price)
         
-        sort_by = self.request.GET.get('sort', 'title')
-        if sort_by in ['title', 'price', 'created_at', '-price', '-created_at']:
+        # При поиске по умолчанию сохраняем сортировку по релевантности
+        sort_by = self.request.GET.get('sort', None if search_query else 'title')
+        if sort_by in self.sort_fields:
             queryset = queryset.order_by(sort_by)
         
         return queryset
+    
+    def get_keyset_ordering(self):
+        sort_by = self.request.GET.get('sort', None if self.request.GET.get('q') else 'title')
+        return sort_by if sort_by in self.sort_fields else None
 
-class BookDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Book.objects.select_related('author', 'publisher').prefetch_related('categories')
+class BookDetailView(ConditionalGetMixin, QueryPlanMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+class RelatedBooksView(ConditionalGetMixin, FragmentListMixin, QueryPlanMixin, generics.ListAPIView):
+    """Похожие книги из предрасчитанной таблицы (см. related.py)"""
+    etag_namespaces = ('book', 'author', 'category', 'publisher', 'recommendation')
+    serializer_class = BookSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = None
+    renderer_classes = [FragmentJSONRenderer, BrowsableAPIRenderer]
+
+    def get_queryset(self):
+        book = get_object_or_404(Book, pk=self.kwargs['pk'])
+        return related.related_books(book, limit=related.LIMIT)
+
+class AlsoBoughtView(RelatedBooksView):
+    """Книги, которые покупают вместе с этой (см. copurchase.py)"""
+
+    def get_queryset(self):
+        book = get_object_or_404(Book, pk=self.kwargs['pk'])
+        return copurchase.also_bought(book, limit=copurchase.TOP_K)
+
 # Category Views
-class CategoryListView(generics.ListCreateAPIView):
-    queryset = Category.objects.annotate(books_count=Count('books'))
+class CategoryListView(ConditionalGetMixin, ValuesListMixin, generics.ListCreateAPIView):
+    etag_namespaces = ('category',)
+    queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    values_serializer_class = CategoryValuesSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Category.objects.annotate(books_count=Count('books'))
+class CategoryDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    etag_namespaces = ('category',)
+    queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 # Author Views
-class AuthorListView(generics.ListCreateAPIView):
-    queryset = Author.objects.annotate(books_count=Count('books'))
+class AuthorListView(ConditionalGetMixin, ValuesListMixin, generics.ListCreateAPIView):
+    etag_namespaces = ('author',)
+    queryset = Author.objects.all()
     serializer_class = AuthorSerializer
+    values_serializer_class = AuthorValuesSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class AuthorDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Author.objects.annotate(books_count=Count('books'))
+class AuthorDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    etag_namespaces = ('author',)
+    queryset = Author.objects.all()
     serializer_class = AuthorSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 # Publisher Views
-class PublisherListView(generics.ListCreateAPIView):
-    queryset = Publisher.objects.annotate(books_count=Count('books'))
+class PublisherListView(ConditionalGetMixin, ValuesListMixin, generics.ListCreateAPIView):
+    etag_namespaces = ('publisher',)
+    queryset = Publisher.objects.all()
     serializer_class = PublisherSerializer
+    values_serializer_class = PublisherValuesSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class PublisherDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Publisher.objects.annotate(books_count=Count('books'))
+class PublisherDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    etag_namespaces = ('publisher',)
+    queryset = Publisher.objects.all()
     serializer_class = PublisherSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
@@ -843,15 +904,23 @@ class PublisherDetailView(generics.RetrieveUpdateDestroyAPIView):
 class CartViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
     
+    def get_queryset(self):
+        return CartSerializer.setup_queryset(Cart.objects.filter(user=self.request.user))
+    
+    def cart_response(self, cart):
+        """Сериализует корзину, заново загрузив ее вместе со всеми позициями"""
+        cart = self.get_queryset().get(pk=cart.pk)
+        return Response(CartSerializer(cart).data)
+    
     def list(self, request):
         """Получить корзину текущего пользователя"""
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart, created = self.get_queryset().get_or_create(user=request.user)
         serializer = CartSerializer(cart)
         return Response(serializer.data)
     
     def retrieve(self, request, pk=None):
         """Получить корзину по ID (для текущего пользователя)"""
-        cart = get_object_or_404(Cart, id=pk, user=request.user)
+        cart = get_object_or_404(self.get_queryset(), id=pk)
         serializer = CartSerializer(cart)
         return Response(serializer.data)
     
@@ -864,30 +933,19 @@ class CartViewSet(viewsets.ViewSet):
         
         try:
             book = Book.objects.get(id=book_id)
-            if book.stock_quantity < quantity:
-                return Response(
-                    {'error': 'Недостаточно товара на складе'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart, 
-                book=book,
-                defaults={'quantity': quantity}
-            )
-            
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
-            
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
+            cart.add_item(book, quantity)
+            return self.cart_response(cart)
             
         except Book.DoesNotExist:
             return Response(
                 {'error': 'Книга не найдена'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        except InsufficientStockError:
+            return Response(
+                {'error': 'Недостаточно товара на складе'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
     
     @action(detail=False, methods=['post'])
     def update_item(self, request):
@@ -897,21 +955,17 @@ class CartViewSet(viewsets.ViewSet):
         quantity = int(request.data.get('quantity', 1))
         
         try:
-            cart_item = CartItem.objects.get(cart=cart, book_id=book_id)
-            if quantity <= 0:
-                cart_item.delete()
-            else:
-                cart_item.quantity = quantity
-                cart_item.save()
-            
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
-            
-        except CartItem.DoesNotExist:
+            if not cart.update_item_quantity(book_id, quantity):
+                return Response(
+                    {'error': 'Товар не найден в корзине'}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+        except InsufficientStockError:
             return Response(
-                {'error': 'Товар не найден в корзине'}, 
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Недостаточно товара на складе'}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
+        return self.cart_response(cart)
     
     @action(detail=False, methods=['post'])
     def remove_item(self, request):
@@ -919,84 +973,53 @@ class CartViewSet(viewsets.ViewSet):
         cart = get_object_or_404(Cart, user=request.user)
         book_id = request.data.get('book_id')
         
-        try:
-            cart_item = CartItem.objects.get(cart=cart, book_id=book_id)
-            cart_item.delete()
-            
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
-            
-        except CartItem.DoesNotExist:
+        if not cart.remove_item(book_id):
             return Response(
                 {'error': 'Товар не найден в корзине'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        return self.cart_response(cart)
     
     @action(detail=False, methods=['post'])
     def clear(self, request):
         """Очистить корзину"""
         cart = get_object_or_404(Cart, user=request.user)
-        cart.items.all().delete()
+        cart.clear()
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return self.cart_response(cart)
 
 # Order Views
-class OrderListView(generics.ListCreateAPIView):
+class OrderListView(QueryPlanMixin, generics.ListCreateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).prefetch_related(
-            Prefetch('items', queryset=OrderItem.objects.select_related('book'))
-        ).order_by('-created_at')
+        return Order.objects.filter(user=self.request.user).order_by('-created_at')
+    
+    def get_keyset_ordering(self):
+        return '-created_at'
     
     def perform_create(self, serializer):
-        cart = get_object_or_404(Cart, user=self.request.user)
-        
-        if cart.items.count() == 0:
-            raise serializers.ValidationError("Корзина пуста")
-        
-        # Проверяем наличие товаров
-        for item in cart.items.all():
-            if item.book.stock_quantity < item.quantity:
-                raise serializers.ValidationError(
-                    f"Недостаточно товара: {item.book.title}"
-                )
-        
-        # Создаем заказ
-        order = serializer.save(
-            user=self.request.user,
-            total_amount=cart.total_price
-        )
-        
-        # Создаем позиции заказа и обновляем склад
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                book=cart_item.book,
-                quantity=cart_item.quantity,
-                price=cart_item.book.price
+        try:
+            serializer.instance = place_order(
+                self.request.user,
+                shipping_address=serializer.validated_data.get('shipping_address', ''),
             )
-            # Обновляем склад
-            cart_item.book.stock_quantity -= cart_item.quantity
-            cart_item.book.save()
-        
-        # Очищаем корзину
-        cart.items.all().delete()
+        except CheckoutError as e:
+            raise serializers.ValidationError(str(e))
 
-class OrderDetailView(generics.RetrieveUpdateDestroyAPIView):
+class OrderDetailView(QueryPlanMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).prefetch_related(
-            Prefetch('items', queryset=OrderItem.objects.select_related('book'))
-        )
+        return Order.objects.filter(user=self.request.user)
 
 # поиск
 class SearchAPIView(APIView):
     permission_classes = [permissions.AllowAny]
+    renderer_classes = [FragmentJSONRenderer, BrowsableAPIRenderer]
     
     def get(self, request):
         query = request.GET.get('q', '')
@@ -1005,16 +1028,30 @@ class SearchAPIView(APIView):
             return Response({'error': 'Query parameter "q" is required'}, 
                           status=status.HTTP_400_BAD_REQUEST)
         
-        books = Book.objects.filter(
-            Q(title__icontains=query) |
-            Q(author__first_name__icontains=query) |
-            Q(author__last_name__icontains=query) |
-            Q(description__icontains=query)
-        )[:20]
+        books = search_books(query, BookSerializer.setup_queryset(Book.objects.all()))[:20]
         
-        serializer = BookSerializer(books, many=True)
+        results = serialize_books(books, BookSerializer)
         return Response({
             'query': query,
-            'results': serializer.data,
-            'count': books.count()
-        })
\ No newline at end of file
+            'results': results,
+            'count': len(results)
+        })
+
+class SuggestAPIView(APIView):
+    """Подсказки по префиксу названия книги или имени автора"""
+    # Эндпоинт публичный, сессия и токен не нужны
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    max_limit = 50
+
+    def get(self, request):
+        query = request.GET.get('q', '')
+        try:
+            limit = min(max(int(request.GET.get('limit', 10)), 1), self.max_limit)
+        except ValueError:
+            limit = 10
+
+        return Response({
+            'query': query,
+            'results': suggest.index.suggest(query, limit),
+        })